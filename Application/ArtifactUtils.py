@@ -0,0 +1,153 @@
+# This Python file uses the following encoding: utf-8
+# Offline model artifacts: a manifest mapping each HuggingFace model id the application uses to a local copy.
+#
+# prefetch.py downloads every artifact on a connected machine into the artifacts folder and records each file's size
+# and SHA-256 in manifest.json. Copy the folder to an offline machine and the model loaders read the local copies
+# directly: a model id with a manifest entry never goes through the HuggingFace cache, so there are no ETag probes
+# or download attempts (and no network timeouts) at startup. Ids without an entry load as before.
+#
+# Each file is checked against its recorded SHA-256 the first time its model is loaded. Files that passed are noted
+# with their size and modification time in verified.json, so later startups only hash files that have changed.
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from SettingsUtils import settings
+
+MANIFEST_NAME = "manifest.json"
+VERIFIED_NAME = "verified.json"
+
+_manifest = None
+_manifest_lock = threading.Lock()
+_verified = set() # model ids whose files have been checked in this process
+_verify_lock = threading.Lock()
+
+
+def artifactsDir():
+    return Path(settings["artifacts"]["dir"])
+
+
+def loadManifest():
+    '''Returns the manifest's artifact entries (model id -> entry), reading the manifest file once'''
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            path = artifactsDir() / MANIFEST_NAME
+            _manifest = {}
+            if path.exists():
+                try:
+                    with open(path, encoding="utf-8") as manifest_file:
+                        _manifest = json.load(manifest_file)["artifacts"]
+                except (OSError, ValueError, KeyError) as error:
+                    print(f"Could not read artifact manifest {path}, models will be loaded online: {error}")
+        return _manifest
+
+
+def resolveArtifact(model_id, default=None):
+    '''
+    Returns the local folder holding model_id when the manifest has an entry for it, otherwise default (model_id
+    itself if default is not given), which loaders treat as before. Entries whose files are missing, have the wrong
+    size or do not match their checksum raise FileNotFoundError rather than quietly going online or loading a
+    corrupted file; run prefetch.py again to repair them.
+    '''
+    entry = loadManifest().get(model_id)
+    if entry is None:
+        return model_id if default is None else default
+
+    directory = artifactsDir() / entry["path"]
+    with _verify_lock:
+        if model_id not in _verified:
+            verifyEntry(model_id, entry)
+            _verified.add(model_id)
+    return str(directory)
+
+
+def verifyEntry(model_id, entry):
+    '''Checks the files of one manifest entry, hashing only those verified.json does not list as unchanged'''
+    directory = artifactsDir() / entry["path"]
+    verified_path = artifactsDir() / VERIFIED_NAME
+    verified = {}
+    if verified_path.exists():
+        try:
+            with open(verified_path, encoding="utf-8") as verified_file:
+                verified = json.load(verified_file)
+        except (OSError, ValueError):
+            pass
+
+    changed = False
+    for name, file_entry in entry["files"].items():
+        path = directory / name
+        if not path.is_file() or path.stat().st_size != file_entry["size"]:
+            raise FileNotFoundError(f"Local artifact {path} for {model_id} is missing or incomplete. "
+                                    f"Run prefetch.py on a connected machine and copy {artifactsDir()} again.")
+
+        key = path.relative_to(artifactsDir()).as_posix()
+        stat = path.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns, file_entry["sha256"]]
+        if verified.get(key) == stamp:
+            continue
+        if fileDigest(path) != file_entry["sha256"]:
+            raise FileNotFoundError(f"Local artifact {path} for {model_id} does not match its checksum. "
+                                    f"Run prefetch.py on a connected machine and copy {artifactsDir()} again.")
+        verified[key] = stamp
+        changed = True
+
+    # The record only saves time, so a read-only artifacts folder just means hashing again next time
+    if changed:
+        try:
+            temp_path = verified_path.with_suffix(".tmp")
+            with open(temp_path, "w", encoding="utf-8") as verified_file:
+                json.dump(verified, verified_file, indent=4)
+            os.replace(temp_path, verified_path)
+        except OSError as error:
+            print(f"Could not record verified artifacts in {verified_path}: {error}")
+
+
+def fileDigest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as artifact_file:
+        for block in iter(lambda: artifact_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def recordArtifact(model_id, directory):
+    '''Adds (or replaces) the manifest entry for model_id with every file in directory, which must be in artifactsDir()'''
+    global _manifest
+    directory = Path(directory)
+    files = {}
+    for path in sorted(directory.rglob("*")):
+        if path.is_file():
+            files[path.relative_to(directory).as_posix()] = {"size": path.stat().st_size, "sha256": fileDigest(path)}
+
+    manifest_path = artifactsDir() / MANIFEST_NAME
+    with _manifest_lock:
+        artifacts = {}
+        if manifest_path.exists():
+            with open(manifest_path, encoding="utf-8") as manifest_file:
+                artifacts = json.load(manifest_file)["artifacts"]
+        artifacts[model_id] = {"path": directory.relative_to(artifactsDir()).as_posix(), "files": files}
+
+        temp_path = manifest_path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as manifest_file:
+            json.dump({"version": 1, "artifacts": artifacts}, manifest_file, indent=4)
+        os.replace(temp_path, manifest_path)
+        _manifest = artifacts
+    return artifacts[model_id]
+
+
+def verifyArtifacts():
+    '''Checks every manifest file against its recorded SHA-256. Returns a list of problems (empty when all match).'''
+    problems = []
+    for model_id, entry in loadManifest().items():
+        directory = artifactsDir() / entry["path"]
+        for name, file_entry in entry["files"].items():
+            path = directory / name
+            if not path.is_file():
+                problems.append(f"{model_id}: {path} is missing")
+            elif fileDigest(path) != file_entry["sha256"]:
+                problems.append(f"{model_id}: {path} does not match its checksum")
+    return problems
@@ -0,0 +1,187 @@
+# This Python file uses the following encoding: utf-8
+# In-memory caches used to avoid re-running models on frames they have already seen
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+import torch
+
+
+def frameDigest(image):
+    '''Returns a fast, exact digest of a frame's pixels, shape and dtype for use as a cache key'''
+    image = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.shape}{image.dtype}".encode())
+    digest.update(memoryview(image).cast("B"))
+    return digest.hexdigest()
+
+
+def perceptualFrameHash(image, hash_size=32):
+    '''
+    Returns a difference hash (dHash) of a frame: the sign of the brightness gradient between neighbouring cells of a
+    grayscale thumbnail. Unlike frameDigest() it stays the same under sensor noise and recompression, so re-captures
+    of an unchanged scene get the same key. The default 32x32 grid (1024 bits, cells of about 20x15 pixels in a
+    640x480 frame) is fine enough that a small object entering or leaving the scene changes the hash.
+    '''
+    gray = cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_RGB2GRAY)
+    thumbnail = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return f"{image.shape[0]}x{image.shape[1]}:{np.packbits(bits).tobytes().hex()}"
+
+
+def normalizeQuestion(question):
+    '''Lowercases a question and drops punctuation and repeated whitespace, so trivially different wordings share a key'''
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+def _nbytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return 0
+
+
+class FrcnnFeatureCache:
+    '''
+    Bounded LRU cache of FRCNN outputs (roi_features, normalized_boxes, boxes, ...) and the box visualization,
+    keyed by frameDigest(). A single instance is shared by every LXMERT model so a second question about
+    the same frame skips FRCNN entirely.
+
+    Entries are evicted least-recently-used first once their combined tensor/array size exceeds budget_mb.
+    A budget of 0 disables the cache.
+    '''
+    def __init__(self, budget_mb=512):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Returns (output_dict, visualization) for a cached frame, or None'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            output_dict, visualization, _ = entry
+            return output_dict, visualization
+
+    def peek(self, key):
+        '''Like get(), but does not count as a lookup or mark the entry as recently used'''
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry[:2]
+
+    def put(self, key, output_dict, visualization):
+        size = sum(_nbytes(value) for value in output_dict.values()) + _nbytes(visualization)
+        if size > self.budget_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (output_dict, visualization, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.budget_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def discard(self, key):
+        '''Removes one frame's entry, if cached'''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class AnswerCache:
+    '''
+    Bounded LRU cache of prediction results with a time to live, keyed by (model name, normalized question, perceptual
+    frame hash, ...). Re-asking a question about an unchanged frame returns the earlier result, including any
+    visualizations it has already generated.
+
+    Results of answer-only requests have no visualizations, so they only serve other answer-only requests.
+    Entries older than ttl_s seconds are treated as misses. A capacity of 0 disables the cache.
+    '''
+    def __init__(self, capacity=256, ttl_s=300):
+        self.capacity = capacity
+        self.ttl = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def get(self, key, answer_only=False):
+        '''Returns the cached result for key, or None if it is missing, expired or answer-only when answer_only is not set'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None or (entry[1] and not answer_only):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result, answer_only=False):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            entry = self._entries.get(key)
+            # Keep a live full result rather than replacing it with an answer-only one
+            if answer_only and entry is not None and not entry[1] and time.monotonic() - entry[2] <= self.ttl:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (result, answer_only, time.monotonic())
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
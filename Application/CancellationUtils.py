@@ -0,0 +1,74 @@
+# This Python file uses the following encoding: utf-8
+# Cooperative cancellation of inference jobs.
+#
+# A job runs inside cancellationScope(token); the prediction pipeline calls checkCancelled() between its stages
+# (FRCNN backbone, proposals and ROI heads, the LXMERT/ViLT forward, each explainer), which raises InferenceCancelled
+# once the token has been cancelled. Work already inside a stage always finishes; nothing is interrupted midway, so
+# caches and memoized visualizations never hold partial results.
+#
+# Jobs handed to another process (the VQA server or an inference worker) wait with waitCancellable(), which tells
+# that process to stop once the job is cancelled instead of waiting for an answer nobody will see.
+
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+
+class InferenceCancelled(Exception):
+    '''Raised at the next stage boundary of a job whose cancellation token was cancelled'''
+
+
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def isCancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise InferenceCancelled()
+
+
+# The token of the job running on each thread
+_scope = threading.local()
+
+@contextmanager
+def cancellationScope(token):
+    '''Makes checkCancelled() on this thread check token (None: the job cannot be cancelled)'''
+    previous = getattr(_scope, "token", None)
+    _scope.token = token
+    try:
+        yield token
+    finally:
+        _scope.token = previous
+
+def checkCancelled():
+    '''Raises InferenceCancelled if the job running on this thread has been cancelled'''
+    token = getattr(_scope, "token", None)
+    if token is not None:
+        token.check()
+
+def waitCancellable(future, timeout=None, onCancelled=None, poll_s=0.1):
+    '''
+    Returns future.result(), checking the token of the job running on this thread while waiting. Once the job has been
+    cancelled, calls onCancelled() (e.g. to tell the process doing the work to stop) and raises InferenceCancelled.
+    Raises concurrent.futures.TimeoutError when the future is not done within timeout seconds.
+    '''
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait = poll_s if deadline is None else max(0, min(poll_s, deadline - time.monotonic()))
+        try:
+            return future.result(timeout=wait)
+        except FutureTimeoutError:
+            token = getattr(_scope, "token", None)
+            if token is not None and token.isCancelled():
+                if onCancelled is not None:
+                    onCancelled()
+                raise InferenceCancelled()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
@@ -14,9 +14,6 @@ import os
 from threading import Timer
 import json
 
-from docx import Document
-from docx.shared import Inches, Pt
-
 
 class ExportUtils:
     def __init__(self, parent=None):
@@ -113,12 +110,21 @@ class ExportUtils:
         except: 
             print("Could not export to JSON file")
 
-    def exportResults(self, predictionResult, model_details, cameraEffect, weatherEffects, exportCheckBox):
+    def exportResults(self, predictionResult, model_details, cameraEffect, weatherEffects):
+        '''
+        Writes the results to a DOCX and a JSON file. Runs on a worker thread, so it does not touch any widgets;
+        returns whether the export succeeded for the GUI to show.
+        '''
         print("Exporting...")
+        start = time.perf_counter()
 
         if (not self.checkExportDir()):
             print("Failed to make export directories; could not export.")
-            return
+            return False
+
+        # python-docx is only needed for exports, so it is not imported at startup
+        from docx import Document
+        from docx.shared import Inches, Pt
 
         try: 
             document = Document()
@@ -217,9 +223,9 @@ class ExportUtils:
             document.save(doc_name)
             print("Results exported to: " + result_dir)
 
-            exportCheckBox.setText("Exported")
-            Timer(2, self.resetExportText, [exportCheckBox]).start()
+            # Includes generating any visualizations that had not been displayed yet
+            predictionResult.timings.add("export", time.perf_counter() - start)
+            return True
         except:
             print("Failed to export")
-            exportCheckBox.setText("Could Not Export")
-            Timer(2, self.resetExportText, [exportCheckBox]).start()
+            return False
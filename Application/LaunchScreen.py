@@ -32,6 +32,10 @@ class LaunchScreen(QWidget):
         # Connect button action to method
         self.ui.button_InitializeClient.clicked.connect(self.startVQA)
 
+    def showModelStatus(self, statusText):
+        '''Show the load and warm-up status of the preloaded models below the initialize button'''
+        self.ui.label_ModelStatus.setText(statusText)
+
     def navToVQAScreen(self):
         '''Initialize VQA interaction screen and set at the active stacked frame'''
         self.stackedWidget.hide()
@@ -3,18 +3,34 @@
 import os
 from pathlib import Path
 import sys
+import time
 
 from PySide6.QtWidgets import QApplication, QWidget
 from PySide6.QtGui import QScreen
-from PySide6.QtCore import QFile
+from PySide6.QtCore import QFile, QTimer, Signal
 from PySide6.QtUiTools import QUiLoader
 
 class LoadScreen(QWidget):
+    # Model registry events (event, model name, details), plus the "warming up", "warmed up" and "warm-up failed"
+    # events of the startup warm-ups. Emitted from loading threads, handled on the GUI thread.
+    modelEvent = Signal(str, str, object)
+    # The model status text whenever it changes, for screens shown while models are still loading or warming up
+    modelStatusChanged = Signal(str)
+
     def __init__(self, app, stackedWidget, parent=None):
         super().__init__(parent)
         self.stackedWidget = stackedWidget
         self.app = app
         self.load_ui()
+        self.modelEvent.connect(self.reportModelEvent)
+
+        # Latest registry event per model, (event, time, details), shown together since models load in parallel
+        self.modelStatus = {}
+        # Latest warm-up event per model, (event, time, details), shown after the model's load status
+        self.warmUpStatus = {}
+        # Refreshes the elapsed time of the models that are still loading
+        self.modelStatusTimer = QTimer(self)
+        self.modelStatusTimer.timeout.connect(self.showModelStatus)
 
     def load_ui(self):
         '''Translate .ui design file to python equivalent and load'''
@@ -31,3 +47,49 @@ class LoadScreen(QWidget):
         self.ui.label_StatusText.setText(statusText)
         # Process Event to update load screen text and progress
         self.app.processEvents()
+
+    def updateProgress(self, percentComplete):
+        '''Update only the progress bar, leaving the status message (e.g. the model status) as it is'''
+        self.ui.progressBar.setValue(percentComplete)
+
+    def reportModelEvent(self, event, name, details):
+        '''Record a model registry event (queued, loading, loaded, failed, evicted) or warm-up event and show every model's status'''
+        if event in ("warming up", "warmed up", "warm-up failed"):
+            self.warmUpStatus[name] = (event, time.perf_counter(), details)
+        else:
+            self.modelStatus[name] = (event, time.perf_counter(), details)
+        if event in ("loading", "warming up") and not self.modelStatusTimer.isActive():
+            self.modelStatusTimer.start(500)
+        self.showModelStatus()
+
+    def showModelStatus(self):
+        '''Show one status per model as the status message, with the elapsed time of those still loading'''
+        statuses = []
+        for name, (event, eventTime, details) in self.modelStatus.items():
+            if event == "queued":
+                statuses.append(f"{name}: waiting")
+            elif event == "loading":
+                statuses.append(f"{name}: loading {time.perf_counter() - eventTime:.0f} s")
+            elif event == "loaded":
+                statuses.append(f"{name}: ready in {details.get('seconds')} s ({details.get('size_mb')} MB)")
+            elif event == "failed":
+                statuses.append(f"{name}: could not load ({details.get('error')})")
+            else:
+                statuses.append(f"{name}: unloaded to stay within the memory budget")
+
+            if name in self.warmUpStatus:
+                warmUpEvent, warmUpTime, warmUpDetails = self.warmUpStatus[name]
+                if warmUpEvent == "warming up":
+                    statuses[-1] += f", warming up {time.perf_counter() - warmUpTime:.0f} s"
+                elif warmUpEvent == "warmed up":
+                    statuses[-1] += f", warmed up in {warmUpDetails.get('seconds'):.1f} s"
+                else:
+                    statuses[-1] += f", could not warm up ({warmUpDetails.get('error')})"
+
+        statusText = "   ".join(statuses)
+        if any(event in ("queued", "loading") for event, _, _ in self.modelStatus.values()):
+            statusText += "\nThis step will take longer the first time this application loads."
+        elif not any(event == "warming up" for event, _, _ in self.warmUpStatus.values()):
+            self.modelStatusTimer.stop()
+        self.ui.label_StatusText.setText(statusText)
+        self.modelStatusChanged.emit(statusText)
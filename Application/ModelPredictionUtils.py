@@ -1,31 +1,170 @@
-import os
-from transformers import ViltForQuestionAnswering, ViltProcessor 
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from transformers import ViltConfig, ViltForQuestionAnswering, ViltProcessor, BatchEncoding
 import torch
 import numpy as np
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 
 # Imports related to LXMERT
-from PIL import Image
-from transformers import LxmertForQuestionAnswering, LxmertTokenizer
-from frcnn.utils import Config, get_data
+from transformers import LxmertConfig, LxmertForQuestionAnswering, LxmertTokenizer
+from frcnn.utils import Config, VocabularyStore, VOCAB_CACHE
 from frcnn.modeling_frcnn import GeneralizedRCNN
 from frcnn.processing_image import Preprocess
-from frcnn.visualizing_image import SingleImageViz
 from transformers import LxmertTokenizer
 # We need to use a modified version of the lxmert model that's based on huggingface
 from ModelVisualizations.Lxmert.lxmert_lrp import LxmertForQuestionAnswering
 from ModelVisualizations.Lxmert.lxmert_visualization_generator import LxmertVisualizationGenerator, create_image_vis
-import cv2
+from ModelVisualizations.Lxmert.layers import no_relevance_capture
+from ModelVisualizations.Lxmert import layers as lrp_layers
 
 # Imports related to ViLT
 from ModelVisualizations.Vilt.vilt_visualization import get_visualization_for_token, combine_images, rgba2rgb
 
+from ArtifactUtils import resolveArtifact
+from CacheUtils import AnswerCache, FrcnnFeatureCache, frameDigest, normalizeQuestion, perceptualFrameHash
+from CancellationUtils import checkCancelled
+from OnnxUtils import loadOnnxVilt
+from SafetensorsUtils import loadMapped
+from SettingsUtils import settings
+from TimingUtils import StageTimings, metrics_log, unloggedTimings
+
 
 device = "cuda:0" if torch.cuda.is_available() else "cpu"
 device = "cpu"
 print(device)
 
+class LazyVisualizations:
+    '''
+    List-like collection of visualizations that are only generated the first time they are accessed.
+
+    Each entry is produced by a zero-argument callable and memoized, so an entry is computed at most once no matter
+    how many threads (UI worker, export) ask for it. Indexing an entry that is not ready blocks until it is generated;
+    use isReady() to check first and generate it on a worker thread instead.
+    '''
+    def __init__(self, generators=()):
+        self._generators = list(generators)
+        self._values = [None] * len(self._generators)
+        self._locks = [threading.Lock() for _ in self._generators]
+
+    @classmethod
+    def fromValues(cls, values):
+        return cls([lambda value=value: value for value in values])
+
+    @classmethod
+    def concatenate(cls, collections):
+        '''Chains several collections without generating any of their entries'''
+        return cls([lambda collection=collection, index=index: collection[index]
+                    for collection in collections for index in range(len(collection))])
+
+    def isReady(self, index):
+        return self._values[index] is not None
+
+    def __len__(self):
+        return len(self._generators)
+
+    def __getitem__(self, index):
+        with self._locks[index]:
+            if self._values[index] is None:
+                self._values[index] = self._generators[index]()
+            return self._values[index]
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+def _memoize(fn):
+    '''Wraps a zero-argument callable so that it runs at most once, even when called from several threads'''
+    lock = threading.Lock()
+    result = []
+
+    def wrapper():
+        with lock:
+            if not result:
+                result.append(fn())
+            return result[0]
+
+    return wrapper
+
+@contextmanager
+def answerOnlyInference():
+    '''
+    Runs forward passes that only need the answer: no autograd graph, and the LRP input/attention/gradient capture
+    in layers.py and LxmertAttention is switched off. Explainers always run their own forward pass with capture on.
+    '''
+    with torch.inference_mode(), no_relevance_capture():
+        yield
+
+def autocastDtype():
+    '''Returns torch.bfloat16 when the reduced-precision mode is enabled in the settings, otherwise None'''
+    return torch.bfloat16 if settings["models"]["precision"] == "bf16" else None
+
+def isQuantized(model):
+    '''True when the model has dynamic int8 Linear layers (see quantizeModel)'''
+    modules = getattr(model, "modules", None) # ONNX Runtime models are not torch modules
+    return modules is not None and any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in modules())
+
+_quantized_autocast_reported = False
+
+def reducedPrecision(model):
+    '''
+    CPU autocast for the answer forward of model when the settings ask for bf16, otherwise a no-op. The explainers
+    (LRP, attention gradients, ViLT's ipot alignment) never run under it and stay in fp32.
+
+    Quantized models always run in fp32: autocast would hand bf16 activations to the dynamic int8 Linear layers,
+    which only accept fp32 input. The int8 weights already give most of the speed-up bf16 would.
+    '''
+    global _quantized_autocast_reported
+    dtype = autocastDtype()
+    if dtype is not None and isQuantized(model):
+        if not _quantized_autocast_reported:
+            print("bf16 autocast is not used for int8 quantized models, they run in fp32")
+            _quantized_autocast_reported = True
+        dtype = None
+    return torch.autocast(torch.device(device).type, dtype=dtype, enabled=dtype is not None)
+
+# Partial results emitted, in this order, while a prediction is streamed to the UI
+STAGE_ANSWER = "answer"
+STAGE_TOP_PREDICTIONS = "top_predictions"
+STAGE_VISUALIZATION = "visualization"
+
+def streamedVisualizations(results):
+    '''
+    Returns the positions, across all of the results, of the visualizations streamResults generates: only the first
+    one (shown by default), or every one when "prefetch_visualizations" is set. The others are generated on demand.
+    '''
+    total = sum(len(result.visualizations) for result in results)
+    return list(range(total if settings["models"]["prefetch_visualizations"] else min(total, 1)))
+
+def streamResults(results, emit):
+    '''
+    Emits the partial results of a prediction (a list of PredictionResults) as (stage, results, index) tuples: the
+    answers, then the top predictions, then each visualization in streamedVisualizations(results) as soon as it has
+    been generated, in display order (for LXMERT the FRCNN boxes come first). index is the visualization's position
+    across all of the results. Stops with InferenceCancelled before the next visualization once the job's
+    cancellation token is cancelled.
+    '''
+    emit((STAGE_ANSWER, results, None))
+    emit((STAGE_TOP_PREDICTIONS, results, None))
+
+    positions = [(result, visualization_index) for result in results
+                 for visualization_index in range(len(result.visualizations))]
+    for index in streamedVisualizations(results):
+        checkCancelled()
+        result, visualization_index = positions[index]
+        result.visualizations[visualization_index]
+        emit((STAGE_VISUALIZATION, results, index))
+
+# Explainers read the attention maps and gradients stored on the model's modules, so a model must not run another
+# forward pass while one of its explainers is working. Every LXMERT forward/backward holds that model's lock.
+_model_locks = {}
+_model_locks_guard = threading.Lock()
+
+def _modelLock(model):
+    with _model_locks_guard:
+        return _model_locks.setdefault(id(model), threading.Lock())
+
 # class to store relevant prediction information
 @dataclass
 class PredictionResults:
@@ -41,35 +180,106 @@ class PredictionResults:
 
     # Extra Visualization Data. These are optional
     top_predictions: list[tuple[str, float]] = field(default_factory=list[tuple[str, float]])
-    visualizations: list = field(default_factory=list[np.ndarray]) # This is a list of RGB images (CV2 images)
+    visualizations: LazyVisualizations = field(default_factory=LazyVisualizations) # RGB images (CV2 images), generated on first access
     visualization_names: list[str] = field(default_factory=list[str])    
 
     # Token information:
     encoded_tokens: list = field(default_factory=list)
     decoded_tokens: list = field(default_factory=list)
 
-# ViLT Model
-def predictVilt(model, processor, question, image):
-    encoding = processor(image, question, return_tensors="pt").to(device)
+    # Time taken by each pipeline stage, including the visualizations generated so far
+    timings: StageTimings = field(default_factory=StageTimings)
 
-    outputs = model(**encoding)
-    logits = outputs.logits
-    idx = torch.sigmoid(logits).argmax(-1).item()
+# ViLT Model
+def predictVilt(model, processor, question, image, answer_only=False, onnx_model=None):
+    return predictViltBatch(model, processor, [question], image, answer_only=answer_only, onnx_model=onnx_model)[0]
 
-    # Get Top Answers
-    top_predictions = getTopPredictions(logits[0], model.config.id2label)
+def predictViltBatch(model, processor, questions, image, answer_only=False, onnx_model=None, timings=None):
+    '''
+    Answers a list of questions about a single image.
 
-    # Obtain the tokens used as input
-    encoded_tokens = encoding['input_ids'].tolist()[0]
-    decoded_tokens = [processor.tokenizer.convert_ids_to_tokens(token) for token in encoded_tokens]
+    The image is encoded once and shared by every question; the questions are padded into one batch so the
+    transformer runs a single forward pass. Returns one PredictionResults per question, in the same order.
+    With answer_only, no visualizations are attached to the results and the forward pass runs on onnx_model
+    (an OnnxUtils.OnnxViltModel) when one is given. The stages are timed into timings (a StageTimings for the
+    batch), which each result gets a copy of.
+    '''
+    if timings is None:
+        timings = StageTimings('ViLT', "; ".join(questions))
+
+    batch_size = len(questions)
+    with timings.stage("ViLT image preprocessing"):
+        image_encoding = processor.image_processor(image, return_tensors="pt")
+    with timings.stage("ViLT tokenization"):
+        encoding = processor.tokenizer(questions, padding=True, truncation=True,
+                                       max_length=model.config.max_position_embeddings, return_tensors="pt")
+        # expand() shares the single encoded image across the batch without copying it
+        encoding["pixel_values"] = image_encoding["pixel_values"].expand(batch_size, -1, -1, -1)
+        encoding["pixel_mask"] = image_encoding["pixel_mask"].expand(batch_size, -1, -1)
+        encoding = encoding.to(device)
+
+    # The visualizations need the PyTorch model; answer-only requests can use the exported graph instead
+    forward_model = onnx_model if answer_only and onnx_model is not None else model
+    checkCancelled()
+    with timings.stage("ViLT forward (ONNX)" if forward_model is onnx_model else "ViLT forward"):
+        with answerOnlyInference(), reducedPrecision(forward_model):
+            outputs = forward_model(**encoding)
+        logits = outputs.logits.float()
+
+    results = []
+    for i, question in enumerate(questions):
+        result_timings = timings.fork(question)
+        idx = torch.sigmoid(logits[i]).argmax(-1).item()
+
+        # Get Top Answers
+        top_predictions = getTopPredictions(logits[i], model.config.id2label)
+
+        # Obtain the tokens used as input (without the batch padding)
+        length = int(encoding['attention_mask'][i].sum())
+        encoded_tokens = encoding['input_ids'][i, :length].tolist()
+        decoded_tokens = [processor.tokenizer.convert_ids_to_tokens(token) for token in encoded_tokens]
+
+        if answer_only:
+            results.append(PredictionResults(question=question, image=image,
+                                             model_used='ViLT',
+                                             prediction=model.config.id2label[idx],
+                                             top_predictions=top_predictions,
+                                             encoded_tokens=encoded_tokens, decoded_tokens=decoded_tokens,
+                                             timings=result_timings))
+            continue
+
+        # Visualizations are only generated when first requested
+        token_encoding = {'input_ids': encoding['input_ids'][i:i+1, :length],
+                          'pixel_values': encoding['pixel_values'][i:i+1]}
+        token_visualizations = _memoize(lambda token_encoding=token_encoding, result_timings=result_timings:
+                                        getViltVisualizations(model, token_encoding, image, result_timings))
+        visualization_names = getViltVisualizationNames(decoded_tokens)
+        visualizations = LazyVisualizations([lambda index=index, token_visualizations=token_visualizations: token_visualizations()[index]
+                                             for index in range(len(visualization_names))])
+
+        results.append(PredictionResults(question=question, image=image,
+                                         model_used='ViLT', 
+                                         prediction=model.config.id2label[idx],
+                                         top_predictions=top_predictions,
+                                         encoded_tokens=encoded_tokens, decoded_tokens=decoded_tokens,
+                                         visualizations=visualizations, visualization_names=visualization_names,
+                                         timings=result_timings
+                                         ))
 
-    # Visualizations
-    _, visuals = get_visualization_for_token(model, encoding, image)
-    visualizations = []
-    visualizations.append(combine_images(visuals))
-    visualizations.extend(visuals)
-    visualizations = [rgba2rgb(np.array(visual)) for visual in visualizations]
+    return results
 
+def getViltVisualizations(model, encoding, image, timings):
+    '''
+    Returns the combined attention image followed by one attention image per token
+    '''
+    _, visuals = get_visualization_for_token(model, encoding, image, stage_timer=timings.stage)
+    with timings.stage("ViLT visualization rendering"):
+        visualizations = []
+        visualizations.append(combine_images(visuals))
+        visualizations.extend(visuals)
+        return [rgba2rgb(np.array(visual)) for visual in visualizations]
+
+def getViltVisualizationNames(decoded_tokens):
     # Generate Names for Each Visualization
     # Order: Combined, token 1, token 2, ...., token n
     # Naming Restriction: These visualization names will dicate the filenames of exported visualization PNGs. Ensure
@@ -79,130 +289,336 @@ def predictVilt(model, processor, question, image):
     visualization_names.extend(
         [f"Token {id} - \'{token}\'" for id, token in enumerate(decoded_tokens)]
     )
-   
-    results = PredictionResults(question=question, image=image,
-                                model_used='ViLT', 
-                                prediction=model.config.id2label[idx],
-                                top_predictions=top_predictions,
-                                encoded_tokens=encoded_tokens, decoded_tokens=decoded_tokens,
-                                visualizations=visualizations, visualization_names=visualization_names
-                                )
 
-    return results
+    return visualization_names
+
+def quantizeModel(model):
+    '''
+    Applies dynamic int8 quantization to the Linear layers of a model for faster CPU inference.
+
+    The LXMERT explainability Linear layers are swapped for layers.QuantizedLinear, which keeps relevance propagation
+    and gradients working. Dynamic quantization is CPU only, so the model is returned unchanged on other devices.
+    '''
+    if device != "cpu":
+        print(f"int8 quantization is only supported on CPU, keeping fp32 weights on {device}")
+        return model
+
+    return torch.ao.quantization.quantize_dynamic(
+        model,
+        qconfig_spec={torch.nn.Linear: torch.ao.quantization.default_dynamic_qconfig,
+                      lrp_layers.Linear: torch.ao.quantization.default_dynamic_qconfig},
+        mapping={**torch.ao.quantization.get_default_dynamic_quant_module_mappings(),
+                 lrp_layers.Linear: lrp_layers.QuantizedLinear},
+        dtype=torch.qint8,
+    )
+
+def _quantizeSetting(quantize):
+    return settings["models"]["quantize"] if quantize is None else quantize
+
+# File names of the ONNX exports (see export_onnx.py)
+VILT_ONNX_NAME = "vilt-b32-finetuned-vqa"
+FINE_VILT_ONNX_NAME = "FineTunedVILT"
+
+# File names of the memory-mapped weights (see convert_weights.py). Models that have not been converted load their
+# original checkpoints.
+VILT_WEIGHTS_NAME = "vilt-b32-finetuned-vqa"
+FINE_VILT_WEIGHTS_NAME = "FineTunedVILT"
+LXMERT_WEIGHTS_NAME = "lxmert-vqa-uncased"
+FINE_LXMERT_WEIGHTS_NAME = "FineTunedLXMERT"
+FRCNN_WEIGHTS_NAME = "frcnn-vg-finetuned"
+
+# HuggingFace ids of the pretrained artifacts. Every loader resolves them through the artifact manifest first (see
+# ArtifactUtils.py and prefetch.py), so ids with a local copy are loaded from disk without any network access.
+VILT_HUB_ID = "dandelin/vilt-b32-finetuned-vqa"
+LXMERT_TOKENIZER_ID = "unc-nlp/lxmert-base-uncased"
+LXMERT_HUB_ID = "unc-nlp/lxmert-vqa-uncased"
+FRCNN_HUB_ID = "unc-nlp/frcnn-vg-finetuned"
+VOCABULARIES_ID = "lxmert-vocabularies"
+
+def _buildVilt(config_path):
+    return ViltForQuestionAnswering(ViltConfig.from_json_file(config_path))
+
+def _buildLxmert(config_path):
+    return LxmertForQuestionAnswering(LxmertConfig.from_json_file(config_path))
 
 #base pre-trained model
-def setupViltTransformer():
-    processor = ViltProcessor.from_pretrained("dandelin/vilt-b32-finetuned-vqa")
-    model = ViltForQuestionAnswering.from_pretrained("dandelin/vilt-b32-finetuned-vqa")
+def setupViltTransformer(quantize=None):
+    processor = ViltProcessor.from_pretrained(resolveArtifact(VILT_HUB_ID))
+    model = loadMapped(VILT_WEIGHTS_NAME, _buildVilt)
+    if model is None:
+        model = ViltForQuestionAnswering.from_pretrained(resolveArtifact(VILT_HUB_ID))
     model.to(device)
+    if _quantizeSetting(quantize):
+        model = quantizeModel(model)
+
+    # ONNX Runtime graph for answer-only requests, when that backend is enabled (None otherwise)
+    onnx_model = loadOnnxVilt(VILT_ONNX_NAME)
 
-    return model, processor
+    return model, processor, onnx_model
 
 #fine-tuned model
-def setupFineViltTransformer():
-    processor = ViltProcessor.from_pretrained("dandelin/vilt-b32-finetuned-vqa")
-    model = torch.load("Fine-Tuned Models/FineTunedVILT.pt")
+def setupFineViltTransformer(quantize=None):
+    processor = ViltProcessor.from_pretrained(resolveArtifact(VILT_HUB_ID))
+    model = loadMapped(FINE_VILT_WEIGHTS_NAME, _buildVilt)
+    if model is None:
+        model = torch.load("Fine-Tuned Models/FineTunedVILT.pt")
     model.to(device)
+    if _quantizeSetting(quantize):
+        model = quantizeModel(model)
 
-    return model, processor
+    onnx_model = loadOnnxVilt(FINE_VILT_ONNX_NAME)
+
+    return model, processor, onnx_model
 
 
 # LXMERT Model
-IMAGE_LOCATION = r"./FRCNN_Image.jpg"
+# Object, attribute and answer labels shared by every LXMERT call. Loaded once during model setup.
+vocabularies = VocabularyStore()
+
+def loadVocabularies():
+    '''Loads the shared vocabularies, from the prefetched copy when the artifact manifest has one'''
+    vocabularies.cache_dir = resolveArtifact(VOCABULARIES_ID, default=VOCAB_CACHE)
+    vocabularies.load()
+
+# FRCNN outputs per frame, shared by the base and fine-tuned LXMERT models
+frcnn_cache = FrcnnFeatureCache(budget_mb=settings["frcnn_cache"]["budget_mb"])
+
+class FrcnnDetector:
+    '''
+    Faster RCNN region detector shared by every LXMERT model.
 
-def setupLxmertTransformer():
+    Base and fine-tuned LXMERT use the same "unc-nlp/frcnn-vg-finetuned" detector, so it is built once and handed
+    to each LXMERT setup through getFrcnnDetector(). Detection results go through frcnn_cache, which lets any LXMERT
+    model reuse the region features another one already extracted for the same frame. detect() is thread safe:
+    concurrent requests for a frame that is not cached yet run FRCNN once and the others pick the result up from the
+    cache.
+    '''
+    def __init__(self):
+        self.frcnn_cfg = Config.from_pretrained(resolveArtifact(FRCNN_HUB_ID))
+        self.frcnn_cfg.model.device = "cuda:0" if torch.cuda.is_available() else "cpu" # Immportant to have frcnn run on GPU for real time performance
+
+        self.frcnn = loadMapped(FRCNN_WEIGHTS_NAME, lambda _: GeneralizedRCNN(self.frcnn_cfg))
+        if self.frcnn is None:
+            self.frcnn = GeneralizedRCNN.from_pretrained(resolveArtifact(FRCNN_HUB_ID), config=self.frcnn_cfg)
+        self.image_preprocess = Preprocess(self.frcnn_cfg)
+        self._lock = threading.Lock()
+
+    # The detector is pickled when a model is handed to an inference worker process; locks cannot be
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def detect(self, image, visualize=True, timings=None):
+        '''
+        Returns the FRCNN output dict for the frame and, when visualize is set, the box visualization (otherwise None).
+        The FRCNN stages are timed into timings when one is given.
+        '''
+        if timings is None:
+            timings = StageTimings("FRCNN", logged=False)
+
+        # Reuse the detections when this exact frame has already been through FRCNN (e.g. a frozen camera) at the
+        # current precision
+        start = time.perf_counter()
+        frame_key = (frameDigest(image), str(autocastDtype()))
+        cached = frcnn_cache.get(frame_key)
+        if cached is None:
+            with self._lock:
+                # Another thread may have detected this frame while we were waiting for the lock. The lookup above
+                # already counted this request, so the re-check does not count again.
+                cached = frcnn_cache.peek(frame_key)
+                if cached is None:
+                    output_dict = self._run(image, timings)
+                    frcnn_cache.put(frame_key, output_dict, None)
+        if cached is not None:
+            output_dict = cached[0]
+            timings.add("FRCNN cache hit", time.perf_counter() - start)
+
+        visualization = self.drawBoxes(image, output_dict, timings) if visualize else None
+        return output_dict, visualization
+
+    def _run(self, image, timings):
+        # run frcnn directly on the in-memory RGB frame
+        with timings.stage("FRCNN preprocessing"):
+            images, sizes, scales_yx = self.image_preprocess(image, array_format="RGB")
+        return self.frcnn(
+            images,
+            sizes,
+            scales_yx=scales_yx,
+            padding="max_detections",
+            max_detections=self.frcnn_cfg.max_detections,
+            return_tensors="pt",
+            autocast_dtype=autocastDtype(),
+            cancel_check=checkCancelled,
+            stage_timer=timings.stage,
+        )
+
+    def drawBoxes(self, image, output_dict, timings):
+        '''
+        Returns the frame with the detected boxes drawn on it. The drawing is kept with the frame's cached detections,
+        so another question or model asking about the same frame does not draw the boxes again.
+        '''
+        frame_key = (frameDigest(image), str(autocastDtype()))
+        cached = frcnn_cache.peek(frame_key)
+        # The entry may have been evicted, or replaced by a detection at another precision, since output_dict was made
+        is_entry = cached is not None and cached[0] is output_dict
+        if is_entry and cached[1] is not None:
+            return cached[1]
+
+        with timings.stage("FRCNN box drawing"):
+            visualization = rgba2rgb(np.array(visualizeBoxes(output_dict, image)))
+        if is_entry:
+            frcnn_cache.put(frame_key, output_dict, visualization)
+        return visualization
+
+# The detector is only kept alive by the LXMERT models holding it, so it is freed once none of them are loaded
+_frcnn_detector = lambda: None
+_frcnn_detector_lock = threading.Lock()
+
+def getFrcnnDetector():
+    '''Returns the shared FrcnnDetector, building it the first time (or after every LXMERT model was unloaded)'''
+    global _frcnn_detector
+    with _frcnn_detector_lock:
+        detector = _frcnn_detector()
+        if detector is None:
+            detector = FrcnnDetector()
+            _frcnn_detector = weakref.ref(detector)
+        return detector
+
+def setupLxmertTransformer(quantize=None):
+    loadVocabularies()
 
     # Define the model
-    lxmert_tokenizer = LxmertTokenizer.from_pretrained("unc-nlp/lxmert-base-uncased")
-    lxmert_vqa = LxmertForQuestionAnswering.from_pretrained("unc-nlp/lxmert-vqa-uncased") 
+    lxmert_tokenizer = LxmertTokenizer.from_pretrained(resolveArtifact(LXMERT_TOKENIZER_ID))
+    lxmert_vqa = loadMapped(LXMERT_WEIGHTS_NAME, _buildLxmert)
+    if lxmert_vqa is None:
+        lxmert_vqa = LxmertForQuestionAnswering.from_pretrained(resolveArtifact(LXMERT_HUB_ID))
     lxmert_vqa.to(device)
+    if _quantizeSetting(quantize):
+        lxmert_vqa = quantizeModel(lxmert_vqa)
 
-    # Setup Faster RCNN Model for visual embeddings (backbone)
-    frcnn_cfg = Config.from_pretrained("unc-nlp/frcnn-vg-finetuned")
-    frcnn_cfg.model.device = "cuda:0" if torch.cuda.is_available() else "cpu" # Immportant to have frcnn run on GPU for real time performance
-
-    frcnn = GeneralizedRCNN.from_pretrained("unc-nlp/frcnn-vg-finetuned", config=frcnn_cfg)
-    image_preprocess = Preprocess(frcnn_cfg)
+    # Faster RCNN Model for visual embeddings (backbone), shared with the other LXMERT models
+    frcnn_detector = getFrcnnDetector()
 
-    return lxmert_tokenizer, lxmert_vqa, frcnn_cfg, frcnn, image_preprocess
+    return lxmert_tokenizer, lxmert_vqa, frcnn_detector
 
-def setupLxmertTransformer_finetuned():
+def setupLxmertTransformer_finetuned(quantize=None):
+    loadVocabularies()
 
     # Define the model
-    lxmert_tokenizer = LxmertTokenizer.from_pretrained("unc-nlp/lxmert-base-uncased")
-    lxmert_vqa_finetuned = LxmertForQuestionAnswering.from_pretrained(pretrained_model_name_or_path='Fine-Tuned Models/FineTunedLXMERT.pth', config='config.json')
+    lxmert_tokenizer = LxmertTokenizer.from_pretrained(resolveArtifact(LXMERT_TOKENIZER_ID))
+    lxmert_vqa_finetuned = loadMapped(FINE_LXMERT_WEIGHTS_NAME, _buildLxmert)
+    if lxmert_vqa_finetuned is None:
+        lxmert_vqa_finetuned = LxmertForQuestionAnswering.from_pretrained(pretrained_model_name_or_path='Fine-Tuned Models/FineTunedLXMERT.pth', config='config.json')
     lxmert_vqa_finetuned.to(device)
+    if _quantizeSetting(quantize):
+        lxmert_vqa_finetuned = quantizeModel(lxmert_vqa_finetuned)
 
-    # Setup Faster RCNN Model for visual embeddings (backbone)
-    frcnn_cfg = Config.from_pretrained("unc-nlp/frcnn-vg-finetuned")
-    frcnn_cfg.model.device = "cuda:0" if torch.cuda.is_available() else "cpu" # Immportant to have frcnn run on GPU for real time performance
-
-    frcnn = GeneralizedRCNN.from_pretrained("unc-nlp/frcnn-vg-finetuned", config=frcnn_cfg)
-    image_preprocess = Preprocess(frcnn_cfg)
-
-    # add lxmert_vqa_finetuned to this list. 
-    return lxmert_tokenizer, lxmert_vqa_finetuned, frcnn_cfg, frcnn, image_preprocess
-
-def runFRCNN(image, image_preprocess, frcnn, frcnn_cfg):
-    # Save a temporary copy of the image for the model
-    #print(f"image type {type(image)}")
-    im = Image.fromarray(image)
-    im.save(IMAGE_LOCATION)
-
-    # run frcnn
-    images, sizes, scales_yx = image_preprocess(IMAGE_LOCATION)
-    output_dict = frcnn(
-        images,
-        sizes,
-        scales_yx=scales_yx,
-        padding="max_detections",
-        max_detections=frcnn_cfg.max_detections,
-        return_tensors="pt",
-    )
-
-    visualization = visualizeBoxes(output_dict)
+    # Faster RCNN Model for visual embeddings (backbone), shared with the other LXMERT models
+    frcnn_detector = getFrcnnDetector()
 
-    # Delete image copy
-    os.remove(IMAGE_LOCATION)
-    print(output_dict.keys())
+    return lxmert_tokenizer, lxmert_vqa_finetuned, frcnn_detector
 
-    return output_dict, visualization
+def visualizeBoxes(output_dict, image):
+    # Imported on first use: it pulls in matplotlib, which only the box visualization needs
+    from frcnn.visualizing_image import SingleImageViz
 
-def visualizeBoxes(output_dict):
     # Image Visualization
-    OBJ_URL = "https://raw.githubusercontent.com/airsplay/py-bottom-up-attention/master/demo/data/genome/1600-400-20/objects_vocab.txt"
-    ATTR_URL = "https://raw.githubusercontent.com/airsplay/py-bottom-up-attention/master/demo/data/genome/1600-400-20/attributes_vocab.txt"
-
-    objids = get_data(OBJ_URL)
-    attrids = get_data(ATTR_URL)
-
-    frcnn_visualizer = SingleImageViz(IMAGE_LOCATION, id2obj=objids, id2attr=attrids)
+    frcnn_visualizer = SingleImageViz(image, id2obj=vocabularies.objects, id2attr=vocabularies.attributes)
 
     # add boxes and labels to the image
     frcnn_visualizer.draw_boxes(
         output_dict.get("boxes"),
-        output_dict.pop("obj_ids"),
-        output_dict.pop("obj_probs"),
-        output_dict.pop("attr_ids"),
-        output_dict.pop("attr_probs"),
+        output_dict.get("obj_ids"),
+        output_dict.get("obj_probs"),
+        output_dict.get("attr_ids"),
+        output_dict.get("attr_probs"),
     )
 
     # Return Visualized Image
     return frcnn_visualizer._get_buffer()
 
-def predictLxmert(lxmert_tokenizer, lxmert_vqa, frcnn_cfg, frcnn, image_preprocess, question, image):
-    output_dict, visualization = runFRCNN(image, image_preprocess, frcnn, frcnn_cfg) 
-    visualizations = [visualization]
+def predictLxmert(lxmert_tokenizer, lxmert_vqa, frcnn_detector, question, image, answer_only=False):
+    return predictLxmertBatch(lxmert_tokenizer, lxmert_vqa, frcnn_detector, [question], image,
+                              answer_only=answer_only)[0]
 
-    # Very important that the boxes are normalized
-    normalized_boxes = output_dict.get("normalized_boxes").to(device)
-    features = output_dict.get("roi_features").to(device)
+def predictLxmertBatch(lxmert_tokenizer, lxmert_vqa, frcnn_detector, questions, image, answer_only=False,
+                       timings=None):
+    '''
+    Answers a list of questions about a single image.
 
-    VQA_URL = "https://raw.githubusercontent.com/airsplay/lxmert/master/data/vqa/trainval_label2ans.json"
-    vqa_answers = get_data(VQA_URL)
+    FRCNN runs once for the image and its region features are shared by every question; the questions are
+    padded into one batch for a single LXMERT forward pass. Returns one PredictionResults per question.
+    With answer_only, the FRCNN boxes are not drawn and no visualizations are attached to the results. The stages
+    are timed into timings (a StageTimings for the batch), which each result gets a copy of.
+    '''
+    if timings is None:
+        timings = StageTimings('LXMERT', "; ".join(questions))
+
+    # The boxes are drawn later, as the first visualization, so the answer is not held back by them
+    output_dict, _ = frcnn_detector.detect(image, visualize=False, timings=timings)
+
+    vqa_answers = vocabularies.answers
+
+    with timings.stage("LXMERT tokenization"):
+        inputs = tokenizeLxmert(lxmert_tokenizer, questions)
+
+    # run lxmert. Nothing is captured on the model's modules here, so this does not need the model lock.
+    checkCancelled()
+    with timings.stage("LXMERT forward"):
+        with answerOnlyInference(), reducedPrecision(lxmert_vqa):
+            output_vqa = runLxmert(lxmert_vqa, output_dict, inputs)
+        output_vqa["question_answering_score"] = output_vqa["question_answering_score"].float()
+
+    results = []
+    for i, question in enumerate(questions):
+        result_timings = timings.fork(question)
+        # Get top predicted answer index
+        pred_vqa = output_vqa["question_answering_score"][i].argmax(-1)
+
+        # Get Top Answers
+        top_predictions = getTopPredictions(output_vqa["question_answering_score"][i], vqa_answers)
+
+        # Obtain the tokens used as input
+        encoded_tokens = inputs['input_ids'][i].tolist()
+        decoded_tokens = [lxmert_tokenizer.convert_ids_to_tokens(token) for token in encoded_tokens]
+
+        if answer_only:
+            results.append(PredictionResults(question=question, image=image,
+                                             model_used='LXMERT',
+                                             prediction=vqa_answers[pred_vqa],
+                                             top_predictions=top_predictions,
+                                             encoded_tokens=encoded_tokens, decoded_tokens=decoded_tokens,
+                                             timings=result_timings))
+            continue
+
+        # The FRCNN boxes are drawn and each explainer runs only when its visualization is requested
+        question_inputs = BatchEncoding({key: value[i:i+1] for key, value in inputs.items()})
+        visualizations = LazyVisualizations(
+            [lambda result_timings=result_timings: frcnn_detector.drawBoxes(image, output_dict, result_timings)] +
+            [lambda method=method, question_inputs=question_inputs, result_timings=result_timings:
+                getLxmertVisualization(lxmert_vqa, output_dict, question_inputs, image, method, result_timings)
+             for method in LXMERT_EXPLAINERS.values()]
+        )
+        visualization_names = ["Faster RCNN Boxes"] + list(LXMERT_EXPLAINERS.keys())
+
+        results.append(PredictionResults(question=question, image=image, 
+                                         model_used='LXMERT', 
+                                         prediction=vqa_answers[pred_vqa], 
+                                         top_predictions=top_predictions, visualizations=visualizations,
+                                         visualization_names=visualization_names,
+                                         encoded_tokens=encoded_tokens, decoded_tokens=decoded_tokens,
+                                         timings=result_timings))
 
-    inputs = lxmert_tokenizer(
-        [question],
+    return results
+
+def tokenizeLxmert(lxmert_tokenizer, questions):
+    return lxmert_tokenizer(
+        questions,
         padding="max_length",
         max_length=20,
         truncation=True,
@@ -212,8 +628,18 @@ def predictLxmert(lxmert_tokenizer, lxmert_vqa, frcnn_cfg, frcnn, image_preproce
         return_tensors="pt",
     ).to(device)
 
-    # run lxmert
-    output_vqa = lxmert_vqa(
+def runLxmert(lxmert_vqa, output_dict, inputs):
+    '''
+    Runs LXMERT for a batch of tokenized questions about the frame described by output_dict.
+    Callers must hold _modelLock(lxmert_vqa) unless running under answerOnlyInference().
+    '''
+    batch_size = inputs.input_ids.shape[0]
+
+    # Very important that the boxes are normalized. expand() shares the frame's features across the batch.
+    normalized_boxes = output_dict.get("normalized_boxes").to(device).expand(batch_size, -1, -1)
+    features = output_dict.get("roi_features").to(device).expand(batch_size, -1, -1)
+
+    return lxmert_vqa(
         input_ids=inputs.input_ids,
         attention_mask=inputs.attention_mask,
         visual_feats=features,
@@ -222,56 +648,32 @@ def predictLxmert(lxmert_tokenizer, lxmert_vqa, frcnn_cfg, frcnn, image_preproce
         output_attentions=False,
     )
 
-    # Get top predicted answer index
-    pred_vqa = output_vqa["question_answering_score"].argmax(-1)
-
-    # Get Top Answers
-    top_predictions = getTopPredictions(output_vqa["question_answering_score"][0], vqa_answers)
-
-    # Obtain the tokens used as input
-    encoded_tokens = inputs['input_ids'].tolist()[0]
-    decoded_tokens = [lxmert_tokenizer.convert_ids_to_tokens(token) for token in encoded_tokens]
-
-    # Generate Visualizations
-    visualization_generator = LxmertVisualizationGenerator(lxmert_vqa, output_dict, inputs, output_vqa)
-    image_scores = []
-
-    # Chefer Explainability
-    _, R_t_i = visualization_generator.generate_ours()
-    # Get all of the image scores across the 12 attention heads
-    chefer_image_scores = torch.sum(R_t_i, dim=0)
-    image_scores.append(chefer_image_scores)
-
-    # Gradcam Image Scores
-    _, R_t_i = visualization_generator.generate_attn_gradcam()
-    gradcam_image_scores = torch.sum(R_t_i, dim=0)
-    image_scores.append(gradcam_image_scores)
-
-    # Attention Rollout Image Scores
-    _, R_t_i = visualization_generator.generate_rollout()
-    attention_rollout_image_scores = torch.sum(R_t_i, dim=0)
-    image_scores.append(attention_rollout_image_scores)
-
-    for image_score in image_scores:
-        path = create_image_vis(image, image_score, output_dict, r"./LxmertVisualization.jpg")
-        visualization = cv2.imread(path)
-        os.remove(path) # Remove the file after we read it
-        visualizations.append(visualization)
-    
-    # Perform final color corrections
-    visualizations = [rgba2rgb(np.array(visual)) for visual in visualizations]
-
-    # Currently only one visualization from LXMERT model
-    visualization_names = ["Faster RCNN Boxes", "Chefer Explainability", "Gradcam", "Attention Rollout"]
+# Visualization name -> LxmertVisualizationGenerator method, in display order
+LXMERT_EXPLAINERS = {
+    "Chefer Explainability": "generate_ours",
+    "Gradcam": "generate_attn_gradcam",
+    "Attention Rollout": "generate_rollout",
+}
 
-    results = PredictionResults(question=question, image=image, 
-                                model_used='LXMERT', 
-                                prediction=vqa_answers[pred_vqa], 
-                                top_predictions=top_predictions, visualizations=visualizations,
-                                visualization_names=visualization_names,
-                                encoded_tokens=encoded_tokens, decoded_tokens=decoded_tokens)
+def getLxmertVisualization(lxmert_vqa, output_dict, inputs, image, method, timings):
+    '''
+    Generates one explainability heatmap for a single tokenized question.
 
-    return results
+    The explainers need the attention maps and gradients of a forward pass, so LXMERT is re-run for this question
+    (FRCNN features are reused) while holding the model lock. Time spent waiting for the lock is not counted.
+    '''
+    with _modelLock(lxmert_vqa):
+        # Checked again once the lock is ours, since waiting for another explainer can take a while
+        checkCancelled()
+        with timings.stage(f"LXMERT {method}"):
+            output_vqa = runLxmert(lxmert_vqa, output_dict, inputs)
+            visualization_generator = LxmertVisualizationGenerator(lxmert_vqa, output_dict, inputs, output_vqa)
+            _, R_t_i = getattr(visualization_generator, method)()
+
+    with timings.stage("LXMERT heatmap rendering"):
+        # Get all of the image scores across the 12 attention heads
+        image_scores = torch.sum(R_t_i, dim=0)
+        return rgba2rgb(create_image_vis(image, image_scores, output_dict))
 
 def getTopPredictions(vqa_raw_scores, vocab_dictionary):
     '''
@@ -292,3 +694,116 @@ def getTopPredictions(vqa_raw_scores, vocab_dictionary):
         top_predictions.append((answer, prob))
     
     return top_predictions[::-1] # Reverse so we show results in descending order
+
+# Model names used by the model registry, the UI and any other front end
+VILT = "ViLT"
+VILT_FINETUNED = "ViLT Fine-Tuned"
+LXMERT = "LXMERT"
+LXMERT_FINETUNED = "LXMERT Fine-Tuned"
+
+# Model name -> setup function returning that model's tuple
+MODEL_SETUPS = {
+    VILT: setupViltTransformer,
+    VILT_FINETUNED: setupFineViltTransformer,
+    LXMERT: setupLxmertTransformer,
+    LXMERT_FINETUNED: setupLxmertTransformer_finetuned,
+}
+
+# ONNX export names of the ViLT models
+VILT_ONNX_NAMES = {
+    VILT: VILT_ONNX_NAME,
+    VILT_FINETUNED: FINE_VILT_ONNX_NAME,
+}
+
+# Earlier results, so re-asking a question about an unchanged frame does not re-run the model
+answer_cache = AnswerCache(capacity=settings["answer_cache"]["capacity"], ttl_s=settings["answer_cache"]["ttl_s"])
+
+def predictBatchForModel(model_name, model, questions, image, answer_only=False, use_cache=True):
+    '''
+    Answers a list of questions with the named model, where model is the tuple returned by its setup function.
+    Questions answer_cache already has a result for are not run again; pass use_cache=False to always run the model
+    (e.g. when timing or comparing models).
+
+    A cached result gets fresh timings holding only the lookup. Its visualizations are shared with the request that
+    computed them, so explainers that run after a cache hit are timed into that request's timings (and its metrics
+    lines), not into the returned result's.
+    '''
+    if not use_cache or not answer_cache.enabled:
+        return _predictBatch(model_name, model, questions, image, answer_only)
+
+    start = time.perf_counter()
+    frame_hash = perceptualFrameHash(image, hash_size=settings["answer_cache"]["hash_size"])
+    variant = _answerVariant(model_name, model, answer_only)
+    keys = [(model_name, normalizeQuestion(question), frame_hash, variant) for question in questions]
+    results = [answer_cache.get(key, answer_only) for key in keys]
+    lookup_seconds = time.perf_counter() - start
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if len(missing) < len(questions):
+        metrics_log.write({"time": round(time.time(), 3), "model": model_name, "answer_cache": answer_cache.stats()})
+    for i, result in enumerate(results):
+        # A cached result's timings are those of the request that computed it; this request only paid for the lookup
+        if result is not None:
+            timings = StageTimings(model_name, questions[i])
+            timings.add("answer cache hit", lookup_seconds)
+            results[i] = replace(result, timings=timings)
+    if missing:
+        predicted = _predictBatch(model_name, model, [questions[i] for i in missing], image, answer_only)
+        for i, result in zip(missing, predicted):
+            answer_cache.put(keys[i], result, answer_only)
+            results[i] = result
+
+    # A cached result may have been asked with different wording, or have visualizations an answer-only request skips.
+    # The visualizations are shared with the cached result, so ones generated earlier are served as they are.
+    for i, (question, result) in enumerate(zip(questions, results)):
+        if answer_only and len(result.visualizations):
+            result = replace(result, visualizations=LazyVisualizations(), visualization_names=[])
+        results[i] = replace(result, question=question) if result.question != question else result
+    return results
+
+def _answerVariant(model_name, model, answer_only):
+    '''
+    Describes how the model computes an answer (precision, int8 quantization, ViLT backend), so answers computed
+    with other settings are not served from the cache
+    '''
+    backend = "torch"
+    if model_name in (VILT, VILT_FINETUNED) and answer_only and model[2] is not None:
+        backend = "onnxruntime"
+    quantized = any(isQuantized(item) for item in model)
+    return f"{autocastDtype()}|{'int8' if quantized else 'fp32 weights'}|{backend}"
+
+def _predictBatch(model_name, model, questions, image, answer_only):
+    timings = StageTimings(model_name, "; ".join(questions))
+    if model_name in (VILT, VILT_FINETUNED):
+        vilt_model, processor, onnx_model = model
+        return predictViltBatch(vilt_model, processor, questions, image, answer_only=answer_only, onnx_model=onnx_model,
+                                timings=timings)
+    return predictLxmertBatch(*model, questions, image, answer_only=answer_only, timings=timings)
+
+def predictForModel(model_name, model, question, image, answer_only=False, use_cache=True):
+    return predictBatchForModel(model_name, model, [question], image, answer_only=answer_only, use_cache=use_cache)[0]
+
+# Synthetic input used to warm up models at startup
+WARM_UP_QUESTION = "What is in the image?"
+WARM_UP_FRAME_SHAPE = (480, 640, 3)
+
+def warmUpModel(model_name, model):
+    '''
+    Runs a synthetic frame and question through a model, each of its explainers and its answer-only path, so the
+    first real question does not pay for allocator growth, lazy kernel initialization, tokenizer setup or FRCNN
+    anchor generation. Returns the time taken in seconds.
+    '''
+    start = time.perf_counter()
+    frame = np.random.default_rng(0).integers(0, 256, size=WARM_UP_FRAME_SHAPE, dtype=np.uint8)
+
+    # Warm-up timings are not representative, so they stay out of the metrics file
+    with unloggedTimings():
+        result = predictForModel(model_name, model, WARM_UP_QUESTION, frame, use_cache=False)
+        for _ in result.visualizations:
+            pass
+        predictForModel(model_name, model, WARM_UP_QUESTION, frame, answer_only=True, use_cache=False)
+
+    # Do not keep the synthetic frame's detections in the cache, but leave the operator's frames alone
+    frcnn_cache.discard((frameDigest(frame), str(autocastDtype())))
+
+    return time.perf_counter() - start
@@ -0,0 +1,168 @@
+# This Python file uses the following encoding: utf-8
+# Loads models by name on first use and keeps them within a RAM budget
+
+import gc
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+def torchModules(model):
+    '''Yields the torch modules in a model tuple, including those held by service objects (e.g. a shared detector)'''
+    items = model if isinstance(model, (tuple, list)) else (model,)
+    for item in items:
+        if isinstance(item, torch.nn.Module):
+            yield item
+        elif hasattr(item, "__dict__"):
+            yield from (value for value in vars(item).values() if isinstance(value, torch.nn.Module))
+
+def modelSizeBytes(*models):
+    '''Returns the parameter + buffer bytes of every torch module in the model tuples, counting shared tensors once'''
+    seen = set()
+    total = 0
+    for model in models:
+        for module in torchModules(model):
+            tensors = list(module.parameters()) + list(module.buffers())
+            # Dynamically quantized layers keep their int8 weights in packed params rather than parameters
+            for submodule in module.modules():
+                if callable(getattr(submodule, "_weight_bias", None)):
+                    tensors.extend(t for t in submodule._weight_bias() if t is not None)
+            for tensor in tensors:
+                if tensor.data_ptr() in seen:
+                    continue
+                seen.add(tensor.data_ptr())
+                total += tensor.element_size() * tensor.nelement()
+    return total
+
+
+class ModelRegistry:
+    '''
+    Registry of models keyed by name.
+
+    Models are built by their setup function the first time they are needed, on a background thread. get() blocks
+    until the model is ready; load() only starts loading and returns a Future. Once the loaded models exceed
+    budget_mb (0 means no limit), the least-recently-used ones are evicted. Evicted models are loaded again on
+    their next use.
+
+    Up to max_parallel_loads models are built at the same time; further loads wait their turn.
+
+    Listeners are called as listener(event, name, details) from whichever thread the event happened on, with events
+    "queued", "loading", "loaded", "failed" and "evicted".
+    '''
+    def __init__(self, setups, budget_mb=0, max_parallel_loads=1):
+        self.setups = setups
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self._loaded = OrderedDict() # name -> (model, size in bytes), least recently used first
+        self._loading = {} # name -> Future
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel_loads, thread_name_prefix="ModelLoad")
+
+    def addListener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, event, name, **details):
+        text = ", ".join(f"{key}={value}" for key, value in details.items())
+        print(f"[ModelRegistry] {event} {name} {text}".rstrip())
+        for listener in self._listeners:
+            try:
+                listener(event, name, details)
+            except Exception:
+                traceback.print_exc()
+
+    def names(self):
+        return list(self.setups.keys())
+
+    def isLoaded(self, name):
+        with self._lock:
+            return name in self._loaded
+
+    def loadedModels(self):
+        with self._lock:
+            return list(self._loaded.keys())
+
+    def totalBytes(self):
+        '''Bytes held by the loaded models. Components shared between models (e.g. the FRCNN detector) count once.'''
+        with self._lock:
+            return modelSizeBytes(*(model for model, _ in self._loaded.values()))
+
+    def load(self, name):
+        '''Starts loading a model in the background (if it is not loaded or loading already) and returns a Future'''
+        if name not in self.setups:
+            raise KeyError(f"Unknown model '{name}'. Available models: {', '.join(self.setups)}")
+
+        with self._lock:
+            if name in self._loading:
+                return self._loading[name]
+            self._notify("queued", name)
+            future = self._executor.submit(self._loadModel, name)
+            self._loading[name] = future
+            return future
+
+    def get(self, name):
+        '''Returns the loaded model, loading it first if necessary, and marks it as most recently used'''
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name][0]
+            future = self.load(name)
+
+        model = future.result()
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+        return model
+
+    def _loadModel(self, name):
+        with self._lock:
+            if name in self._loaded:
+                self._loading.pop(name, None)
+                return self._loaded[name][0]
+
+        self._notify("loading", name)
+        start = time.perf_counter()
+        try:
+            model = self.setups[name]()
+        except Exception as error:
+            with self._lock:
+                self._loading.pop(name, None)
+            self._notify("failed", name, error=repr(error))
+            raise
+
+        size = modelSizeBytes(model)
+        with self._lock:
+            self._loaded[name] = (model, size)
+            self._loading.pop(name, None)
+        self._notify("loaded", name, seconds=round(time.perf_counter() - start, 1), size_mb=round(size / 2**20))
+
+        self._evictOverBudget(keep=name)
+        return model
+
+    def evict(self, name):
+        with self._lock:
+            entry = self._loaded.pop(name, None)
+        if entry is None:
+            return
+        size = entry[1]
+        del entry
+        gc.collect()
+        self._notify("evicted", name, size_mb=round(size / 2**20), total_mb=round(self.totalBytes() / 2**20))
+
+    def _evictOverBudget(self, keep):
+        if self.budget_bytes <= 0:
+            return
+        while True:
+            with self._lock:
+                if self.totalBytes() <= self.budget_bytes:
+                    return
+                candidates = [name for name in self._loaded if name != keep]
+                if not candidates:
+                    return
+            self.evict(candidates[0])
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
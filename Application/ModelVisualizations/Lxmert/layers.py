@@ -1,10 +1,34 @@
+import threading
+from contextlib import contextmanager
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.ao.nn.quantized.dynamic as nnqd
 
 __all__ = ['forward_hook', 'Clone', 'Add', 'Cat', 'ReLU', 'GELU', 'Dropout', 'BatchNorm2d', 'Linear', 'MaxPool2d',
            'AdaptiveAvgPool2d', 'AvgPool2d', 'Conv2d', 'Sequential', 'safe_divide', 'einsum', 'Softmax', 'IndexSelect',
-           'LayerNorm', 'AddEye', 'Tanh', 'MatMul', 'Mul']
+           'LayerNorm', 'AddEye', 'Tanh', 'MatMul', 'Mul', 'QuantizedLinear', 'capture_enabled',
+           'no_relevance_capture']
+
+
+# Relevance capture (stored layer inputs, attention maps and attention gradients) is only needed by the explainers.
+# The switch is per thread so an answer-only forward never disables capture for an explainer running elsewhere.
+_capture_state = threading.local()
+
+
+def capture_enabled():
+    return getattr(_capture_state, "enabled", True)
+
+
+@contextmanager
+def no_relevance_capture():
+    previous = capture_enabled()
+    _capture_state.enabled = False
+    try:
+        yield
+    finally:
+        _capture_state.enabled = previous
 
 
 def safe_divide(a, b):
@@ -14,6 +38,8 @@ def safe_divide(a, b):
 
 
 def forward_hook(self, input, output):
+    if not capture_enabled():
+        return
     if type(input[0]) in (list, tuple):
         self.X = []
         for i in input[0]:
@@ -216,30 +242,73 @@ class BatchNorm2d(nn.BatchNorm2d, RelProp):
         return R
 
 
+def _linear_relprop(module, weight, R, alpha):
+    beta = alpha - 1
+    pw = torch.clamp(weight, min=0)
+    nw = torch.clamp(weight, max=0)
+    px = torch.clamp(module.X, min=0)
+    nx = torch.clamp(module.X, max=0)
+
+    def f(w1, w2, x1, x2):
+        Z1 = F.linear(x1, w1)
+        Z2 = F.linear(x2, w2)
+        S1 = safe_divide(R, Z1 + Z2)
+        S2 = safe_divide(R, Z1 + Z2)
+        C1 = x1 * module.gradprop(Z1, x1, S1)[0]
+        C2 = x2 * module.gradprop(Z2, x2, S2)[0]
+
+        return C1 + C2
+
+    activator_relevances = f(pw, nw, px, nx)
+    inhibitor_relevances = f(nw, pw, px, nx)
+
+    R = alpha * activator_relevances - beta * inhibitor_relevances
+
+    return R
+
+
 class Linear(nn.Linear, RelProp):
     def relprop(self, R, alpha):
-        beta = alpha - 1
-        pw = torch.clamp(self.weight, min=0)
-        nw = torch.clamp(self.weight, max=0)
-        px = torch.clamp(self.X, min=0)
-        nx = torch.clamp(self.X, max=0)
+        return _linear_relprop(self, self.weight, R, alpha)
 
-        def f(w1, w2, x1, x2):
-            Z1 = F.linear(x1, w1)
-            Z2 = F.linear(x2, w2)
-            S1 = safe_divide(R, Z1 + Z2)
-            S2 = safe_divide(R, Z1 + Z2)
-            C1 = x1 * self.gradprop(Z1, x1, S1)[0]
-            C2 = x2 * self.gradprop(Z2, x2, S2)[0]
 
-            return C1 + C2
+class _QuantizedLinearFunction(torch.autograd.Function):
+    # The int8 dynamic linear kernel has no derivative; back-propagate through the dequantized weight instead
+    @staticmethod
+    def forward(ctx, input, module):
+        ctx.module = module
+        return nnqd.Linear.forward(module, input)
 
-        activator_relevances = f(pw, nw, px, nx)
-        inhibitor_relevances = f(nw, pw, px, nx)
+    @staticmethod
+    def backward(ctx, grad_output):
+        return grad_output.matmul(ctx.module.weight().dequantize().to(grad_output.dtype)), None
 
-        R = alpha * activator_relevances - beta * inhibitor_relevances
 
-        return R
+class QuantizedLinear(nnqd.Linear, RelProp):
+    '''
+    Dynamic int8 version of Linear. Weights are stored as int8 and activations are quantized on the fly.
+    Gradients and relevance are propagated with the dequantized weights, so the explainers keep working.
+    '''
+    def forward(self, x):
+        if torch.is_grad_enabled() and x.requires_grad:
+            return _QuantizedLinearFunction.apply(x, self)
+        return super().forward(x)
+
+    def relprop(self, R, alpha):
+        return _linear_relprop(self, self.weight().dequantize(), R, alpha)
+
+    @classmethod
+    def from_float(cls, mod):
+        # nnqd.Linear.from_float only accepts plain nn.Linear modules
+        qconfig = getattr(mod, 'qconfig', None)
+        observer = qconfig.weight() if qconfig is not None else torch.ao.quantization.default_weight_observer()
+        observer(mod.weight)
+        scale, zero_point = observer.calculate_qparams()
+        qweight = torch.quantize_per_tensor(mod.weight.detach().float(), float(scale), int(zero_point), torch.qint8)
+
+        qlinear = cls(mod.in_features, mod.out_features, dtype=torch.qint8)
+        qlinear.set_weight_bias(qweight, None if mod.bias is None else mod.bias.detach())
+        return qlinear
 
 
 class Conv2d(nn.Conv2d, RelProp):
@@ -1,17 +1,17 @@
 # LXMERT visualization generator. Based on work from: https://github.com/hila-chefer/Transformer-MM-Explainability
 
 import torch
-import cv2
 import copy
 import numpy as np
 
 # Visualization Creator Function
-# Note: For best results, open the saved visualization
-def create_image_vis(img, image_scores, rcnn_dict: dict, output_path: str) -> str:
+def create_image_vis(img, image_scores, rcnn_dict: dict) -> np.ndarray:
+    '''
+    Weights each FRCNN box of the RGB image by its relevance score and returns the result as a uint8 RGB array.
+    '''
     bbox_scores = image_scores
 
     mask = torch.zeros(img.shape[0], img.shape[1])
-    print(mask.shape)
 
     for index in range(len(bbox_scores)):
         
@@ -27,11 +27,9 @@ def create_image_vis(img, image_scores, rcnn_dict: dict, output_path: str) -> st
     img = img * img_multiplier
     img *= (255.0/img.max())
 
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
-
-    # Note: For some reason, the images don't display nicely unless they are written as files and then opened again
-    cv2.imwrite(output_path, img)
-    return output_path
+    # Same normalization the old JPEG write/read gave us: round and saturate to 8-bit, NaNs (flat masks) become black
+    img = np.nan_to_num(img, nan=0.0, posinf=255.0, neginf=0.0)
+    return np.clip(np.rint(img), 0, 255).astype(np.uint8)
 
 # Extra Rules and Visualization Helper Functions
 
@@ -90,13 +88,30 @@ def handle_residual(orig_self_attention):
     return self_attention
 
 # Supports Bi-Modal Transformer Explainability, Gradcam, and Attention Rollout
+# batch_index selects which question of a batched forward pass the relevancy maps are generated for
 class LxmertVisualizationGenerator: 
-    def __init__(self, model, rcnn_dict: dict, inputs, outputs, save_visualization=False):
+    def __init__(self, model, rcnn_dict: dict, inputs, outputs, save_visualization=False, batch_index=0):
         self.model = model
         self.rcnn_dict = rcnn_dict
         self.inputs = inputs
         self.outputs = outputs
         self.save_visualization = save_visualization
+        self.batch_index = batch_index
+
+    def _backward_from_answer(self, output, index):
+        # Back-propagate only from this question's answer score; other rows of the batch get no gradient
+        if index is None:
+            index = np.argmax(output[self.batch_index].cpu().data.numpy(), axis=-1)
+
+        one_hot = np.zeros((output.size()[0], output.size()[-1]), dtype=np.float32)
+        one_hot[self.batch_index, index] = 1
+        one_hot_vector = one_hot
+        one_hot = torch.from_numpy(one_hot).requires_grad_(True)
+        one_hot = torch.sum(one_hot.to(self.model.device) * output)
+
+        self.model.zero_grad()
+        one_hot.backward(retain_graph=True)
+        return one_hot_vector
 
     def _gradcam(self, cam, grad):
         cam = cam.reshape(-1, cam.shape[-2], cam.shape[-1]) # Becomes (12, 36, 20)
@@ -111,7 +126,7 @@ class LxmertVisualizationGenerator:
         model = self.model
 
         # initialize relevancy matrices
-        text_tokens = len(self.inputs.input_ids.flatten()) # By default question length is 20
+        text_tokens = len(self.inputs.input_ids[self.batch_index]) # By default question length is 20
         image_bboxes = self.rcnn_dict.get("roi_features").shape[1] # Max of 36 Boxes for LXMERT
 
         # text self attention matrix
@@ -124,29 +139,20 @@ class LxmertVisualizationGenerator:
         self.R_i_t = torch.zeros(image_bboxes, text_tokens).to(model.device)
 
 
-        if index == None:
-            index = np.argmax(output.cpu().data.numpy(), axis=-1)
-
-        one_hot = np.zeros((1, output.size()[-1]), dtype=np.float32)
-        one_hot[0, index] = 1
-        one_hot = torch.from_numpy(one_hot).requires_grad_(True)
-        one_hot = torch.sum(one_hot.to(self.model.device) * output)
-
-        model.zero_grad()
-        one_hot.backward(retain_graph=True)
+        self._backward_from_answer(output, index)
 
         # last cross attention + self- attention layer
         blk = model.lxmert.encoder.x_layers[-1]
         # cross attn cam will be the one used for the R_t_i matrix        
-        grad_t_i = blk.visual_attention.att.get_attn_gradients()[-1].detach()
-        cam_t_i = blk.visual_attention.att.get_attn()[-1].detach()
+        grad_t_i = blk.visual_attention.att.get_attn_gradients()[self.batch_index].detach()
+        cam_t_i = blk.visual_attention.att.get_attn()[self.batch_index].detach()
         cam_t_i = self._gradcam(cam_t_i, grad_t_i)
         # self.R_t_i = torch.matmul(self.R_t_t.t(), torch.matmul(cam_t_i, self.R_i_i))
         self.R_t_i = cam_t_i
 
         # language self attention
-        grad = blk.lang_self_att.self.get_attn_gradients()[-1].detach()
-        cam = blk.lang_self_att.self.get_attn()[-1].detach()
+        grad = blk.lang_self_att.self.get_attn_gradients()[self.batch_index].detach()
+        cam = blk.lang_self_att.self.get_attn()[self.batch_index].detach()
         self.R_t_t = self._gradcam(cam, grad)
 
         # disregard the [CLS] token itself
@@ -158,7 +164,7 @@ class LxmertVisualizationGenerator:
         model = self.model
 
         # initialize relevancy matrices
-        text_tokens = len(self.inputs.input_ids.flatten()) # By default question length is 20
+        text_tokens = len(self.inputs.input_ids[self.batch_index]) # By default question length is 20
         image_bboxes = self.rcnn_dict.get("roi_features").shape[1] # Max of 36 Boxes for LXMERT
 
         # text self attention matrix
@@ -175,7 +181,7 @@ class LxmertVisualizationGenerator:
         # language self attention
         blocks = model.lxmert.encoder.layer
         for blk in blocks:
-            cam = blk.attention.self.get_attn()[-1].detach()
+            cam = blk.attention.self.get_attn()[self.batch_index].detach()
             cam = cam.reshape(-1, cam.shape[-2], cam.shape[-1]).mean(dim=0)
             cams_text.append(cam)
 
@@ -183,7 +189,7 @@ class LxmertVisualizationGenerator:
         # image self attention
         blocks = model.lxmert.encoder.r_layers
         for blk in blocks:
-            cam = blk.attention.self.get_attn()[-1].detach()
+            cam = blk.attention.self.get_attn()[self.batch_index].detach()
             cam = cam.reshape(-1, cam.shape[-2], cam.shape[-1]).mean(dim=0)
             cams_image.append(cam)
 
@@ -197,12 +203,12 @@ class LxmertVisualizationGenerator:
                 break
 
             # language self attention
-            cam = blk.lang_self_att.self.get_attn()[-1].detach()
+            cam = blk.lang_self_att.self.get_attn()[self.batch_index].detach()
             cam = cam.reshape(-1, cam.shape[-2], cam.shape[-1]).mean(dim=0)
             cams_text.append(cam)
 
             # image self attention
-            cam = blk.visn_self_att.self.get_attn()[-1].detach()
+            cam = blk.visn_self_att.self.get_attn()[self.batch_index].detach()
             cam = cam.reshape(-1, cam.shape[-2], cam.shape[-1]).mean(dim=0)
             cams_image.append(cam)
 
@@ -210,7 +216,7 @@ class LxmertVisualizationGenerator:
         # take care of last cross attention layer- only text
         blk = model.lxmert.encoder.x_layers[-1]
         # cross attn cam will be the one used for the R_t_i matrix
-        cam_t_i = blk.visual_attention.att.get_attn()[-1].detach()
+        cam_t_i = blk.visual_attention.att.get_attn()[self.batch_index].detach()
         cam_t_i = cam_t_i.reshape(-1, cam_t_i.shape[-2], cam_t_i.shape[-1]).mean(dim=0)
         self.R_t_t = compute_rollout_attention(copy.deepcopy(cams_text))
         self.R_i_i = compute_rollout_attention(cams_image)
@@ -218,7 +224,7 @@ class LxmertVisualizationGenerator:
         
         #self.R_t_i = torch.matmul(self.R_t_t.t(), torch.matmul(cam_t_i, self.R_i_i))
         # language self attention
-        cam = blk.lang_self_att.self.get_attn()[-1].detach()
+        cam = blk.lang_self_att.self.get_attn()[self.batch_index].detach()
         cam = cam.reshape(-1, cam.shape[-2], cam.shape[-1]).mean(dim=0)
         cams_text.append(cam)
 
@@ -230,11 +236,11 @@ class LxmertVisualizationGenerator:
     
     def _handle_self_attention_lang(self, blocks):
         for blk in blocks:
-            grad = blk.attention.self.get_attn_gradients()[-1].detach()
+            grad = blk.attention.self.get_attn_gradients()[self.batch_index].detach()
             if self.use_lrp:
-                cam = blk.attention.self.get_attn_cam()[-1].detach()
+                cam = blk.attention.self.get_attn_cam()[self.batch_index].detach()
             else:
-                cam = blk.attention.self.get_attn()[-1].detach()
+                cam = blk.attention.self.get_attn()[self.batch_index].detach()
             cam = avg_heads(cam, grad)
             R_t_t_add, R_t_i_add = apply_self_attention_rules(self.R_t_t, self.R_t_i, cam)
             self.R_t_t += R_t_t_add
@@ -242,33 +248,33 @@ class LxmertVisualizationGenerator:
 
     def _handle_self_attention_image(self, blocks):
         for blk in blocks:
-            grad = blk.attention.self.get_attn_gradients()[-1].detach()
+            grad = blk.attention.self.get_attn_gradients()[self.batch_index].detach()
             if self.use_lrp:
-                cam = blk.attention.self.get_attn_cam()[-1].detach()
+                cam = blk.attention.self.get_attn_cam()[self.batch_index].detach()
             else:
-                cam = blk.attention.self.get_attn()[-1].detach()
+                cam = blk.attention.self.get_attn()[self.batch_index].detach()
             cam = avg_heads(cam, grad)
             R_i_i_add, R_i_t_add = apply_self_attention_rules(self.R_i_i, self.R_i_t, cam)
             self.R_i_i += R_i_i_add
             self.R_i_t += R_i_t_add
 
     def _handle_co_attn_self_lang(self, block):
-        grad = block.lang_self_att.self.get_attn_gradients().detach()
+        grad = block.lang_self_att.self.get_attn_gradients()[self.batch_index].detach()
         if self.use_lrp:
-            cam = block.lang_self_att.self.get_attn_cam()[-1].detach()
+            cam = block.lang_self_att.self.get_attn_cam()[self.batch_index].detach()
         else:
-            cam = block.lang_self_att.self.get_attn()[-1].detach()
+            cam = block.lang_self_att.self.get_attn()[self.batch_index].detach()
         cam = avg_heads(cam, grad)
         R_t_t_add, R_t_i_add = apply_self_attention_rules(self.R_t_t, self.R_t_i, cam)
         self.R_t_t += R_t_t_add
         self.R_t_i += R_t_i_add
 
     def _handle_co_attn_self_image(self, block):
-        grad = block.visn_self_att.self.get_attn_gradients()[-1].detach()
+        grad = block.visn_self_att.self.get_attn_gradients()[self.batch_index].detach()
         if self.use_lrp:
-            cam = block.visn_self_att.self.get_attn_cam()[-1].detach()
+            cam = block.visn_self_att.self.get_attn_cam()[self.batch_index].detach()
         else:
-            cam = block.visn_self_att.self.get_attn()[-1].detach()
+            cam = block.visn_self_att.self.get_attn()[self.batch_index].detach()
         cam = avg_heads(cam, grad)
         R_i_i_add, R_i_t_add = apply_self_attention_rules(self.R_i_i, self.R_i_t, cam)
         self.R_i_i += R_i_i_add
@@ -276,10 +282,10 @@ class LxmertVisualizationGenerator:
 
     def _handle_co_attn_lang(self, block):
         if self.use_lrp:
-            cam_t_i = block.visual_attention.att.get_attn_cam()[-1].detach()
+            cam_t_i = block.visual_attention.att.get_attn_cam()[self.batch_index].detach()
         else:
-            cam_t_i = block.visual_attention.att.get_attn()[-1].detach()
-        grad_t_i = block.visual_attention.att.get_attn_gradients()[-1].detach()
+            cam_t_i = block.visual_attention.att.get_attn()[self.batch_index].detach()
+        grad_t_i = block.visual_attention.att.get_attn_gradients()[self.batch_index].detach()
         cam_t_i = avg_heads(cam_t_i, grad_t_i)
         R_t_i_addition, R_t_t_addition = apply_mm_attention_rules(self.R_t_t, self.R_i_i, self.R_i_t, cam_t_i,
                                                                   apply_normalization=self.normalize_self_attention,
@@ -288,10 +294,10 @@ class LxmertVisualizationGenerator:
 
     def _handle_co_attn_image(self, block):
         if self.use_lrp:
-            cam_i_t = block.visual_attention_copy.att.get_attn_cam()[-1].detach()
+            cam_i_t = block.visual_attention_copy.att.get_attn_cam()[self.batch_index].detach()
         else:
-            cam_i_t = block.visual_attention_copy.att.get_attn()[-1].detach()
-        grad_i_t = block.visual_attention_copy.att.get_attn_gradients().detach()
+            cam_i_t = block.visual_attention_copy.att.get_attn()[self.batch_index].detach()
+        grad_i_t = block.visual_attention_copy.att.get_attn_gradients()[self.batch_index].detach()
         cam_i_t = avg_heads(cam_i_t, grad_i_t)
         R_i_t_addition, R_i_i_addition = apply_mm_attention_rules(self.R_i_i, self.R_t_t, self.R_t_i, cam_i_t,
                                                                   apply_normalization=self.normalize_self_attention,
@@ -309,7 +315,7 @@ class LxmertVisualizationGenerator:
         model = self.model
 
         # initialize relevancy matrices
-        text_tokens = len(self.inputs.input_ids.flatten()) # By default question length is 20
+        text_tokens = len(self.inputs.input_ids[self.batch_index]) # By default question length is 20
         image_bboxes = self.rcnn_dict.get("roi_features").shape[1] # Max of 36 Boxes for LXMERT
 
         # text self attention matrix
@@ -321,17 +327,7 @@ class LxmertVisualizationGenerator:
         # impact of text on images
         self.R_i_t = torch.zeros(image_bboxes, text_tokens).to(model.device)
 
-        if index is None:
-            index = np.argmax(output.cpu().data.numpy(), axis=-1)
-
-        one_hot = np.zeros((1, output.size()[-1]), dtype=np.float32)
-        one_hot[0, index] = 1
-        one_hot_vector = one_hot
-        one_hot = torch.from_numpy(one_hot).requires_grad_(True)
-        one_hot = torch.sum(one_hot.to(self.model.device) * output) 
-
-        model.zero_grad()
-        one_hot.backward(retain_graph=True)
+        one_hot_vector = self._backward_from_answer(output, index)
         if self.use_lrp:
             model.relprop(torch.tensor(one_hot_vector).to(output.device), **kwargs)
 
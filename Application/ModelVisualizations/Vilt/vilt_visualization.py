@@ -2,6 +2,7 @@ from PIL import Image
 import numpy as np
 import torch
 import torch.nn.functional as F
+from contextlib import nullcontext
 
 # Based on: https://huggingface.co/spaces/MikailDuzenli/vilt_demo/blob/main/app.py
 
@@ -88,7 +89,7 @@ def get_model_embedding_and_mask(model, input_ids, pixel_values):
     return text_embeds, image_embeds, attention_mask, image_masks, patch_index
 
 
-def get_visualization_for_token(model, encoding, image):
+def get_visualization_for_token(model, encoding, image, stage_timer=None):
     '''
     We obtain the attention mapping for each token of input text. 
     This creates of images containing attention based on each token. 
@@ -97,34 +98,39 @@ def get_visualization_for_token(model, encoding, image):
     Note: ViLT was not made with visual grounding in mind. 
     It is possible that the model may be focusing on incorrect aspects of an image when making its predictions.
 
+    stage_timer, when given, takes a stage name and returns a context manager timing that stage.
     '''
+    if stage_timer is None:
+        stage_timer = lambda name: nullcontext()
+
     # Ensure image is PIL image type
     if type(image) != Image:
         image = Image.fromarray(image)
 
-    txt_emb, img_emb, text_masks, image_masks, patch_index = get_model_embedding_and_mask(
-            model, input_ids=encoding['input_ids'], pixel_values=encoding['pixel_values'])
+    with stage_timer("ViLT explainer forward"):
+        txt_emb, img_emb, text_masks, image_masks, patch_index = get_model_embedding_and_mask(
+                model, input_ids=encoding['input_ids'], pixel_values=encoding['pixel_values'])
 
-    number_tokens = len(encoding['input_ids'][0])
-    input_ids = encoding['input_ids']
+        number_tokens = len(encoding['input_ids'][0])
+        input_ids = encoding['input_ids']
 
-    embedding_output = torch.cat([txt_emb, img_emb], dim=1)
-    attention_mask = torch.cat([text_masks, image_masks], dim=1)
+        embedding_output = torch.cat([txt_emb, img_emb], dim=1)
+        attention_mask = torch.cat([text_masks, image_masks], dim=1)
 
-    extended_attention_mask = model.vilt.get_extended_attention_mask(
-        attention_mask, input_ids.size(), device=device)
+        extended_attention_mask = model.vilt.get_extended_attention_mask(
+            attention_mask, input_ids.size(), device=device)
 
-    encoder_outputs = model.vilt.encoder(
-        embedding_output,
-        attention_mask=extended_attention_mask,
-        head_mask=None,
-        output_attentions=False,
-        output_hidden_states=True,
-        return_dict=True,
-    )
+        encoder_outputs = model.vilt.encoder(
+            embedding_output,
+            attention_mask=extended_attention_mask,
+            head_mask=None,
+            output_attentions=False,
+            output_hidden_states=True,
+            return_dict=True,
+        )
 
-    x = encoder_outputs.hidden_states[-1]
-    x = model.vilt.layernorm(x)
+        x = encoder_outputs.hidden_states[-1]
+        x = model.vilt.layernorm(x)
 
     txt_emb, img_emb = (
         x[:, :txt_emb.shape[1]],
@@ -149,16 +155,17 @@ def get_visualization_for_token(model, encoding, image):
                 keepdim=False)).to(dtype=cost.dtype)
     img_len = (img_pad.size(1) - img_pad.sum(dim=1,
                 keepdim=False)).to(dtype=cost.dtype)
-    T = ipot(cost.detach(),
-                txt_len,
-                txt_pad,
-                img_len,
-                img_pad,
-                joint_pad,
-                0.1,
-                1000,
-                1,
-                )
+    with stage_timer("ViLT ipot alignment"):
+        T = ipot(cost.detach(),
+                    txt_len,
+                    txt_pad,
+                    img_len,
+                    img_pad,
+                    joint_pad,
+                    0.1,
+                    1000,
+                    1,
+                    )
     plan = T[0]
     plan_single = plan * len(txt_emb)
 
@@ -172,29 +179,30 @@ def get_visualization_for_token(model, encoding, image):
     results = []
 
     # Obtain all the attention maps for each token
-    for hidx in range(number_tokens):
-        cost_ = original_cost_[hidx][1:].to(device)
-
-        heatmap = torch.zeros(H, W)
-        for i, pidx in enumerate(patch_index[0]):
-            h, w = pidx[0].item(), pidx[1].item()
-            heatmap[h, w] = cost_[i]
-
-        heatmap = (heatmap - heatmap.mean()) / heatmap.std()
-        heatmap = np.clip(heatmap, 1.0, 3.0)
-        heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min())
-
-        _w, _h = image.size
-        overlay = Image.fromarray(np.uint8(heatmap * 255), "L").resize(
-            (_w, _h), resample=Image.Resampling.NEAREST
-        )
-
-        image_rgba = image.copy()
-        image_rgba.putalpha(overlay)
-        result = image_rgba
-
-        overlays.append(overlay)
-        results.append(result)
+    with stage_timer("ViLT heatmaps"):
+        for hidx in range(number_tokens):
+            cost_ = original_cost_[hidx][1:].to(device)
+
+            heatmap = torch.zeros(H, W)
+            for i, pidx in enumerate(patch_index[0]):
+                h, w = pidx[0].item(), pidx[1].item()
+                heatmap[h, w] = cost_[i]
+
+            heatmap = (heatmap - heatmap.mean()) / heatmap.std()
+            heatmap = np.clip(heatmap, 1.0, 3.0)
+            heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min())
+
+            _w, _h = image.size
+            overlay = Image.fromarray(np.uint8(heatmap * 255), "L").resize(
+                (_w, _h), resample=Image.Resampling.NEAREST
+            )
+
+            image_rgba = image.copy()
+            image_rgba.putalpha(overlay)
+            result = image_rgba
+
+            overlays.append(overlay)
+            results.append(result)
 
     return overlays, results
 
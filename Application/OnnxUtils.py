@@ -0,0 +1,127 @@
+# This Python file uses the following encoding: utf-8
+# ONNX export of the ViLT answer head and an ONNX Runtime backend for answer-only requests.
+# onnxruntime is an optional dependency; it is only imported when the ONNX backend is enabled in the settings.
+
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from transformers import ViltConfig
+
+from SettingsUtils import settings
+
+# Inputs produced by ViltProcessor, in the order the exported graph takes them
+VILT_INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids", "pixel_values", "pixel_mask"]
+VILT_DYNAMIC_AXES = {
+    "input_ids": {0: "batch", 1: "sequence"},
+    "attention_mask": {0: "batch", 1: "sequence"},
+    "token_type_ids": {0: "batch", 1: "sequence"},
+    "pixel_values": {0: "batch", 2: "height", 3: "width"},
+    "pixel_mask": {0: "batch", 1: "height", 2: "width"},
+    "logits": {0: "batch"},
+}
+
+def onnxPaths(name):
+    '''Returns the (graph, config) paths of an exported model in the configured ONNX folder'''
+    onnx_dir = Path(settings["vilt"]["onnx_dir"])
+    return onnx_dir / f"{name}.onnx", onnx_dir / f"{name}.config.json"
+
+
+class _ViltLogits(torch.nn.Module):
+    '''Exposes only the answer logits so the exported graph has plain tensor inputs and a single output'''
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids, pixel_values, pixel_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids,
+                          pixel_values=pixel_values, pixel_mask=pixel_mask).logits
+
+
+def exportVilt(model, encoding, name, opset_version=14):
+    '''
+    Exports a ViltForQuestionAnswering model to ONNX with dynamic batch, sequence and image size axes.
+    encoding is a sample processor output used to trace the model. Returns the (graph, config) paths.
+    '''
+    onnx_path, config_path = onnxPaths(name)
+    onnx_path.parent.mkdir(parents=True, exist_ok=True)
+
+    model.eval()
+    sample = tuple(encoding[input_name].contiguous() for input_name in VILT_INPUT_NAMES)
+    with torch.no_grad():
+        torch.onnx.export(
+            _ViltLogits(model),
+            sample,
+            str(onnx_path),
+            input_names=VILT_INPUT_NAMES,
+            output_names=["logits"],
+            dynamic_axes=VILT_DYNAMIC_AXES,
+            opset_version=opset_version,
+            do_constant_folding=True,
+        )
+
+    # The label map and text limits are needed at inference time without loading the PyTorch model
+    model.config.to_json_file(str(config_path))
+    return onnx_path, config_path
+
+
+class OnnxViltModel:
+    '''
+    Runs an exported ViLT graph with ONNX Runtime on the CPU.
+
+    Called like ViltForQuestionAnswering for the answer forward (model(**encoding).logits) and exposes the same
+    config, so predictViltBatch can use either. It cannot produce the attention visualizations.
+    '''
+    def __init__(self, onnx_path, config_path, threads=0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+
+        self.session = onnxruntime.InferenceSession(str(onnx_path), options, providers=["CPUExecutionProvider"])
+        self.config = ViltConfig.from_json_file(str(config_path))
+
+    def __call__(self, **encoding):
+        # ONNX Runtime needs contiguous arrays; the pixel tensors are usually expanded views of one image
+        feeds = {name: np.ascontiguousarray(encoding[name].cpu().numpy()) for name in VILT_INPUT_NAMES}
+        logits, = self.session.run(["logits"], feeds)
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def loadOnnxVilt(name):
+    '''
+    Returns an OnnxViltModel for the exported model when the ONNX Runtime ViLT backend is enabled in the settings,
+    otherwise None. Missing exports or a missing onnxruntime package fall back to PyTorch with a message.
+    '''
+    if settings["vilt"]["backend"] != "onnxruntime":
+        return None
+
+    onnx_path, config_path = onnxPaths(name)
+    if not onnx_path.exists() or not config_path.exists():
+        print(f"ONNX export {onnx_path} not found, using PyTorch for {name}. Create it with export_onnx.py")
+        return None
+
+    try:
+        return OnnxViltModel(onnx_path, config_path, threads=settings["vilt"]["onnx_threads"])
+    except ImportError:
+        print(f"onnxruntime is not installed, using PyTorch for {name}")
+    except Exception as error:
+        print(f"Could not load {onnx_path} with ONNX Runtime, using PyTorch for {name}: {error}")
+    return None
+
+
+def compareVilt(model, onnx_model, encoding):
+    '''
+    Runs the PyTorch model and the ONNX Runtime graph on the same encoding.
+    Returns the largest absolute logit difference and the fraction of rows with the same top answer.
+    '''
+    with torch.no_grad():
+        expected = model(**{name: encoding[name] for name in VILT_INPUT_NAMES}).logits
+    actual = onnx_model(**encoding).logits
+
+    max_difference = (expected - actual).abs().max().item()
+    agreement = (expected.argmax(-1) == actual.argmax(-1)).float().mean().item()
+    return max_difference, agreement
@@ -0,0 +1,330 @@
+# This Python file uses the following encoding: utf-8
+# Runs inference in dedicated worker processes so model work never holds the GUI process's GIL.
+#
+# Frames and visualizations cross the process boundary through shared memory blocks; only small descriptors and
+# answers are pickled. Model weights are moved into shared memory once in the GUI process and mapped read-only by
+# every worker, so N workers do not hold N copies of the models.
+
+import gc
+import itertools
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+import torch.multiprocessing
+
+from CancellationUtils import InferenceCancelled, cancellationScope, waitCancellable
+from ModelPredictionUtils import (LazyVisualizations, PredictionResults, VILT_ONNX_NAMES, predictBatchForModel,
+                                  warmUpModel)
+from ModelRegistry import torchModules
+from OnnxUtils import OnnxViltModel, loadOnnxVilt
+from TimingUtils import StageTimings, metrics_log
+
+
+def putSharedArray(array):
+    '''Copies an array into a new shared memory block. Returns the block and a picklable (name, shape, dtype).'''
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+def readSharedArray(descriptor, unlink=False):
+    '''Copies an array out of the shared memory block described by descriptor, optionally freeing the block'''
+    name, shape, dtype = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf).copy()
+    finally:
+        block.close()
+        if unlink:
+            block.unlink()
+
+def shareableModel(model):
+    '''
+    Moves a model tuple's torch weights into shared memory and returns the tuple to send to the workers. ONNX Runtime
+    sessions cannot be sent, so workers open their own. Quantized int8 weights are packed outside torch storages and
+    are copied rather than shared. Weights memory-mapped from .safetensors files (models.mapped_weights) are copied
+    into shared memory as well, so with the pool enabled they are read in full when a model is first sent to a worker
+    rather than paged in lazily; they are still held once, not once per worker.
+    '''
+    for module in torchModules(model):
+        module.share_memory()
+    return tuple(None if isinstance(item, OnnxViltModel) else item for item in model)
+
+
+class _WorkerCancellation:
+    '''Cancellation token of a predict request in a worker process: the GUI process writes its id to cancelled'''
+    def __init__(self, cancelled, request_id):
+        self.cancelled = cancelled
+        self.request_id = request_id
+
+    def check(self):
+        if self.cancelled.value == self.request_id:
+            raise InferenceCancelled()
+
+
+def _workerMain(requests, responses, threads, cancelled):
+    '''
+    Worker process loop. Requests are (kind, request id, *arguments); replies are (request id, result, error).
+    cancelled is a shared value holding the id of the last request the GUI process cancelled; a predict request
+    with that id stops at its next pipeline stage.
+    '''
+    torch.set_num_threads(threads)
+    # Stage timings are sent back with the answers and written to the metrics file by the GUI process
+    metrics_log.enabled = False
+    models = {}
+    results = OrderedDict() # result key -> PredictionResults, for visualizations generated later
+    exported = {} # shared memory name -> block holding a visualization the GUI process has not copied yet
+
+    while True:
+        kind, request_id, *arguments = requests.get()
+        if kind == "stop":
+            break
+
+        try:
+            reply = None
+            if kind == "model":
+                name, model = arguments
+                if name in VILT_ONNX_NAMES and model[2] is None:
+                    model = (model[0], model[1], loadOnnxVilt(VILT_ONNX_NAMES[name]))
+                models[name] = model
+            elif kind == "unload":
+                models.pop(arguments[0], None)
+                gc.collect()
+            elif kind == "warm_up":
+                reply = warmUpModel(arguments[0], models[arguments[0]])
+            elif kind == "predict":
+                name, questions, frame, answer_only = arguments
+                image = readSharedArray(frame)
+                reply = []
+                with cancellationScope(_WorkerCancellation(cancelled, request_id)):
+                    predicted = predictBatchForModel(name, models[name], questions, image, answer_only=answer_only)
+                for result in predicted:
+                    key = None
+                    if len(result.visualizations):
+                        key = uuid.uuid4().hex
+                        results[key] = result
+                        while len(results) > 64:
+                            results.popitem(last=False)
+                    reply.append({
+                        "question": result.question,
+                        "model_used": result.model_used,
+                        "prediction": result.prediction,
+                        "top_predictions": [(answer, float(probability)) for answer, probability in result.top_predictions],
+                        "visualization_names": result.visualization_names,
+                        "encoded_tokens": result.encoded_tokens,
+                        "decoded_tokens": result.decoded_tokens,
+                        "timings": result.timings.stages(),
+                        "key": key,
+                    })
+            elif kind == "visualize":
+                key, index = arguments
+                if key not in results:
+                    raise KeyError("Prediction result is no longer kept by the worker")
+                # The block stays open until the GUI process has copied it (Windows frees unreferenced blocks)
+                block, reply = putSharedArray(results[key].visualizations[index])
+                exported[block.name] = block
+            elif kind == "free":
+                exported.pop(arguments[0]).close()
+        except Exception as error:
+            if request_id is not None:
+                responses.put((request_id, None, repr(error)))
+            continue
+
+        if request_id is not None:
+            responses.put((request_id, reply, None))
+
+
+class InferenceProcessPool:
+    '''
+    Worker processes that answer questions for the GUI.
+
+    predict() has the same interface as ServerUtils.InferenceClient.predict(), so the GUI uses either one the same
+    way. Models are loaded through the GUI process's model registry, shared with each worker on its first request for
+    that model, and unloaded from the workers when the registry evicts them.
+
+    A worker that dies (crash, out of memory) fails its pending requests and gets no new ones; requests that take
+    longer than timeout_s seconds raise TimeoutError instead of blocking the caller forever. A predict() whose
+    cancellation token (see CancellationUtils) is cancelled while it waits stops the worker at its next pipeline
+    stage and raises InferenceCancelled.
+    '''
+    def __init__(self, modelRegistry, workers=2, threads_per_worker=1, timeout_s=300):
+        self.modelRegistry = modelRegistry
+        self.timeout_s = timeout_s
+        context = torch.multiprocessing.get_context("spawn")
+        self._responses = context.Queue()
+        self._queues = [context.Queue() for _ in range(workers)]
+        self._cancelled = [context.Value("q", -1) for _ in range(workers)] # last cancelled request id per worker
+        self._processes = [context.Process(target=_workerMain,
+                                           args=(requests, self._responses, threads_per_worker, cancelled),
+                                           name=f"InferenceWorker-{index}", daemon=True)
+                           for index, (requests, cancelled) in enumerate(zip(self._queues, self._cancelled))]
+        for process in self._processes:
+            process.start()
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._futures = {} # request id -> (worker, Future)
+        self._dead = set() # workers whose process has exited
+        self._stopping = False
+        self._sent = [set() for _ in range(workers)] # model names each worker has
+        self._busy = [0] * workers
+
+        threading.Thread(target=self._collectResponses, name="InferenceWorkerResponses", daemon=True).start()
+        modelRegistry.addListener(self._onRegistryEvent)
+
+    def _collectResponses(self):
+        while True:
+            # Checked at least once a second, so a dead worker's requests fail even while the others keep answering
+            self._checkWorkers()
+            try:
+                request_id, reply, error = self._responses.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self._lock:
+                _, future = self._futures.pop(request_id, (None, None))
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(f"Inference worker error: {error}"))
+            else:
+                future.set_result(reply)
+
+    def _checkWorkers(self):
+        '''Fails every pending request of a worker process that has exited'''
+        if self._stopping:
+            return
+        for worker, process in enumerate(self._processes):
+            if worker in self._dead or process.is_alive():
+                continue
+            with self._lock:
+                self._dead.add(worker)
+                pending = [request_id for request_id, (owner, _) in self._futures.items() if owner == worker]
+                futures = [self._futures.pop(request_id)[1] for request_id in pending]
+            print(f"Inference worker {process.name} exited with code {process.exitcode}")
+            for future in futures:
+                future.set_exception(RuntimeError(f"Inference worker {process.name} exited with code "
+                                                  f"{process.exitcode}"))
+
+    def _request(self, worker, kind, *arguments):
+        future = Future()
+        with self._lock:
+            if worker in self._dead:
+                raise RuntimeError(f"Inference worker {self._processes[worker].name} is no longer running")
+            request_id = next(self._ids)
+            self._futures[request_id] = (worker, future)
+        self._queues[worker].put((kind, request_id, *arguments))
+        return future
+
+    def _wait(self, future):
+        '''
+        Returns the future's result, raising TimeoutError when the worker takes longer than timeout_s. When the job
+        waiting on this thread is cancelled, the worker is told to stop the request and InferenceCancelled is raised.
+        '''
+        try:
+            return waitCancellable(future, timeout=self.timeout_s, onCancelled=lambda: self._cancel(future))
+        except FutureTimeoutError:
+            self._forget(future)
+            raise TimeoutError(f"Inference worker did not answer within {self.timeout_s} s")
+
+    def _forget(self, future):
+        '''Stops waiting for a request's reply and returns its (worker, request id), or None if it has been answered'''
+        with self._lock:
+            for request_id, (worker, pending) in list(self._futures.items()):
+                if pending is future:
+                    del self._futures[request_id]
+                    return worker, request_id
+        return None
+
+    def _cancel(self, future):
+        request = self._forget(future)
+        if request is not None:
+            worker, request_id = request
+            self._cancelled[worker].value = request_id
+
+    def _post(self, worker, kind, *arguments):
+        self._queues[worker].put((kind, None, *arguments))
+
+    def _ensureModel(self, worker, model_name):
+        model = self.modelRegistry.get(model_name)
+        with self._lock:
+            if model_name in self._sent[worker]:
+                return
+            self._sent[worker].add(model_name)
+            # Put while holding the lock so the model always reaches the worker before any request that uses it
+            self._post(worker, "model", model_name, shareableModel(model))
+
+    def _onRegistryEvent(self, event, name, details):
+        if event != "evicted":
+            return
+        with self._lock:
+            for worker, sent in enumerate(self._sent):
+                if name in sent:
+                    sent.discard(name)
+                    self._post(worker, "unload", name)
+
+    def predict(self, model_name, questions, image, answer_only=False):
+        '''Answers questions about a frame on the least busy worker. Blocks until the answers are ready.'''
+        with self._lock:
+            alive = [worker for worker in range(len(self._busy)) if worker not in self._dead]
+            if not alive:
+                raise RuntimeError("Every inference worker process has exited")
+            worker = min(alive, key=self._busy.__getitem__)
+            self._busy[worker] += 1
+
+        block, frame = putSharedArray(image)
+        try:
+            self._ensureModel(worker, model_name)
+            replies = self._wait(self._request(worker, "predict", model_name, list(questions), frame, answer_only))
+        finally:
+            block.close()
+            block.unlink()
+            with self._lock:
+                self._busy[worker] -= 1
+
+        results = []
+        for reply in replies:
+            timings = StageTimings.fromStages(model_name, reply["question"], reply["timings"], logged=True)
+            visualizations = LazyVisualizations()
+            if reply["key"] is not None:
+                # The worker generates a visualization on request; it is timed here, including the transfer
+                visualizations = LazyVisualizations([
+                    lambda key=reply["key"], index=index, name=name, timings=timings:
+                        self._visualize(worker, key, index, timings, name)
+                    for index, name in enumerate(reply["visualization_names"])])
+            results.append(PredictionResults(question=reply["question"], image=image,
+                                             model_used=reply["model_used"],
+                                             prediction=reply["prediction"],
+                                             top_predictions=reply["top_predictions"],
+                                             visualizations=visualizations,
+                                             visualization_names=reply["visualization_names"],
+                                             encoded_tokens=reply["encoded_tokens"], decoded_tokens=reply["decoded_tokens"],
+                                             timings=timings))
+        return results
+
+    def _visualize(self, worker, key, index, timings, name):
+        with timings.stage(f"worker visualization: {name}"):
+            descriptor = self._wait(self._request(worker, "visualize", key, index))
+            visualization = readSharedArray(descriptor, unlink=True)
+        self._post(worker, "free", descriptor[0])
+        return visualization
+
+    def warmUp(self, model_name):
+        '''Warms the model up on every running worker at once and returns the slowest worker's time in seconds'''
+        workers = [worker for worker in range(len(self._queues)) if worker not in self._dead]
+        for worker in workers:
+            self._ensureModel(worker, model_name)
+        futures = [self._request(worker, "warm_up", model_name) for worker in workers]
+        return max(self._wait(future) for future in futures)
+
+    def shutdown(self):
+        self._stopping = True
+        for worker in range(len(self._queues)):
+            self._post(worker, "stop")
+        for process in self._processes:
+            process.join(timeout=5)
@@ -0,0 +1,214 @@
+# This Python file uses the following encoding: utf-8
+# Memory-mapped model weights in the safetensors format (https://github.com/huggingface/safetensors).
+#
+# convert_weights.py writes each model's state dict once as a .safetensors file (plus its config). Loading maps the
+# file copy-on-write and points the model's parameters straight at the mapping, so nothing is unpickled or copied:
+# pages are read from disk when a layer first touches them, and the weights never exist twice in memory. The format
+# is small enough to read and write here, which keeps the lazy mapping independent of the torch and safetensors
+# versions; the files stay readable by the safetensors library.
+
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import torch
+from transformers.modeling_utils import no_init_weights
+
+from SettingsUtils import settings
+
+_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+_TORCH_DTYPES = {name: dtype for dtype, name in _DTYPES.items()}
+
+# Parameters registered on a thread inside emptyWeights() are moved to the meta device. The patched
+# register_parameter is only installed while at least one thread is inside the block.
+_empty_weights = threading.local()
+_register_parameter = torch.nn.Module.register_parameter
+_patch_lock = threading.Lock()
+_patch_users = 0
+
+
+def weightPaths(name):
+    '''Returns the (weights, config) paths of a converted model in the configured weights folder'''
+    weights_dir = Path(settings["models"]["weights_dir"])
+    return weights_dir / f"{name}.safetensors", weights_dir / f"{name}.config.json"
+
+
+def saveSafetensors(tensors, path, metadata=None):
+    '''
+    Writes a dict of tensors as a safetensors file. Tensors sharing memory (tied weights) are stored once and
+    recorded as aliases in the metadata. Larger element types come first so every tensor stays aligned for mapping.
+    '''
+    unique = {}
+    aliases = {}
+    for name, tensor in tensors.items():
+        key = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape), tensor.stride())
+        if key in unique and tensor.nelement():
+            aliases[name] = unique[key]
+        else:
+            unique.setdefault(key, name)
+
+    names = sorted((name for name in tensors if name not in aliases),
+                   key=lambda name: -tensors[name].element_size())
+    header = {}
+    offset = 0
+    for name in names:
+        tensor = tensors[name]
+        nbytes = tensor.element_size() * tensor.nelement()
+        header[name] = {"dtype": _DTYPES[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + nbytes]}
+        offset += nbytes
+
+    metadata = dict(metadata or {})
+    if aliases:
+        metadata["aliases"] = json.dumps(aliases)
+    if metadata:
+        header["__metadata__"] = metadata
+
+    # The header is padded so the data starts 8-byte aligned
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as weights_file:
+        weights_file.write(struct.pack("<Q", len(header_bytes)))
+        weights_file.write(header_bytes)
+        for name in names:
+            tensor = tensors[name].detach().cpu().contiguous().reshape(-1)
+            weights_file.write(tensor.view(torch.uint8).numpy().tobytes() if tensor.nelement() else b"")
+
+
+def loadSafetensors(path):
+    '''
+    Maps a safetensors file copy-on-write and returns (tensors, metadata). The tensors are views of the mapping, so
+    their data is only read from disk when it is used. Aliases recorded by saveSafetensors share their tensor.
+    '''
+    with open(path, "rb") as weights_file:
+        header_size, = struct.unpack("<Q", weights_file.read(8))
+        header = json.loads(weights_file.read(header_size))
+        # ACCESS_COPY: writes (if any) stay private to this process and never reach the file
+        mapping = mmap.mmap(weights_file.fileno(), 0, access=mmap.ACCESS_COPY) if os.path.getsize(path) else None
+
+    metadata = header.pop("__metadata__", {})
+    data = torch.frombuffer(mapping, dtype=torch.uint8) if mapping is not None else torch.empty(0, dtype=torch.uint8)
+    start = 8 + header_size
+
+    tensors = {}
+    for name, entry in header.items():
+        dtype = _TORCH_DTYPES[entry["dtype"]]
+        begin, end = entry["data_offsets"]
+        raw = data[start + begin:start + end]
+        # Files written elsewhere may not align every tensor; those few are copied instead of mapped
+        if (start + begin) % torch.empty(0, dtype=dtype).element_size():
+            raw = raw.clone()
+        tensors[name] = raw.view(dtype).reshape(entry["shape"])
+
+    for alias, name in json.loads(metadata.get("aliases", "{}")).items():
+        tensors[alias] = tensors[name]
+    return tensors, metadata
+
+
+def _registerEmptyParameter(module, name, param):
+    if getattr(_empty_weights, "active", False) and param is not None and param.device.type != "meta":
+        param = torch.nn.Parameter(param.to("meta"), requires_grad=param.requires_grad)
+    _register_parameter(module, name, param)
+
+
+@contextmanager
+def emptyWeights():
+    '''
+    Builds models on this thread without weight storage, like accelerate's init_empty_weights: every parameter is
+    registered as a meta tensor (shape and dtype only), so initializing it costs nothing and assignTensors() gives
+    it its data. Buffers stay real since some (e.g. position ids) are not saved with the weights. Models built on
+    other threads meanwhile are not affected.
+    '''
+    global _patch_users
+    with _patch_lock:
+        if _patch_users == 0:
+            torch.nn.Module.register_parameter = _registerEmptyParameter
+        _patch_users += 1
+    previous = getattr(_empty_weights, "active", False)
+    _empty_weights.active = True
+    try:
+        yield
+    finally:
+        _empty_weights.active = previous
+        with _patch_lock:
+            _patch_users -= 1
+            if _patch_users == 0:
+                torch.nn.Module.register_parameter = _register_parameter
+
+
+def assignTensors(model, tensors):
+    '''
+    Points the model's parameters and buffers at the given tensors instead of copying into them (unlike
+    load_state_dict), so memory-mapped weights stay mapped. The tensors must match the model's state dict exactly.
+    '''
+    expected = model.state_dict(keep_vars=True)
+    missing = expected.keys() - tensors.keys()
+    unexpected = tensors.keys() - expected.keys()
+    if missing or unexpected:
+        raise ValueError(f"Weights do not match {type(model).__name__}: missing {sorted(missing)}, "
+                         f"unexpected {sorted(unexpected)}")
+
+    for name, current in expected.items():
+        tensor = tensors[name]
+        if tensor.shape != current.shape or tensor.dtype != current.dtype:
+            raise ValueError(f"Weight {name} is {tensor.dtype} {tuple(tensor.shape)}, "
+                             f"the model expects {current.dtype} {tuple(current.shape)}")
+
+        owner_name, _, attribute = name.rpartition(".")
+        owner = model.get_submodule(owner_name)
+        if attribute in owner._parameters:
+            owner._parameters[attribute] = torch.nn.Parameter(tensor, requires_grad=current.requires_grad)
+        else:
+            owner._buffers[attribute] = tensor
+
+
+def saveMapped(model, name):
+    '''Writes a model's weights (and its transformers config, if it has one) for loadMapped(). Returns the paths.'''
+    weights_path, config_path = weightPaths(name)
+    saveSafetensors(model.state_dict(), weights_path, {"format": "pt", "model": type(model).__name__})
+    if hasattr(model, "config") and hasattr(model.config, "to_json_file"):
+        model.config.to_json_file(config_path)
+    return weights_path, config_path
+
+
+def loadMapped(name, build):
+    '''
+    Returns the model built by build(config path) with its weights mapped from the converted file, in eval mode, or
+    None when mapped weights are turned off in the settings or the model has not been converted (see
+    convert_weights.py). Files that cannot be used fall back to the original checkpoint (None) with a message.
+    build should construct the model without loading weights. It runs under emptyWeights() (and transformers'
+    no_init_weights), so no parameter memory is allocated or initialized before the mapped tensors replace it.
+    '''
+    if not settings["models"]["mapped_weights"]:
+        return None
+
+    weights_path, config_path = weightPaths(name)
+    if not weights_path.exists():
+        return None
+
+    try:
+        with emptyWeights(), no_init_weights():
+            model = build(config_path)
+        tensors, _ = loadSafetensors(weights_path)
+        assignTensors(model, tensors)
+    except Exception as error:
+        print(f"Could not map {weights_path}, loading the original {name} checkpoint: {error}")
+        return None
+    print(f"Mapped {name} weights from {weights_path}")
+    return model.eval()
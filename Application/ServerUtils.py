@@ -0,0 +1,395 @@
+# This Python file uses the following encoding: utf-8
+# Local VQA inference server: a dynamic batching scheduler, the HTTP API that server.py hosts and a client for it.
+#
+# API (JSON over HTTP, images are base64-encoded PNG/JPEG files):
+#   GET  /health                               -> {"status": "ok"}
+#   GET  /models                               -> {"models": [...], "loaded": [...]}
+#   POST /predict                              {"model", "question" or "questions", "image", "answer_only",
+#                                               "visualizations", "top_k", "request_id"} -> {"results": [...]}
+#   POST /cancel                               {"request_id"} -> {"cancelled": true/false}; the cancelled predict
+#                                               request answers 409
+#   GET  /visualizations/<result_id>/<index>   -> PNG of one visualization of an earlier result
+
+import base64
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import cv2
+import numpy as np
+import requests
+
+from CacheUtils import frameDigest
+from CancellationUtils import CancellationToken, InferenceCancelled, cancellationScope, waitCancellable
+from ModelPredictionUtils import LazyVisualizations, PredictionResults, predictBatchForModel
+from TimingUtils import StageTimings
+
+
+def encodeImage(image, extension=".png"):
+    '''Encodes an RGB frame as base64 image file text. PNG is lossless, so the server sees the exact frame.'''
+    ok, buffer = cv2.imencode(extension, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise ValueError("Could not encode image")
+    return base64.b64encode(buffer.tobytes()).decode("ascii")
+
+def decodeImage(text):
+    '''Decodes base64 image file text into an RGB frame'''
+    return decodeImageBytes(base64.b64decode(text))
+
+def decodeImageBytes(data):
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+def encodePng(image):
+    ok, buffer = cv2.imencode(".png", cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise ValueError("Could not encode image")
+    return buffer.tobytes()
+
+
+class _BatchRequest:
+    def __init__(self, questions, image, answer_only):
+        self.questions = questions
+        self.image = image
+        self.answer_only = answer_only
+        self.key = (frameDigest(image), answer_only)
+        self.future = Future()
+        self.token = CancellationToken()
+
+
+class _BatchCancellation:
+    '''Cancellation token of a merged batch: the batch stops once every request in it has been cancelled'''
+    def __init__(self, requests):
+        self.requests = requests
+
+    def check(self):
+        if all(request.token.isCancelled() for request in self.requests):
+            raise InferenceCancelled()
+
+
+class BatchScheduler:
+    '''
+    Coalesces concurrent prediction requests into batched forwards.
+
+    Each model has a dispatcher thread. It takes the first waiting request, then keeps collecting requests for
+    window_ms (or until max_batch questions are waiting). Requests about the same frame with the same answer_only
+    flag are merged into one predictBatchForModel call, which encodes the frame (or runs FRCNN) once and answers all
+    of their questions in a single forward pass. Every request gets back its own PredictionResults.
+
+    Requests submitted with a request_id can be cancelled. A cancelled request that is still waiting is dropped; a
+    batch that is running stops at its next pipeline stage once all of its requests have been cancelled.
+    '''
+    def __init__(self, modelRegistry, window_ms=10, max_batch=32):
+        self.modelRegistry = modelRegistry
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queues = {}
+        self._requests = {} # request id -> _BatchRequest, until it is answered
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+
+    def submit(self, model_name, questions, image, answer_only=False, request_id=None):
+        '''Queues questions about a frame and returns a Future resolving to their list of PredictionResults'''
+        if model_name not in self.modelRegistry.setups:
+            raise KeyError(f"Unknown model '{model_name}'")
+
+        request = _BatchRequest(list(questions), image, answer_only)
+        if request_id is not None:
+            with self._lock:
+                self._requests[request_id] = request
+            request.future.add_done_callback(lambda _: self._forget(request_id))
+        self._queue(model_name).put(request)
+        return request.future
+
+    def cancel(self, request_id):
+        '''Cancels a request submitted with request_id. Returns False if it is unknown or has been answered.'''
+        with self._lock:
+            request = self._requests.get(request_id)
+        if request is None:
+            return False
+        request.token.cancel()
+        return True
+
+    def _forget(self, request_id):
+        with self._lock:
+            self._requests.pop(request_id, None)
+
+    def _queue(self, model_name):
+        with self._lock:
+            if model_name not in self._queues:
+                self._queues[model_name] = queue.Queue()
+                threading.Thread(target=self._dispatch, args=(model_name, self._queues[model_name]),
+                                 name=f"BatchScheduler-{model_name}", daemon=True).start()
+            return self._queues[model_name]
+
+    def _dispatch(self, model_name, requests_queue):
+        while True:
+            pending = [requests_queue.get()]
+            question_count = len(pending[0].questions)
+            deadline = time.perf_counter() + self.window
+            while question_count < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = requests_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(request)
+                question_count += len(request.questions)
+
+            groups = defaultdict(list)
+            for request in pending:
+                groups[request.key].append(request)
+            for group in groups.values():
+                self._run(model_name, group)
+
+    def _run(self, model_name, group):
+        # Requests cancelled while they were waiting are not run at all
+        live = []
+        for request in group:
+            if request.token.isCancelled():
+                request.future.set_exception(InferenceCancelled())
+            else:
+                live.append(request)
+        group = live
+        if not group:
+            return
+
+        questions = [question for request in group for question in request.questions]
+        try:
+            model = self.modelRegistry.get(model_name)
+            with cancellationScope(_BatchCancellation(group)):
+                results = predictBatchForModel(model_name, model, questions, group[0].image,
+                                               answer_only=group[0].answer_only)
+        except Exception as error:
+            for request in group:
+                request.future.set_exception(error)
+            return
+
+        with self._lock:
+            self.batches += 1
+            self.requests += len(group)
+        if len(group) > 1:
+            print(f"[BatchScheduler] {model_name}: {len(group)} requests, {len(questions)} questions in one batch")
+
+        start = 0
+        for request in group:
+            request.future.set_result(results[start:start + len(request.questions)])
+            start += len(request.questions)
+
+
+class ResultStore:
+    '''Keeps the most recent results so their visualizations can be generated when a client asks for them'''
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, result):
+        result_id = uuid.uuid4().hex
+        with self._lock:
+            self._results[result_id] = result
+            while len(self._results) > self.capacity:
+                self._results.popitem(last=False)
+        return result_id
+
+    def get(self, result_id):
+        with self._lock:
+            return self._results.get(result_id)
+
+
+class VQAServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, scheduler, result_store):
+        super().__init__(address, VQARequestHandler)
+        self.scheduler = scheduler
+        self.result_store = result_store
+
+
+class VQARequestHandler(BaseHTTPRequestHandler):
+    server_version = "DroneVQA"
+
+    def do_GET(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts == ["health"]:
+            self._sendJson(200, {"status": "ok"})
+        elif parts == ["models"]:
+            registry = self.server.scheduler.modelRegistry
+            self._sendJson(200, {"models": registry.names(), "loaded": registry.loadedModels()})
+        elif len(parts) == 3 and parts[0] == "visualizations":
+            self._sendVisualization(parts[1], parts[2])
+        else:
+            self._sendJson(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path.strip("/")
+        if path == "cancel":
+            self._cancel()
+            return
+        if path != "predict":
+            self._sendJson(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        # Anything malformed in the body is a 400, so the client always gets a response
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length))
+            questions = body.get("questions") or [body["question"]]
+            if not isinstance(questions, list) or not all(isinstance(question, str) for question in questions):
+                raise TypeError("questions must be a list of strings")
+            if not isinstance(body["image"], str):
+                raise TypeError("image must be base64 text")
+            image = decodeImage(body["image"])
+            model_name = body.get("model", "ViLT")
+            request_id = body.get("request_id")
+            if not isinstance(model_name, str) or not isinstance(request_id, (str, type(None))):
+                raise TypeError("model and request_id must be strings")
+            answer_only = bool(body.get("answer_only", False))
+            include_visualizations = bool(body.get("visualizations", False)) and not answer_only
+            top_k = int(body.get("top_k", 5))
+        except (KeyError, ValueError, TypeError, AttributeError) as error:
+            self._sendJson(400, {"error": f"Bad request: {error}"})
+            return
+
+        start = time.perf_counter()
+        try:
+            results = self.server.scheduler.submit(model_name, questions, image, answer_only,
+                                                   request_id=request_id).result()
+        except KeyError as error:
+            self._sendJson(404, {"error": str(error)})
+            return
+        except InferenceCancelled:
+            self._sendJson(409, {"error": "Request was cancelled"})
+            return
+        except Exception as error:
+            self._sendJson(500, {"error": repr(error)})
+            return
+
+        response = []
+        for result in results:
+            entry = {
+                "question": result.question,
+                "model_used": result.model_used,
+                "answer": result.prediction,
+                "top_predictions": [[answer, float(probability)] for answer, probability in result.top_predictions[:top_k]],
+                "encoded_tokens": result.encoded_tokens,
+                "decoded_tokens": result.decoded_tokens,
+                "visualization_names": result.visualization_names,
+                "timings": [[name, seconds] for name, seconds in result.timings.stages()],
+            }
+            if len(result.visualizations):
+                entry["result_id"] = self.server.result_store.add(result)
+            if include_visualizations:
+                entry["visualizations"] = [base64.b64encode(encodePng(visual)).decode("ascii")
+                                           for visual in result.visualizations]
+            response.append(entry)
+
+        self._sendJson(200, {"results": response, "seconds": round(time.perf_counter() - start, 4)})
+
+    def _cancel(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request_id = json.loads(self.rfile.read(length))["request_id"]
+        except (KeyError, ValueError, TypeError) as error:
+            self._sendJson(400, {"error": f"Bad request: {error}"})
+            return
+        self._sendJson(200, {"cancelled": self.server.scheduler.cancel(request_id)})
+
+    def _sendVisualization(self, result_id, index):
+        result = self.server.result_store.get(result_id)
+        if result is None or not index.isdigit() or int(index) >= len(result.visualizations):
+            self._sendJson(404, {"error": "Unknown result or visualization (results are only kept for a while)"})
+            return
+        self._send(200, "image/png", encodePng(result.visualizations[int(index)]))
+
+    def _sendJson(self, status, body):
+        self._send(status, "application/json", json.dumps(body).encode("utf-8"))
+
+    def _send(self, status, content_type, payload):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class InferenceClient:
+    '''
+    Client for the local VQA server. predict() returns PredictionResults like predictBatchForModel, with
+    visualizations fetched from the server the first time they are displayed. A predict() whose cancellation token
+    (see CancellationUtils) is cancelled while it waits cancels the request on the server and raises
+    InferenceCancelled.
+    '''
+    def __init__(self, url, timeout=120):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        # Requests are sent from here so the calling thread can keep checking its cancellation token
+        self._executor = ThreadPoolExecutor(thread_name_prefix="InferenceClient")
+
+    def isAvailable(self):
+        try:
+            return requests.get(f"{self.url}/health", timeout=2).ok
+        except requests.RequestException:
+            return False
+
+    def predict(self, model_name, questions, image, answer_only=False):
+        start = time.perf_counter()
+        request_id = uuid.uuid4().hex
+        request = self._executor.submit(requests.post, f"{self.url}/predict", timeout=self.timeout, json={
+            "model": model_name,
+            "questions": questions,
+            "image": encodeImage(image),
+            "answer_only": answer_only,
+            "request_id": request_id,
+        })
+        response = waitCancellable(request, onCancelled=lambda: self._cancel(request_id))
+        if not response.ok:
+            raise RuntimeError(f"VQA server error {response.status_code}: {response.text}")
+
+        request_seconds = time.perf_counter() - start
+
+        results = []
+        for entry in response.json()["results"]:
+            # The server writes these stages to its own metrics file; the round trip is only known here
+            timings = StageTimings.fromStages(model_name, entry["question"], entry.get("timings", []))
+            timings.add("server round trip", request_seconds)
+            visualizations = LazyVisualizations()
+            if "result_id" in entry:
+                visualizations = LazyVisualizations([
+                    lambda result_id=entry["result_id"], index=index, name=name, timings=timings:
+                        self._fetchVisualization(result_id, index, timings, name)
+                    for index, name in enumerate(entry["visualization_names"])])
+            results.append(PredictionResults(question=entry["question"], image=image,
+                                             model_used=entry["model_used"],
+                                             prediction=entry["answer"],
+                                             top_predictions=[tuple(prediction) for prediction in entry["top_predictions"]],
+                                             visualizations=visualizations,
+                                             visualization_names=entry["visualization_names"],
+                                             encoded_tokens=entry["encoded_tokens"], decoded_tokens=entry["decoded_tokens"],
+                                             timings=timings))
+        return results
+
+    def _cancel(self, request_id):
+        try:
+            requests.post(f"{self.url}/cancel", timeout=2, json={"request_id": request_id})
+        except requests.RequestException as error:
+            print(f"Could not cancel request on the VQA server: {error}")
+
+    def _fetchVisualization(self, result_id, index, timings, name):
+        with timings.stage(f"server visualization: {name}"):
+            response = requests.get(f"{self.url}/visualizations/{result_id}/{index}", timeout=self.timeout)
+        if not response.ok:
+            raise RuntimeError(f"VQA server error {response.status_code}: {response.text}")
+        return decodeImageBytes(response.content)
@@ -0,0 +1,132 @@
+# This Python file uses the following encoding: utf-8
+# Application settings. Values in DroneVQASettings.json override the defaults below.
+
+import copy
+import json
+import os
+from pathlib import Path
+
+SETTINGS_PATH = Path(__file__).resolve().parent / "DroneVQASettings.json"
+
+DEFAULT_SETTINGS = {
+    # Models are loaded on first use; the preloaded ones are loaded while the load screen is showing, up to
+    # parallel_loads at a time (0 loads every preloaded model at once). The launch screen opens once one is ready.
+    # Least-recently-used models are evicted once the loaded models exceed ram_budget_mb (0 means no limit).
+    # quantize applies dynamic int8 quantization to the Linear layers (CPU only, see benchmark.py quantization).
+    # warm_up runs a synthetic question through each preloaded model and its explainers in the background once it
+    # has loaded (the launch screen does not wait for it).
+    # precision "bf16" runs the ViLT, LXMERT and FRCNN forwards under bf16 CPU autocast (see benchmark.py bf16);
+    # with quantize on, ViLT and LXMERT stay fp32 and only FRCNN uses bf16.
+    # mapped_weights loads the weights convert_weights.py wrote to weights_dir by memory-mapping them. With
+    # process_pool enabled the mapped weights are copied into shared memory for the workers, so they stop being lazy.
+    # prefetch_visualizations generates every visualization right after the answer instead of only the first one
+    # (the others are generated when selected); for LXMERT that is three explainer passes per question.
+    "models": {
+        "ram_budget_mb": 0,
+        "preload": ["ViLT"],
+        "parallel_loads": 0,
+        "quantize": False,
+        "warm_up": True,
+        "precision": "fp32",
+        "mapped_weights": True,
+        "weights_dir": "Fine-Tuned Models/safetensors",
+        "prefetch_visualizations": False,
+    },
+    # ViLT answer forward backend: "pytorch" or "onnxruntime" (answer-only requests run the graphs exported by
+    # export_onnx.py; visualizations always use PyTorch). onnx_threads 0 lets ONNX Runtime choose.
+    "vilt": {
+        "backend": "pytorch",
+        "onnx_dir": "Fine-Tuned Models/ONNX",
+        "onnx_threads": 0,
+    },
+    # CPU threading profile (see ThreadingUtils.py). null keeps the library default; the inference pool runs
+    # predictions, visualizations and exports, the camera pool runs the capture loop.
+    "threading": {
+        "torch_intra_op_threads": None,
+        "torch_inter_op_threads": None,
+        "opencv_threads": None,
+        "camera_pool": 1,
+        "inference_pool": None,
+    },
+    # Local inference server (server.py). With enabled, the GUI sends questions to it instead of loading models.
+    # A superseded question is cancelled on the server too, though a batch merged with other clients' questions only
+    # stops once all of them have been cancelled.
+    "server": {
+        "enabled": False,
+        "url": "http://127.0.0.1:8765",
+        "timeout_s": 120,
+        "batch_window_ms": 10,
+        "max_batch": 32,
+    },
+    # Run inference in worker processes (ProcessPoolUtils.py) instead of GUI threads. threads_per_worker 0 splits
+    # the cores evenly between the workers. Requests a worker has not answered within timeout_s seconds fail.
+    "process_pool": {
+        "enabled": False,
+        "workers": 2,
+        "threads_per_worker": 0,
+        "timeout_s": 300,
+    },
+    # Frame-keyed cache of FRCNN region features shared by the LXMERT models
+    "frcnn_cache": {
+        "budget_mb": 512,
+    },
+    # Results of earlier questions, keyed by model, normalized question, a perceptual hash of the frame (a
+    # hash_size x hash_size gradient grid) and the precision/quantization/backend the answer was computed with. At
+    # most capacity results are kept (0 disables the cache), each for ttl_s seconds.
+    "answer_cache": {
+        "capacity": 256,
+        "ttl_s": 300,
+        "hash_size": 32,
+    },
+    # Local copies of the pretrained models, tokenizers and vocabularies written by prefetch.py. Ids listed in the
+    # folder's manifest.json are loaded from there without contacting HuggingFace; the others are downloaded as usual.
+    # Local files are checked against the manifest checksums the first time they are loaded (see ArtifactUtils.py).
+    "artifacts": {
+        "dir": "Fine-Tuned Models/artifacts",
+    },
+    # Per-stage pipeline latencies, one JSON line per stage. The file rolls over at max_mb, keeping backups older
+    # files; an empty file name turns the metrics file off. server.py writes server_file instead, since a rolling file
+    # cannot be shared between processes (batch_vqa.py and process pool workers write none).
+    "metrics": {
+        "file": "Exports and Snapshots/Metrics/pipeline_metrics.jsonl",
+        "server_file": "Exports and Snapshots/Metrics/server_metrics.jsonl",
+        "max_mb": 5,
+        "backups": 3,
+    },
+}
+
+def loadSettings(path=SETTINGS_PATH):
+    '''Returns the application settings, filling in anything missing from the settings file with the defaults'''
+    settings = copy.deepcopy(DEFAULT_SETTINGS)
+
+    if os.path.exists(path):
+        try:
+            with open(path, encoding='utf-8') as settings_file:
+                user_settings = json.load(settings_file)
+        except (OSError, ValueError):
+            print(f"Could not read settings file {path}, using defaults")
+            return settings
+
+        for section, values in user_settings.items():
+            if isinstance(values, dict):
+                settings.setdefault(section, {}).update(values)
+            else:
+                settings[section] = values
+
+    return settings
+
+def saveSettings(section, values, path=SETTINGS_PATH):
+    '''Writes values into one section of the settings file, keeping the rest of the file, and of the loaded settings'''
+    user_settings = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as settings_file:
+            user_settings = json.load(settings_file)
+
+    user_settings.setdefault(section, {}).update(values)
+    with open(path, 'w', encoding='utf-8') as settings_file:
+        json.dump(user_settings, settings_file, indent=4)
+        settings_file.write("\n")
+
+    settings.setdefault(section, {}).update(values)
+
+settings = loadSettings()
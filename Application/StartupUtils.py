@@ -0,0 +1,95 @@
+# This Python file uses the following encoding: utf-8
+# Startup profiling: time to first window, time per startup step and per-package import cost.
+#
+# Set DRONEVQA_PROFILE_STARTUP=1 to have application.py print a startup report once the launch screen is showing.
+# With DRONEVQA_EXIT_AFTER_STARTUP=1 it also quits right after, which is how `python benchmark.py startup` times it.
+# This module only uses the standard library so it can be imported before anything else.
+
+import builtins
+import json
+import os
+import sys
+import threading
+import time
+
+# Prefix of the machine-readable report line read by benchmark.py
+REPORT_PREFIX = "STARTUP_PROFILE "
+
+
+class StartupProfiler:
+    '''
+    Records named startup milestones (seconds since start) and, when enabled, how long each package took to import.
+
+    Import times are measured by wrapping __import__: every package's first import is timed, and its "self" time
+    excludes the packages it imported in turn, so the heaviest dependencies stand out (like python -X importtime,
+    but per top-level package and across every thread).
+    '''
+    def __init__(self, start, enabled=None):
+        self.start = start
+        self.enabled = os.environ.get("DRONEVQA_PROFILE_STARTUP") == "1" if enabled is None else enabled
+        self.exitAfterStartup = os.environ.get("DRONEVQA_EXIT_AFTER_STARTUP") == "1"
+        self.milestones = []
+        self.imports = {} # package -> [cumulative seconds, self seconds, thread name]
+        self._lock = threading.Lock()
+        self._stacks = threading.local()
+        if self.enabled:
+            self._installImportTimer()
+
+    def mark(self, name):
+        '''Records a milestone, e.g. a load screen step or "first window"'''
+        with self._lock:
+            self.milestones.append((name, time.perf_counter() - self.start))
+
+    def timeImport(self, name, importer):
+        '''Runs importer() (e.g. importlib.import_module) and records it as the import of name'''
+        if not self.enabled or name in self.imports:
+            return importer()
+        return self._timed(name, importer)
+
+    def _installImportTimer(self):
+        originalImport = builtins.__import__
+
+        def timedImport(name, globals=None, locals=None, fromlist=(), level=0):
+            package = name.partition(".")[0]
+            if level or not package or package in sys.modules or package in self.imports:
+                return originalImport(name, globals, locals, fromlist, level)
+            return self._timed(package, lambda: originalImport(name, globals, locals, fromlist, level))
+
+        builtins.__import__ = timedImport
+
+    def _timed(self, package, importer):
+        stack = self._stacks.__dict__.setdefault("stack", [])
+        stack.append(0.0) # time spent importing other packages from this one
+        start = time.perf_counter()
+        try:
+            return importer()
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self.imports.setdefault(package, [elapsed, elapsed - children, threading.current_thread().name])
+
+    def report(self, top=25):
+        '''Prints the milestones and the most expensive imports, plus one JSON line for benchmark.py'''
+        with self._lock:
+            milestones = list(self.milestones)
+            imports = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+
+        print("\nStartup milestones (s since start)")
+        previous = 0.0
+        for name, seconds in milestones:
+            print(f"  {seconds:8.3f}  (+{seconds - previous:7.3f})  {name}")
+            previous = seconds
+
+        print(f"\nSlowest imports (self time excludes the packages they import), top {top}")
+        for package, (cumulative, selfTime, thread) in imports[:top]:
+            print(f"  {selfTime:8.3f} s self  {cumulative:8.3f} s cumulative  {package:<28} [{thread}]")
+
+        print(REPORT_PREFIX + json.dumps({
+            "milestones": dict(milestones),
+            "imports": {package: {"cumulative_s": round(cumulative, 4), "self_s": round(selfTime, 4)}
+                        for package, (cumulative, selfTime, _) in imports},
+        }))
+        sys.stdout.flush()
@@ -0,0 +1,55 @@
+# This Python file uses the following encoding: utf-8
+# CPU threading profile: how many threads PyTorch, OpenCV and the Qt worker pools may use.
+# The profile is the "threading" section of DroneVQASettings.json; `python benchmark.py threads --write` tunes it.
+
+import cv2
+import torch
+
+
+def applyThreadingProfile(profile):
+    '''
+    Applies the torch and OpenCV thread counts of a threading profile. A value of None keeps the library default.
+    Call this at startup before any model runs; PyTorch only accepts the inter-op thread count before its first
+    parallel work.
+    '''
+    if profile.get("torch_intra_op_threads"):
+        torch.set_num_threads(profile["torch_intra_op_threads"])
+
+    if profile.get("torch_inter_op_threads"):
+        try:
+            torch.set_num_interop_threads(profile["torch_inter_op_threads"])
+        except RuntimeError as error:
+            print(f"Could not set torch inter-op threads, keeping {torch.get_num_interop_threads()}: {error}")
+
+    # 0 is meaningful for OpenCV (run everything on the calling thread), so only None keeps its default
+    if profile.get("opencv_threads") is not None:
+        cv2.setNumThreads(profile["opencv_threads"])
+
+    print(f"Threading profile: torch intra-op {torch.get_num_threads()}, torch inter-op {torch.get_num_interop_threads()}, "
+          f"OpenCV {cv2.getNumThreads()}, camera pool {profile.get('camera_pool')}, inference pool {profile.get('inference_pool')}")
+
+def createThreadPools(profile):
+    '''
+    Returns (camera pool, inference pool). The camera capture loop gets its own pool so a long-running inference,
+    visualization or export worker never delays frames, and vice versa.
+    '''
+    # Imported here so headless tools (e.g. benchmark.py threads) can use this module without Qt
+    from PySide6.QtCore import QThreadPool
+
+    camera_pool = QThreadPool()
+    camera_pool.setMaxThreadCount(profile.get("camera_pool") or 1)
+
+    inference_pool = QThreadPool()
+    if profile.get("inference_pool"):
+        inference_pool.setMaxThreadCount(profile["inference_pool"])
+
+    return camera_pool, inference_pool
+
+def threadCandidates(cores):
+    '''Intra-op thread counts worth trying on a machine with this many cores: powers of two and the core count'''
+    candidates = {cores}
+    count = 1
+    while count < cores:
+        candidates.add(count)
+        count *= 2
+    return sorted(candidates)
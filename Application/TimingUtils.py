@@ -0,0 +1,136 @@
+# This Python file uses the following encoding: utf-8
+# Per-stage latency of the VQA pipeline.
+#
+# Every prediction carries a StageTimings (PredictionResults.timings) that the pipeline adds a wall-clock time to as
+# each stage finishes: preprocessing, the FRCNN backbone/proposals/ROI heads/NMS, tokenization, the transformer
+# forward, each explainer, rendering and export. Stages shared by a batch of questions are timed once and appear in
+# every question's timings. The timings are shown in the details pane and appended, one JSON line per stage, to a
+# rolling metrics file ("metrics" in DroneVQASettings.json) for later analysis.
+
+import itertools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from SettingsUtils import settings
+
+_request_ids = itertools.count(1)
+
+# Timings created while this is set on a thread (e.g. model warm-up) are not written to the metrics file
+_unlogged = threading.local()
+
+
+class MetricsLog:
+    '''
+    Appends stage timings as JSON lines to a size-capped file, keeping backups older files (file.1, file.2, ...).
+    The file is opened on the first write; an empty path or a write error turns the log off.
+    '''
+    def __init__(self, path, max_mb, backups):
+        self.path = path
+        self.max_mb = max_mb
+        self.backups = backups
+        self.enabled = bool(path)
+        self._logger = None
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._logger is None and not self._open():
+                return
+        self._logger.info(json.dumps(record))
+
+    def _open(self):
+        try:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(self.path, maxBytes=int(self.max_mb * 2**20), backupCount=self.backups,
+                                          encoding="utf-8")
+        except OSError as error:
+            print(f"Could not open the metrics file {self.path}, stage timings will not be recorded: {error}")
+            self.enabled = False
+            return False
+
+        logger = logging.getLogger("DroneVQA.metrics")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        self._logger = logger
+        return True
+
+
+metrics_log = MetricsLog(settings["metrics"]["file"], settings["metrics"]["max_mb"], settings["metrics"]["backups"])
+
+@contextmanager
+def unloggedTimings():
+    '''Timings created on this thread inside the block are kept on the results but not written to the metrics file'''
+    previous = getattr(_unlogged, "active", False)
+    _unlogged.active = True
+    try:
+        yield
+    finally:
+        _unlogged.active = previous
+
+
+class StageTimings:
+    '''
+    Wall-clock seconds of each pipeline stage of one prediction, in the order the stages finished. Stages can be
+    added from any thread (explainers run after the answer has been returned). request identifies the batch a
+    question was asked in, so the metrics of questions answered together can be grouped.
+    '''
+    def __init__(self, model="", question="", logged=None):
+        self.model = model
+        self.question = question
+        self.request = next(_request_ids)
+        self.logged = not getattr(_unlogged, "active", False) if logged is None else logged
+        self.shared = 0 # leading stages shared with the other questions of the batch
+        self._stages = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fromStages(cls, model, question, stages, logged=False):
+        '''Rebuilds timings received from another process (a server or pool worker, which logs its own)'''
+        timings = cls(model, question, logged=logged)
+        for name, seconds in stages:
+            timings.add(name, seconds)
+        return timings
+
+    @contextmanager
+    def stage(self, name):
+        '''Times the block as stage name. Stages that raise (e.g. a cancelled job) are not recorded.'''
+        start = time.perf_counter()
+        yield
+        self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self._stages.append((name, seconds))
+        if self.logged:
+            metrics_log.write({"time": round(time.time(), 3), "request": self.request, "model": self.model,
+                               "question": self.question, "stage": name, "ms": round(seconds * 1000, 3)})
+
+    def fork(self, question):
+        '''Returns the timings of one question of this batch: the batch's stages so far, then its own'''
+        timings = StageTimings(self.model, question, logged=self.logged)
+        timings.request = self.request
+        timings._stages = self.stages()
+        timings.shared = len(timings._stages)
+        return timings
+
+    def stages(self):
+        with self._lock:
+            return list(self._stages)
+
+    def total(self):
+        return sum(seconds for _, seconds in self.stages())
+
+    def summary(self, include_shared=True):
+        '''Returns one "stage<tab>milliseconds" line per stage, as shown in the details pane'''
+        stages = self.stages()
+        if not include_shared:
+            stages = stages[self.shared:]
+        return "".join(f"{name}\t{seconds * 1000:.1f} ms\n" for name, seconds in stages)
@@ -15,22 +15,31 @@ import time
 import os
 from threading import Timer
 
-from docx import Document
-from docx.shared import Inches, Pt
-
 from worker import Worker
-from ModelPredictionUtils import PredictionResults, predictVilt, predictLxmert
+from CancellationUtils import CancellationToken, cancellationScope
+from ModelPredictionUtils import (PredictionResults, LazyVisualizations, predictBatchForModel, streamResults,
+                                  streamedVisualizations, answer_cache,
+                                  STAGE_ANSWER, STAGE_TOP_PREDICTIONS, STAGE_VISUALIZATION,
+                                  VILT, VILT_FINETUNED, LXMERT, LXMERT_FINETUNED)
 
 from ExportUtils import ExportUtils
+from SettingsUtils import settings
+from TimingUtils import StageTimings
 
 class VQAInteractionScreen(QWidget):
-    def __init__(self, threadManager, controller, models, parent=None):
+    def __init__(self, threadManager, controller, modelRegistry, cameraThreadManager, inferenceClient=None, parent=None):
         super().__init__(parent)
-        self.threadManager = threadManager
+        self.threadManager = threadManager # Predictions, visualizations and exports
+        self.cameraThreadManager = cameraThreadManager # Camera capture loop
         self.controller = controller
-        self.models = models
+        self.modelRegistry = modelRegistry
+        self.inferenceClient = inferenceClient # Set when questions go to the VQA server or worker processes
         self.currentImage = None
         self.predictionResult = None
+        self.questionResults = [] # Per-question results behind predictionResult, whose stage timings are shown
+        self.streamedIndices = set() # Visualizations of predictionResult the question's job is still generating
+        self.renderedIndices = set() # Visualizations of predictionResult whose display rendering has been timed
+        self.cancellationToken = None # Token of the latest question's job, cancelled when a newer question is asked
         self.current_model_details = ""
         self.visuals = []
         self.cameraEffect = "None"
@@ -140,7 +149,7 @@ class VQAInteractionScreen(QWidget):
         worker = Worker(self.get_video_stream)
         worker.signals.result.connect(self.display_video_stream)
         worker.signals.finished.connect(self.setupCamera)
-        self.threadManager.start(worker)
+        self.cameraThreadManager.start(worker)
 
     def restartCamera(self):
         self.setupCamera()
@@ -202,16 +211,8 @@ class VQAInteractionScreen(QWidget):
         self.ui.lineEdit_Answer.setText("")
         self.ui.textEdit_Details.setText("")
 
-        # Disable question asking options while model is running
-        self.ui.radioButton_ViltFineTuned.setEnabled(False)
-        self.ui.radioButton_ViltBase.setEnabled(False)
-        self.ui.radioButton_LxmertFineTuned.setEnabled(False)
-        self.ui.radioButton_LxmertBase.setEnabled(False)
-        self.ui.lineEdit_Question.setEnabled(False)
-        self.ui.checkBox_ExportResults.setEnabled(False)
-
-        # Change text/color/state of ask button to reflect that a model is running and results are loading
-        self.ui.pushButton_Ask.setEnabled(False)
+        # Change text/color of ask button to reflect that a model is running and results are loading. The question
+        # options stay enabled: asking again supersedes (cancels) the running question at its next pipeline stage.
         self.ui.pushButton_Ask.setText("Loading...")
         self.ui.pushButton_Ask.setStyleSheet("* { background-color: DarkSalmon; color: black; }\n\nQPushButton {\nborder-radius: 4px;\npadding: 4px 0;\n}")
 
@@ -219,56 +220,152 @@ class VQAInteractionScreen(QWidget):
         question = self.ui.lineEdit_Question.text()
         image = self.currentImage.copy()
 
-        model_index = 0
+        # A checklist of questions separated by ';' is answered in a single batch against the same frame
+        questions = [q.strip() for q in question.split(";") if q.strip()]
+        isBatch = len(questions) > 1
+
+        model_name = VILT
         # ViLT (Base) Model
         if self.ui.radioButton_ViltBase.isChecked():
-            model_index = 0
-            model = self.models[model_index]
-            worker = Worker(predictVilt, model[0], model[1], question, image) 
-       #Fine Tuned ViLT
+            model_name = VILT
+        #Fine Tuned ViLT
         elif self.ui.radioButton_ViltFineTuned.isChecked():
-            model_index = 1
-            model = self.models[model_index]
-            worker = Worker(predictVilt, model[0], model[1], question, image) 
+            model_name = VILT_FINETUNED
         # LXMERT (Base) Model
         elif self.ui.radioButton_LxmertBase.isChecked():
-            model_index = 2
-            model = self.models[model_index]
-            worker = Worker(predictLxmert, model[0], model[1], model[2], model[3], model[4], question, image)
+            model_name = LXMERT
         #Fine Tuned LXMERT
         elif self.ui.radioButton_LxmertFineTuned.isChecked():
-            model_index = 3
-            model = self.models[model_index]
-            worker = Worker(predictLxmert, model[0], model[1], model[2], model[3], model[4], question, image)
+            model_name = LXMERT_FINETUNED
+
+        # Answer-only requests skip all explainability work
+        answer_only = self.ui.checkBox_AnswerOnly.isChecked()
+
+        # The model is fetched from the registry on the worker thread, so a first-use load does not block the GUI
+        if not self.modelRegistry.isLoaded(model_name) and not settings["server"]["enabled"]:
+            self.ui.pushButton_Ask.setText(f"Loading {model_name}...")
+
+        # A new question supersedes the previous one: its remaining stages (e.g. explainers still running) are skipped
+        if self.cancellationToken is not None:
+            self.cancellationToken.cancel()
+        token = CancellationToken()
+        self.cancellationToken = token
+        worker = Worker(self.runModel, model_name, questions if isBatch else [question], image, answer_only, token)
+
+        # Signals of a superseded question may still arrive (e.g. its answer was already on its way); only the latest
+        # question updates the screen
+        def isCurrent():
+            return token is self.cancellationToken
 
         def completed():
-            # Enable question asking options now that model is complete
-            self.ui.radioButton_ViltFineTuned.setEnabled(True)
-            self.ui.radioButton_ViltBase.setEnabled(True)
-            self.ui.radioButton_LxmertFineTuned.setEnabled(True)
-            self.ui.radioButton_LxmertBase.setEnabled(True)
-            self.ui.lineEdit_Question.setEnabled(True)
-            self.ui.checkBox_ExportResults.setEnabled(True)
-
-            # Set ask button active and change text/color back to user ask prompt
-            self.ui.pushButton_Ask.setEnabled(True)
+            # Change ask button text/color back to user ask prompt
             self.ui.pushButton_Ask.setText("Ask")
             self.ui.pushButton_Ask.setStyleSheet("* { background-color: lightgrey; color: black; }\n\nQPushButton {\nborder-radius: 4px;\npadding: 4px 0;\n}")
 
-        worker.signals.result.connect(self.showResults)
-        worker.signals.finished.connect(completed)
-        #worker.signals.progress.connect(self.progress_fn)
+        # Results are streamed in stages: the answer, the top predictions, then each visualization as it is generated.
+        # The ask button shows its prompt again as soon as the answer is shown.
+        shown = []
+
+        def showStage(stage):
+            if not isCurrent():
+                return
+            stage, results, index = stage
+            if stage == STAGE_ANSWER:
+                self.ui.lineEdit_Answer.setText("; ".join(result.prediction for result in results))
+                completed()
+            elif stage == STAGE_TOP_PREDICTIONS:
+                # The job goes on to generate these; the others are generated when they are selected
+                self.streamedIndices = set(streamedVisualizations(results))
+                if isBatch:
+                    self.showBatchResults(results)
+                else:
+                    self.showResults(results[0])
+                shown.append(self.predictionResult)
+            elif stage == STAGE_VISUALIZATION and shown and self.predictionResult is shown[0]:
+                self.streamedIndices.discard(index)
+                self.displaySelectedVisualization(index)
+                self.showTimings()
+
+        def failed(error):
+            # A streamed visualization failed after the answer was shown
+            if shown and isCurrent() and self.predictionResult is shown[0] and self.streamedIndices:
+                self.streamedIndices.clear()
+                self.ui.label_ResultVisualization.setText(f"Could not generate visualization: {error[1]}")
+                self.ui.label_ResultVisualization.show()
+
+        def finished():
+            # Prediction failed before an answer could be shown
+            if not shown and isCurrent():
+                completed()
+
+        worker.signals.progress.connect(showStage)
+        worker.signals.error.connect(failed)
+        worker.signals.finished.connect(finished)
 
         self.threadManager.start(worker)
 
+    def runModel(self, model_name, questions, image, answer_only, cancellationToken, progress_callback):
+        '''
+        Runs on a worker thread and returns one PredictionResults per question, either from the VQA server, from the
+        inference worker processes or from the local model (loaded through the registry if needed). The partial
+        results are streamed to progress_callback as they become available (see streamResults). Stops at the next
+        pipeline stage once cancellationToken is cancelled; the server and worker processes are told to stop too.
+        '''
+        with cancellationScope(cancellationToken):
+            # The job may have been superseded while it was queued behind other work
+            cancellationToken.check()
+            if self.inferenceClient is not None:
+                results = self.inferenceClient.predict(model_name, questions, image, answer_only=answer_only)
+            else:
+                model = self.modelRegistry.get(model_name)
+                results = predictBatchForModel(model_name, model, questions, image, answer_only=answer_only)
+
+            streamResults(results, progress_callback)
+        return results
+
+    def generateVisualization(self, imageIndex, onReady):
+        """
+        Generates a visualization on a worker thread and calls onReady(imageIndex) once it is available,
+        as long as the same prediction result is still being displayed. A failure replaces the placeholder with an
+        error message.
+        """
+        results = self.predictionResult
+
+        def visualizationReady(_):
+            if self.predictionResult is results:
+                onReady(imageIndex)
+
+        def visualizationFailed(error):
+            if self.predictionResult is results and self.ui.comboBox_Visualizations.currentIndex() == imageIndex:
+                self.ui.label_ResultVisualization.setText(f"Could not generate visualization: {error[1]}")
+                self.ui.label_ResultVisualization.show()
+
+        worker = Worker(results.visualizations.__getitem__, imageIndex)
+        worker.signals.result.connect(visualizationReady)
+        worker.signals.error.connect(visualizationFailed)
+        self.threadManager.start(worker)
+
     def displayVisualization(self, imageIndex):
         """
         Sets the visualization image in the 'Model Visualization' area
         """
+        # The dropdown reports index -1 while it is being cleared
+        if imageIndex < 0 or self.predictionResult is None:
+            return
+
+        # Visualizations are generated on demand (unless the question's job is already generating this one); show a
+        # placeholder until this one is ready
+        if not self.predictionResult.visualizations.isReady(imageIndex):
+            self.ui.label_ResultVisualization.setText("Generating visualization...")
+            self.ui.label_ResultVisualization.show()
+            if imageIndex not in self.streamedIndices:
+                self.generateVisualization(imageIndex, self.displaySelectedVisualization)
+            return
 
         # Get visualization based on index
         image = self.predictionResult.visualizations[imageIndex]
 
+        start = time.perf_counter()
         # Resize Image for Display
         dim = (self.ui.label_ResultVisualization.width(),self.ui.label_ResultVisualization.height())
         frame = cv2.resize(image, dim)
@@ -280,10 +377,30 @@ class VQAInteractionScreen(QWidget):
         self.ui.label_ResultVisualization.hide()
         self.ui.label_ResultVisualization.show()
 
+        # Only the first rendering of each visualization is timed, so switching back and forth between them (or
+        # redrawing after a resize) does not add a stage per redraw
+        if imageIndex not in self.renderedIndices:
+            self.renderedIndices.add(imageIndex)
+            self.predictionResult.timings.add("display rendering", time.perf_counter() - start)
+            self.showTimings()
+
+    def displaySelectedVisualization(self, imageIndex):
+        """
+        Displays a newly generated visualization if it is still the one selected in the dropdown
+        """
+        if self.ui.comboBox_Visualizations.currentIndex() == imageIndex:
+            self.displayVisualization(imageIndex)
+
     def displayExpandedVisualization(self, imageIndex):
         """
         Launches a separate window with a larger version of the selected visualization
         """
+        if imageIndex < 0 or self.predictionResult is None:
+            return
+
+        if not self.predictionResult.visualizations.isReady(imageIndex):
+            self.generateVisualization(imageIndex, self.displayExpandedVisualization)
+            return
 
         # Get visualization based on index
         image = self.predictionResult.visualizations[imageIndex]
@@ -305,22 +422,69 @@ class VQAInteractionScreen(QWidget):
 
 
 
-    def showResults(self, results: PredictionResults):
+    def showBatchResults(self, results: list):
+        '''
+        Shows the results of a question list as one combined result: the answers in question order, one
+        "question<tab>answer" line per question in the details and every visualization prefixed by its question number
+        '''
+        visualizations = LazyVisualizations.concatenate([result.visualizations for result in results])
+        visualization_names = []
+        for number, result in enumerate(results, start=1):
+            visualization_names.extend([f"Q{number} - {name}" for name in result.visualization_names])
+
+        question = "; ".join(result.question for result in results)
+        combined = PredictionResults(question=question,
+                                     image=results[0].image,
+                                     model_used=results[0].model_used,
+                                     prediction="; ".join(result.prediction for result in results),
+                                     visualizations=visualizations, visualization_names=visualization_names,
+                                     timings=StageTimings(results[0].timings.model, question))
+        details = "".join(f"{result.question}\t{result.prediction}\n" for result in results)
+        self.showResults(combined, details, results)
+
+    def showTimings(self):
+        '''
+        Shows the stage timings of the displayed prediction below its details. Stages shared by a question list are
+        listed once, under the first question; rendering and export of a question list are listed last.
+        '''
+        if self.predictionResult is None:
+            return
+
+        timings = ""
+        isBatch = len(self.questionResults) > 1
+        for number, result in enumerate(self.questionResults, start=1):
+            if isBatch:
+                timings += f"Q{number}\n"
+            timings += result.timings.summary(include_shared=number == 1)
+        if not any(result is self.predictionResult for result in self.questionResults):
+            timings += self.predictionResult.timings.summary()
+
+        # The answer cache of the VQA server or worker processes is not visible from here
+        if self.inferenceClient is None and answer_cache.enabled:
+            stats = answer_cache.stats()
+            timings += (f"\nAnswer cache\t{stats['hits']} hits / {stats['hits'] + stats['misses']} lookups "
+                        f"({stats['hit_rate']:.0%})\n")
+
+        self.ui.textEdit_Details.setText(f"{self.current_model_details}\nStage timings\n{timings}")
+
+    def showResults(self, results: PredictionResults, details=None, questionResults=None):
         # Store prediction results (for showing more visualization images later)
+        if results is not self.predictionResult:
+            self.renderedIndices = set()
         self.predictionResult = results
+        self.questionResults = questionResults if questionResults is not None else [results]
 
         self.ui.lineEdit_Answer.clear()
         self.ui.lineEdit_Answer.setText(results.prediction)
 
-        # Show top predictions
+        # Show top predictions (or the per-question answers of a question list)
         detailsBox = self.ui.textEdit_Details
         detailsBox.clear()
-        details = []
-        self.current_model_details = ""
-        for prediction, prob in results.top_predictions:
-            details.append(f"{prediction}\t{prob:.5f}\n")
-        self.current_model_details = "".join(details)
+        if details is None:
+            details = "".join(f"{prediction}\t{prob:.5f}\n" for prediction, prob in results.top_predictions)
+        self.current_model_details = details
         detailsBox.setText(self.current_model_details)
+        self.showTimings()
 
         # Clear the old visualization dropdown options
         self.ui.comboBox_Visualizations.clear()
@@ -339,6 +503,17 @@ class VQAInteractionScreen(QWidget):
             self.displayVisualization(defaultImageIndex)
         
         if (self.ui.checkBox_ExportResults.isChecked()):
-            self.ExportResults.exportResults(self.predictionResult, self.current_model_details, 
-                                             self.cameraEffect, self.weatherEffects, 
-                                             self.ui.checkBox_ExportResults)
+            # Exporting generates every visualization, so keep it off the GUI thread
+            worker = Worker(self.ExportResults.exportResults, self.predictionResult, self.current_model_details, 
+                            self.cameraEffect, [effect.copy() for effect in self.weatherEffects])
+            worker.signals.result.connect(self.showExportStatus)
+            worker.signals.error.connect(lambda _: self.showExportStatus(False))
+            self.threadManager.start(worker)
+
+    def showExportStatus(self, exported):
+        '''
+        Shows the outcome of an export on the export checkbox for 2 seconds (runs on the GUI thread)
+        '''
+        exportCheckBox = self.ui.checkBox_ExportResults
+        exportCheckBox.setText("Exported" if exported else "Could Not Export")
+        QTimer.singleShot(2000, lambda: self.ExportResults.resetExportText(exportCheckBox))
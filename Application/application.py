@@ -1,45 +1,102 @@
 # This Python file uses the following encoding: utf-8
+# Only what the load screen needs is imported up front; everything else is imported while it is showing.
+# Set DRONEVQA_PROFILE_STARTUP=1 for a startup timing report (see StartupUtils.py and `python benchmark.py startup`).
+import time
+startupTime = time.perf_counter()
+
+from StartupUtils import StartupProfiler
+profiler = StartupProfiler(startupTime)
+
 from pathlib import Path
+import importlib
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from PySide6.QtWidgets import QApplication, QStackedWidget
 from PySide6.QtGui import QIcon
-from PySide6.QtCore import QThreadPool
+from PySide6.QtCore import QTimer
 from LoadScreen import LoadScreen
 
-def ImportGlobalModules(loadScreen):
-    loadScreen.updateLoadStatus(percentComplete=5, statusText="Importing AirSim")
-    global airsim
-    import airsim
-
-    loadScreen.updateLoadStatus(percentComplete=15, statusText="Importing LaunchScreen")
+def waitFor(app, future):
+    '''Keeps the load screen responsive until a background task finishes, then returns its exception (or None)'''
+    while not future.done():
+        app.processEvents()
+        time.sleep(0.05)
+    return future.exception()
+
+def waitForFirstModel(app, loadScreen, futures, startPercent, endPercent):
+    '''
+    Keeps the load screen responsive while models load in parallel and returns the name of the first model that
+    loaded successfully, or None once every load has failed. The progress bar follows the finished loads.
+    '''
+    pending = dict(futures)
+    while pending:
+        app.processEvents()
+        time.sleep(0.05)
+        for name, future in list(pending.items()):
+            if not future.done():
+                continue
+            del pending[name]
+            if future.exception() is None:
+                loadScreen.updateProgress(endPercent)
+                return name
+        loadScreen.updateProgress(startPercent + ((endPercent - startPercent) * (len(futures) - len(pending))) // len(futures))
+    return None
+
+def updateLoadStatus(loadScreen, percentComplete, statusText):
+    '''Shows a startup step on the load screen and records it as a startup milestone'''
+    profiler.mark(statusText.split("\n")[0])
+    loadScreen.updateLoadStatus(percentComplete=percentComplete, statusText=statusText)
+
+def ImportGlobalModules(app, loadScreen):
+    # AirSim, torch, transformers and the model code are by far the slowest imports; they are imported one after the
+    # other on a background thread while the GUI thread imports the screens, so the load screen keeps responding.
+    # Everything the two threads share (settings, Qt, the standard library modules both pull in) is imported before
+    # the background thread starts or after it has finished, so they never initialize the same module at once, which
+    # can deadlock on the import locks or hand one thread a partially initialized module.
+    global settings
+    from SettingsUtils import settings
+
+    importExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Import")
+    airsimImport = importExecutor.submit(profiler.timeImport, "airsim", lambda: importlib.import_module("airsim"))
+    modelImport = importExecutor.submit(profiler.timeImport, "ModelPredictionUtils",
+                                        lambda: importlib.import_module("ModelPredictionUtils"))
+    importExecutor.shutdown(wait=False)
+
+    # Only needs Qt, which is already imported
+    updateLoadStatus(loadScreen, percentComplete=5, statusText="Importing LaunchScreen")
     global LaunchScreen
     from LaunchScreen import LaunchScreen
 
-    loadScreen.updateLoadStatus(percentComplete=20, statusText="Importing VQAInteractionScreen")
-    global VQAInteractionScreen
-    from VQAInteractionScreen import VQAInteractionScreen
+    updateLoadStatus(loadScreen, percentComplete=15, statusText="Importing AirSim")
+    error = waitFor(app, airsimImport)
+    if error is not None:
+        raise error
+    global airsim
+    import airsim
 
-    loadScreen.updateLoadStatus(percentComplete=30, statusText="Importing AirSimControl")
+    # Only needs AirSim and Qt, which are both imported by now
+    updateLoadStatus(loadScreen, percentComplete=20, statusText="Importing AirSimControl")
     global AirSimControl
     from AirSimControl import AirSimControl
 
-    loadScreen.updateLoadStatus(percentComplete=40, statusText="Importing setupViltTransformer")
-    global setupViltTransformer
-    from ModelPredictionUtils import setupViltTransformer
-    
-    loadScreen.updateLoadStatus(percentComplete=45, statusText="Importing setupViltTransformer")
-    global setupFineViltTransformer
-    from ModelPredictionUtils import setupFineViltTransformer
+    updateLoadStatus(loadScreen, percentComplete=30, statusText="Importing PyTorch and the models")
+    error = waitFor(app, modelImport)
+    if error is not None:
+        raise error
+    global MODEL_SETUPS, warmUpModel
+    from ModelPredictionUtils import MODEL_SETUPS, warmUpModel
+
+    updateLoadStatus(loadScreen, percentComplete=45, statusText="Importing VQAInteractionScreen")
+    global VQAInteractionScreen
+    from VQAInteractionScreen import VQAInteractionScreen
 
-    loadScreen.updateLoadStatus(percentComplete=50, statusText="Importing setupLxmertTransformer")
-    global setupLxmertTransformer
-    from ModelPredictionUtils import setupLxmertTransformer
+    global applyThreadingProfile, createThreadPools
+    from ThreadingUtils import applyThreadingProfile, createThreadPools
 
-    loadScreen.updateLoadStatus(percentComplete=55, statusText="Importing setupLxmertTransformer_finetuned")
-    global setupLxmertTransformer_finetuned
-    from ModelPredictionUtils import setupLxmertTransformer_finetuned
+    global ModelRegistry
+    from ModelRegistry import ModelRegistry
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -59,43 +116,110 @@ if __name__ == "__main__":
 
     # Update App To Display Loading Screen
     app.processEvents()
+    profiler.mark("first window")
 
     # Import modules while the loading screen  is displaying
-    ImportGlobalModules(loadScreen)
+    ImportGlobalModules(app, loadScreen)
 
-    loadScreen.updateLoadStatus(percentComplete=55, statusText="Initializing AirSimControl")
+    updateLoadStatus(loadScreen, percentComplete=55, statusText="Initializing AirSimControl")
     controller = AirSimControl()
 
-    loadScreen.updateLoadStatus(percentComplete=60, statusText="Initializing QThreadPool")
-    threadManager = QThreadPool()
+    # Apply the threading profile before any model runs
+    updateLoadStatus(loadScreen, percentComplete=60, statusText="Applying threading profile")
+    applyThreadingProfile(settings["threading"])
+    cameraThreadManager, threadManager = createThreadPools(settings["threading"])
 
     # Initialize global variables
-    loadScreen.updateLoadStatus(percentComplete=65, statusText="Initializing global camera variables")
+    updateLoadStatus(loadScreen, percentComplete=65, statusText="Initializing global camera variables")
     CAMERA_NAME = '0'
     IMAGE_TYPE = airsim.ImageType.Scene
     DECODE_EXTENSION = '.png'
     record = True
 
-    # Setup Models 
-    loadScreen.updateLoadStatus(percentComplete=65, statusText="Beginning to set up models...")
-    models = []
-    loadScreen.updateLoadStatus(percentComplete=70, statusText="Initializing Vilt model\nThis step will take longer the first time this application loads.")
-    models.append((setupViltTransformer()))
-    loadScreen.updateLoadStatus(percentComplete=75, statusText="Initializing fine-tuned Vilt model\nThis step will take longer the first time this application loads.")
-    models.append((setupFineViltTransformer()))
-    loadScreen.updateLoadStatus(percentComplete=80, statusText="Initializing base LxMERT model\nThis step will take longer the first time this application loads.")
-    models.append((setupLxmertTransformer()))
-    loadScreen.updateLoadStatus(percentComplete=90, statusText="Initializing fine-tuned LxMERT model\nThis step will take longer the first time this application loads.")
-    models.append((setupLxmertTransformer_finetuned()))
-    loadScreen.updateLoadStatus(percentComplete=95, statusText="Switching to launch screen...")
+    # Setup Models. Models are loaded by name on first use; only the preloaded ones are loaded before the launch screen.
+    updateLoadStatus(loadScreen, percentComplete=65, statusText="Beginning to set up models...")
+    preloads = [] if settings["server"]["enabled"] else settings["models"]["preload"]
+    modelRegistry = ModelRegistry(MODEL_SETUPS, budget_mb=settings["models"]["ram_budget_mb"],
+                                  max_parallel_loads=settings["models"]["parallel_loads"] or max(1, len(preloads)))
+    modelRegistry.addListener(loadScreen.modelEvent.emit)
+
+    # When the GUI uses the inference server, the server hosts the models and nothing is loaded here
+    inferenceClient = None
+    processPool = None
+    if settings["server"]["enabled"]:
+        from ServerUtils import InferenceClient
+        inferenceClient = InferenceClient(settings["server"]["url"], timeout=settings["server"]["timeout_s"])
+        updateLoadStatus(loadScreen, percentComplete=70, statusText=f"Connecting to VQA server at {inferenceClient.url}")
+        if not inferenceClient.isAvailable():
+            print(f"VQA server at {inferenceClient.url} is not responding yet; questions will fail until it is started")
+    # With the process pool, models are loaded here and their weights are shared with the worker processes
+    elif settings["process_pool"]["enabled"]:
+        updateLoadStatus(loadScreen, percentComplete=70, statusText="Starting inference worker processes")
+        from ProcessPoolUtils import InferenceProcessPool
+        workers = settings["process_pool"]["workers"]
+        threadsPerWorker = settings["process_pool"]["threads_per_worker"] or max(1, (os.cpu_count() or 1) // workers)
+        processPool = InferenceProcessPool(modelRegistry, workers=workers, threads_per_worker=threadsPerWorker,
+                                           timeout_s=settings["process_pool"]["timeout_s"])
+        app.aboutToQuit.connect(processPool.shutdown)
+        inferenceClient = processPool
+
+    # Every preloaded model is built at once on the registry's loading threads (the load screen shows each one's
+    # status). The launch screen opens as soon as the first one is ready; the rest keep loading in the background and
+    # questions for them wait until they are ready.
+    updateLoadStatus(loadScreen, percentComplete=70, statusText=f"Loading {', '.join(preloads)} models...")
+    preloadFutures = {name: modelRegistry.load(name) for name in preloads}
+    if preloads:
+        waitForFirstModel(app, loadScreen, preloadFutures, 70, 85)
+
+    # Warm up the preloaded models so the first question is answered at steady-state latency. Warm-ups run one at a
+    # time in the background, each as soon as its model has loaded, so they never hold back the launch screen.
+    warmUpExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="WarmUp")
+    app.aboutToQuit.connect(lambda: warmUpExecutor.shutdown(wait=False, cancel_futures=True))
+
+    # Warm-ups report to the load screen the same way model loads do
+    def warmUp(name):
+        loadScreen.modelEvent.emit("warming up", name, {})
+        try:
+            seconds = processPool.warmUp(name) if processPool is not None else warmUpModel(name, modelRegistry.get(name))
+        except Exception as error:
+            print(f"Could not warm up {name} model: {error}")
+            loadScreen.modelEvent.emit("warm-up failed", name, {"error": str(error)})
+            raise
+        print(f"Warmed up {name} model in {seconds:.1f} s")
+        loadScreen.modelEvent.emit("warmed up", name, {"seconds": seconds})
+        return seconds
+
+    def warmUpInBackground(name, loadFuture):
+        if loadFuture.exception() is not None:
+            print(f"Could not preload {name} model; it will be loaded on first use: {loadFuture.exception()}")
+        elif settings["models"]["warm_up"]:
+            warmUpExecutor.submit(warmUp, name)
+
+    # Models that have loaded already (at least the first one) have their warm-up queued right away
+    for name, loadFuture in preloadFutures.items():
+        loadFuture.add_done_callback(lambda loadFuture, name=name: warmUpInBackground(name, loadFuture))
+
+    updateLoadStatus(loadScreen, percentComplete=95, statusText="Switching to launch screen...")
 
     # Switch to the launch screen
-    VQAScreen = VQAInteractionScreen(threadManager, controller, models)
+    VQAScreen = VQAInteractionScreen(threadManager, controller, modelRegistry, cameraThreadManager, inferenceClient)
     launchScreen = LaunchScreen(app, stackedWidget, threadManager, VQAScreen, controller)
+    # Models still loading or warming up keep reporting their status on the launch screen
+    loadScreen.modelStatusChanged.connect(launchScreen.showModelStatus)
+    loadScreen.showModelStatus()
     stackedWidget.addWidget(launchScreen)
     stackedWidget.addWidget(VQAScreen)
     stackedWidget.resize(500, 625)
     stackedWidget.setCurrentWidget(launchScreen)
 
+    # Runs once the event loop has drawn the launch screen
+    def launchScreenShown():
+        profiler.mark("launch screen")
+        if profiler.enabled:
+            profiler.report()
+        if profiler.exitAfterStartup:
+            app.quit()
+    QTimer.singleShot(0, launchScreenShown)
+
     sys.exit(app.exec())
 
@@ -0,0 +1,171 @@
+# This Python file uses the following encoding: utf-8
+# Headless batch VQA: runs a question checklist against every frame in a directory or glob and writes one JSON line
+# per (image, question). Run from the Application folder, e.g.:
+#   python batch_vqa.py "Exports and Snapshots/Snapshots/" --questions checklist.txt --model LXMERT --output flight.jsonl
+# Re-running with the same output file skips the (image, question) pairs it already answered.
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+def findImages(source):
+    '''Yields image paths from a directory (sorted, not recursive) or a glob pattern'''
+    if os.path.isdir(source):
+        paths = (os.path.join(source, name) for name in sorted(os.listdir(source)))
+    else:
+        paths = iter(sorted(glob.glob(source, recursive=True)))
+    return (path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path))
+
+def completedPairs(output_path):
+    '''Returns the (image, question) pairs that already have an answer in the output file'''
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, encoding='utf-8') as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # A line cut off when the previous run was stopped
+            if "error" not in record:
+                done.add((record["image"], record["question"]))
+    return done
+
+def endsWithNewline(output_path):
+    '''False when the output file exists and its last line was cut off (e.g. the previous run was killed)'''
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return True
+    with open(output_path, "rb") as output_file:
+        output_file.seek(-1, os.SEEK_END)
+        return output_file.read(1) == b"\n"
+
+def defaultWorkers():
+    '''One worker per 4 cores (at least one); each worker uses its share of the cores for torch'''
+    return max(1, (os.cpu_count() or 1) // 4)
+
+# Worker process state, set up once per process by initWorker
+_model_name = None
+_model = None
+_load_error = None
+
+def initWorker(model_name, threads):
+    '''
+    Loads the model in a worker process. Errors are kept for answerImage to report: a Pool initializer that raises
+    makes the pool restart the worker forever instead of failing.
+    '''
+    global _model_name, _model, _load_error
+    _model_name = model_name
+    try:
+        import torch
+        from ModelPredictionUtils import MODEL_SETUPS
+        from TimingUtils import metrics_log
+
+        torch.set_num_threads(threads)
+        # Several workers cannot share the rolling metrics file; the stage timings are in each answer's record instead
+        metrics_log.enabled = False
+        start = time.perf_counter()
+        _model = MODEL_SETUPS[model_name]()
+    except Exception as error:
+        _load_error = repr(error)
+        print(f"[worker {os.getpid()}] could not load {model_name}: {_load_error}")
+        return
+    print(f"[worker {os.getpid()}] loaded {model_name} in {time.perf_counter() - start:.1f} s")
+
+def answerImage(task):
+    '''Answers the remaining questions about one image in a single batch and returns their JSON records'''
+    from benchmark import loadImage
+    from ModelPredictionUtils import predictBatchForModel
+
+    path, questions = task
+    if _load_error is not None:
+        return [{"image": path, "question": question, "model": _model_name, "error": _load_error, "load_failed": True}
+                for question in questions]
+
+    records = []
+    try:
+        start = time.perf_counter()
+        image = loadImage(path)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        # Only answers are recorded, so skip all explainability work. Every frame is answered on its own, even when it
+        # looks like an earlier one.
+        results = predictBatchForModel(_model_name, _model, questions, image, answer_only=True, use_cache=False)
+        predict_seconds = time.perf_counter() - start
+    except Exception as error:
+        return [{"image": path, "question": question, "model": _model_name, "error": repr(error)} for question in questions]
+
+    for result in results:
+        records.append({
+            "image": path,
+            "question": result.question,
+            "model": _model_name,
+            "answer": result.prediction,
+            "top_predictions": [[answer, float(probability)] for answer, probability in result.top_predictions],
+            "timings": {
+                "load_image_s": round(load_seconds, 4),
+                "batch_predict_s": round(predict_seconds, 4),
+                "per_question_s": round(predict_seconds / len(questions), 4),
+                "batch_size": len(questions),
+            },
+            "worker": os.getpid(),
+        })
+    return records
+
+def main():
+    from benchmark import loadQuestions
+    from ModelPredictionUtils import MODEL_SETUPS
+
+    parser = argparse.ArgumentParser(description="Run a question checklist against a directory of frames")
+    parser.add_argument("images", help="directory of frames, or a glob pattern such as 'flights/**/*.png'")
+    parser.add_argument("--questions", required=True, help="text file with one question per line")
+    parser.add_argument("--model", default="ViLT", choices=list(MODEL_SETUPS), help="model to use")
+    parser.add_argument("--output", required=True, help="JSONL file to append results to")
+    parser.add_argument("--workers", type=int, default=defaultWorkers(), help="worker processes (each loads the model)")
+    args = parser.parse_args()
+
+    questions = loadQuestions(args.questions)
+    done = completedPairs(args.output)
+    if done:
+        print(f"Resuming: {len(done)} answers already in {args.output}")
+
+    # Stream (image, remaining questions) tasks so large directories are not listed up front
+    def tasks():
+        for path in findImages(args.images):
+            remaining = [question for question in questions if (path, question) not in done]
+            if remaining:
+                yield path, remaining
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    context = multiprocessing.get_context("spawn")
+    written = 0
+    start = time.perf_counter()
+    # Start on a new line when the previous run was killed halfway through writing one
+    separator = "" if endsWithNewline(args.output) else "\n"
+    with context.Pool(args.workers, initializer=initWorker,
+                      initargs=(args.model, threads)) as pool, \
+         open(args.output, "a", encoding="utf-8") as output_file:
+        output_file.write(separator)
+        for records in pool.imap_unordered(answerImage, tasks()):
+            # Every worker loads the same model, so one failure means none of them can answer
+            if records[0].get("load_failed"):
+                print(f"Could not load the {args.model} model: {records[0]['error']}")
+                sys.exit(1)
+            for record in records:
+                output_file.write(json.dumps(record) + "\n")
+            # Flush after every image so an interrupted run can be resumed from the file
+            output_file.flush()
+            written += len(records)
+            print(f"{written} answers written ({records[0]['image']})")
+
+    print(f"Done: {written} answers in {time.perf_counter() - start:.1f} s with {args.workers} workers x {threads} threads")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+# This Python file uses the following encoding: utf-8
+# Inference benchmarks. Run from the Application folder, e.g.:
+#   python benchmark.py answer-only --image "../Model Testing/test.jpg"
+#   python benchmark.py --questions questions.txt quantization --models ViLT LXMERT
+#   python benchmark.py threads --write
+#   python benchmark.py bf16 --verbose
+#   python benchmark.py startup --output startup_times.jsonl
+
+import argparse
+import statistics
+import time
+from contextlib import nullcontext
+
+import cv2
+import torch
+
+DEFAULT_IMAGE = "../Model Testing/test.jpg"
+DEFAULT_QUESTIONS = [
+    "How many cars are there?",
+    "What color is the building?",
+    "Is there a person in the image?",
+    "Is the road wet?",
+    "What is in the sky?",
+]
+
+def loadImage(path):
+    '''Loads an image file as an RGB array, the same layout the camera feed produces'''
+    image = cv2.imread(path)
+    if image is None:
+        raise FileNotFoundError(f"Could not read image {path}")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+def loadQuestions(path):
+    if path is None:
+        return DEFAULT_QUESTIONS
+    with open(path, encoding='utf-8') as question_file:
+        return [line.strip() for line in question_file if line.strip()]
+
+def timeIt(fn, repeats=5, warmup=1):
+    '''Runs fn warmup + repeats times and returns latency statistics (seconds) of the timed runs'''
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    return {"median": statistics.median(timings), "mean": statistics.mean(timings), "min": min(timings)}
+
+def retainedBytes(fn, model):
+    '''
+    Runs fn once and returns (result, bytes) where bytes counts the tensors autograd saved for backward plus the
+    inputs/attention maps the LRP layers stored on the model's modules. This is the memory the explainers need
+    and the answer-only path avoids.
+    '''
+    saved = [0]
+
+    def pack(tensor):
+        saved[0] += tensor.element_size() * tensor.nelement()
+        return tensor
+
+    # Clear what previous runs left on the modules so only this run is counted
+    for module in model.modules():
+        for attribute in ("X", "attn"):
+            if isinstance(getattr(module, attribute, None), (torch.Tensor, list)):
+                setattr(module, attribute, None)
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        result = fn()
+
+    for module in model.modules():
+        for attribute in ("X", "attn"):
+            value = getattr(module, attribute, None)
+            tensors = value if isinstance(value, list) else [value]
+            saved[0] += sum(t.element_size() * t.nelement() for t in tensors if isinstance(t, torch.Tensor))
+
+    return result, saved[0]
+
+def formatResult(name, latency, memory):
+    return (f"{name:<28} median {latency['median'] * 1000:9.1f} ms   mean {latency['mean'] * 1000:9.1f} ms"
+            f"   retained {memory / 2**20:8.1f} MiB")
+
+def benchmarkAnswerOnly(args):
+    '''Compares the answer-only forward (inference_mode, no relevance capture) with a capturing forward'''
+    from ModelPredictionUtils import (answerOnlyInference, runLxmert, tokenizeLxmert,
+                                      setupViltTransformer, setupLxmertTransformer)
+
+    image = loadImage(args.image)
+    questions = loadQuestions(args.questions)
+    modes = [("capture (explainer forward)", nullcontext), ("answer only", answerOnlyInference)]
+
+    print(f"{len(questions)} questions, {args.repeats} timed runs per mode\n")
+
+    model, processor, _ = setupViltTransformer()
+    encoding = processor(images=[image] * len(questions), text=questions, padding=True, return_tensors="pt")
+    print("ViLT")
+    for name, mode in modes:
+        def forward():
+            with mode():
+                return model(**encoding)
+        _, memory = retainedBytes(forward, model)
+        print(formatResult(name, timeIt(forward, args.repeats), memory))
+
+    lxmert_tokenizer, lxmert_vqa, frcnn_detector = setupLxmertTransformer()
+    output_dict, _ = frcnn_detector.detect(image, visualize=False)
+    inputs = tokenizeLxmert(lxmert_tokenizer, questions)
+    print("\nLXMERT (FRCNN excluded)")
+    for name, mode in modes:
+        def forward():
+            with mode():
+                return runLxmert(lxmert_vqa, output_dict, inputs)
+        _, memory = retainedBytes(forward, lxmert_vqa)
+        print(formatResult(name, timeIt(forward, args.repeats), memory))
+
+def benchmarkQuantization(args):
+    '''
+    Compares int8 dynamically quantized models with their fp32 versions on a fixed question set: answer agreement
+    with fp32 (top-1 and top-5 overlap), latency of the answer-only batch and the size of the weights
+    '''
+    from ModelPredictionUtils import MODEL_SETUPS, predictBatchForModel
+    from ModelRegistry import modelSizeBytes
+
+    image = loadImage(args.image)
+    questions = loadQuestions(args.questions)
+    print(f"{len(questions)} questions, {args.repeats} timed runs per model\n")
+
+    for model_name in args.models:
+        runs = {}
+        for precision, quantize in (("fp32", False), ("int8", True)):
+            model = MODEL_SETUPS[model_name](quantize=quantize)
+            predict = lambda: predictBatchForModel(model_name, model, questions, image, answer_only=True, use_cache=False)
+            results = predict()
+            runs[precision] = (results, timeIt(predict, args.repeats), modelSizeBytes(model))
+            del model
+
+        reference = runs["fp32"][0]
+        print(model_name)
+        for precision, (results, latency, size) in runs.items():
+            top1, top5 = answerAgreement(results, reference)
+            print(f"  {precision}  median {latency['median'] * 1000:9.1f} ms   weights {size / 2**20:8.1f} MiB"
+                  f"   top-1 agreement {top1:6.1%}   top-5 overlap {top5:6.1%}")
+
+        if args.verbose:
+            printAnswers(questions, reference, runs["int8"][0], "int8")
+        print()
+
+def benchmarkBf16(args):
+    '''
+    Compares the bf16 CPU autocast mode with fp32: latency of the answer-only batch (for LXMERT including FRCNN,
+    which is re-run on every repeat) and answer agreement with fp32 (top-1 and top-5 overlap)
+    '''
+    from ModelPredictionUtils import MODEL_SETUPS, frcnn_cache, predictBatchForModel
+    from SettingsUtils import settings
+
+    image = loadImage(args.image)
+    questions = loadQuestions(args.questions)
+    print(f"{len(questions)} questions, {args.repeats} timed runs per mode")
+    print("bf16 is only faster on CPUs with native bf16 support (e.g. AVX512-BF16 or AMX)\n")
+
+    for model_name in args.models:
+        model = MODEL_SETUPS[model_name]()
+        runs = {}
+        for precision in ("fp32", "bf16"):
+            settings["models"]["precision"] = precision
+            def predict():
+                frcnn_cache.clear()
+                return predictBatchForModel(model_name, model, questions, image, answer_only=True, use_cache=False)
+            runs[precision] = (predict(), timeIt(predict, args.repeats))
+        del model
+
+        reference = runs["fp32"][0]
+        print(model_name)
+        for precision, (results, latency) in runs.items():
+            top1, top5 = answerAgreement(results, reference)
+            print(f"  {precision}  median {latency['median'] * 1000:9.1f} ms   mean {latency['mean'] * 1000:9.1f} ms"
+                  f"   top-1 agreement {top1:6.1%}   top-5 overlap {top5:6.1%}")
+
+        if args.verbose:
+            printAnswers(questions, reference, runs["bf16"][0], "bf16")
+        print()
+
+def answerAgreement(results, reference):
+    '''Returns the fraction of questions with the same top answer as reference and the mean top-5 overlap'''
+    top1 = sum(r.prediction == f.prediction for r, f in zip(results, reference)) / len(reference)
+    top5 = statistics.mean(
+        len({a for a, _ in r.top_predictions} & {a for a, _ in f.top_predictions}) / len(f.top_predictions)
+        for r, f in zip(results, reference))
+    return top1, top5
+
+def printAnswers(questions, reference, results, name):
+    for question, f, q in zip(questions, reference, results):
+        marker = " " if f.prediction == q.prediction else "*"
+        print(f"   {marker} {question:<40} fp32: {f.prediction:<20} {name}: {q.prediction}")
+
+# Prefix of the line a `threads --inter-op N` child process reports its total latency on
+THREADS_REPORT_PREFIX = "THREADS_TOTAL "
+
+def benchmarkThreads(args):
+    '''
+    Auto-tunes the threading profile: times predictVilt/predictLxmert (through predictForModel) on this machine at
+    each candidate torch intra-op thread count, then at each OpenCV thread count with the best intra-op count, then at
+    each torch inter-op thread count with both. Each sweep picks the count with the lowest total median latency
+    across the models. For LXMERT, FRCNN is re-run on every repeat; unless --answer-only is given, the first
+    visualization (the one the GUI generates with the answer) is timed too. PyTorch fixes the inter-op count at its
+    first parallel work, so each inter-op count is timed in a fresh process. With --write the three counts are saved
+    to the threading profile in DroneVQASettings.json; the Qt pool sizes are left as they are.
+    '''
+    import json
+    import os
+    import subprocess
+    import sys
+    from ModelPredictionUtils import MODEL_SETUPS
+    from SettingsUtils import saveSettings
+    from ThreadingUtils import threadCandidates
+
+    image = loadImage(args.image)
+    question = loadQuestions(args.questions)[0]
+
+    # Child process timing one inter-op count (see the inter-op sweep below)
+    if args.inter_op is not None:
+        torch.set_num_interop_threads(args.inter_op)
+        torch.set_num_threads(args.threads[0])
+        cv2.setNumThreads(args.opencv_threads[0])
+        models = {model_name: MODEL_SETUPS[model_name]() for model_name in args.models}
+        print(THREADS_REPORT_PREFIX + json.dumps(timeThreadSetting(models, image, question, args)))
+        return
+
+    cores = os.cpu_count() or 1
+    candidates = args.threads or threadCandidates(cores)
+    opencv_candidates = args.opencv_threads or threadCandidates(cores)
+    inter_op_candidates = args.inter_op_threads or threadCandidates(cores)
+    print(f"Intra-op {candidates}, OpenCV {opencv_candidates}, inter-op {inter_op_candidates} threads, "
+          f"{args.repeats} timed runs each, answer_only={args.answer_only}\n")
+
+    models = {model_name: MODEL_SETUPS[model_name]() for model_name in args.models}
+
+    print("torch intra-op threads")
+    totals = {}
+    for threads in candidates:
+        torch.set_num_threads(threads)
+        print(f"  {threads:>3} threads")
+        totals[threads] = timeThreadSetting(models, image, question, args)
+    best = min(totals, key=totals.get)
+    torch.set_num_threads(best)
+
+    print("\nOpenCV threads")
+    opencv_totals = {}
+    for threads in opencv_candidates:
+        cv2.setNumThreads(threads)
+        print(f"  {threads:>3} threads")
+        opencv_totals[threads] = timeThreadSetting(models, image, question, args)
+    best_opencv = min(opencv_totals, key=opencv_totals.get)
+    del models
+
+    print("\ntorch inter-op threads (each in a fresh process)")
+    inter_op_totals = {}
+    for threads in inter_op_candidates:
+        command = [sys.executable, "benchmark.py", "--image", args.image, "--repeats", str(args.repeats)]
+        if args.questions:
+            command += ["--questions", args.questions]
+        command += ["threads", "--models", *args.models, "--threads", str(best), "--opencv-threads", str(best_opencv),
+                    "--inter-op", str(threads)]
+        if args.answer_only:
+            command.append("--answer-only")
+        process = subprocess.run(command, capture_output=True, text=True)
+        reports = [line[len(THREADS_REPORT_PREFIX):] for line in process.stdout.splitlines()
+                   if line.startswith(THREADS_REPORT_PREFIX)]
+        if process.returncode != 0 or not reports:
+            print(process.stdout[-2000:], process.stderr[-2000:])
+            raise RuntimeError(f"Timing {threads} inter-op threads failed with exit code {process.returncode}")
+        inter_op_totals[threads] = json.loads(reports[-1])
+        print(f"  {threads:>3} threads   total median {inter_op_totals[threads] * 1000:9.1f} ms")
+    best_inter_op = min(inter_op_totals, key=inter_op_totals.get)
+
+    print(f"\nBest torch intra-op thread count: {best} (total median {totals[best] * 1000:.1f} ms)")
+    print(f"Best OpenCV thread count: {best_opencv} (total median {opencv_totals[best_opencv] * 1000:.1f} ms)")
+    print(f"Best torch inter-op thread count: {best_inter_op} "
+          f"(total median {inter_op_totals[best_inter_op] * 1000:.1f} ms)")
+
+    if args.write:
+        saveSettings("threading", {"torch_intra_op_threads": best, "opencv_threads": best_opencv,
+                                   "torch_inter_op_threads": best_inter_op})
+        print("Saved to the threading profile in DroneVQASettings.json")
+
+def timeThreadSetting(models, image, question, args):
+    '''Times one prediction per model at the current thread counts and returns the total median latency in seconds'''
+    from ModelPredictionUtils import frcnn_cache, predictForModel
+
+    total = 0.0
+    for model_name, model in models.items():
+        def predict():
+            # FRCNN is the heaviest and most thread-sensitive stage, so it must not be served from the cache
+            frcnn_cache.clear()
+            result = predictForModel(model_name, model, question, image, answer_only=args.answer_only, use_cache=False)
+            # Visualizations are generated on demand; time the one the GUI shows with the answer
+            if not args.answer_only and len(result.visualizations):
+                result.visualizations[0]
+            return result
+        latency = timeIt(predict, args.repeats)
+        total += latency["median"]
+        print(f"        {model_name:<20} median {latency['median'] * 1000:9.1f} ms   min {latency['min'] * 1000:9.1f} ms")
+    return total
+
+def benchmarkStartup(args):
+    '''
+    Times application startup: launches application.py --repeats times with the startup profiler on (it quits as
+    soon as the launch screen is showing) and reports the median time to the first window (the load screen) and to
+    the launch screen, plus the slowest imports of the last run. With --output the medians are appended to a JSON
+    lines file so the numbers can be tracked across changes. Needs everything the application needs to start,
+    including AirSim.
+    '''
+    import datetime
+    import json
+    import os
+    import subprocess
+    import sys
+    from StartupUtils import REPORT_PREFIX
+
+    environment = dict(os.environ, DRONEVQA_PROFILE_STARTUP="1", DRONEVQA_EXIT_AFTER_STARTUP="1")
+    runs = []
+    for run in range(args.repeats):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "application.py"], env=environment, capture_output=True, text=True)
+        wall = time.perf_counter() - start
+        reports = [line[len(REPORT_PREFIX):] for line in process.stdout.splitlines() if line.startswith(REPORT_PREFIX)]
+        if process.returncode != 0 or not reports:
+            print(process.stdout[-2000:], process.stderr[-2000:])
+            raise RuntimeError(f"application.py exited with code {process.returncode} before the launch screen was shown")
+
+        report = json.loads(reports[-1])
+        report["wall_s"] = wall
+        runs.append(report)
+        milestones = report["milestones"]
+        print(f"  run {run + 1}: first window {milestones['first window']:6.2f} s   "
+              f"launch screen {milestones['launch screen']:6.2f} s   process {wall:6.2f} s")
+
+    summary = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "runs": len(runs),
+        "first_window_s": round(statistics.median(run["milestones"]["first window"] for run in runs), 3),
+        "launch_screen_s": round(statistics.median(run["milestones"]["launch screen"] for run in runs), 3),
+        "process_s": round(statistics.median(run["wall_s"] for run in runs), 3),
+    }
+    print(f"\nMedian time to first window {summary['first_window_s']:.2f} s, "
+          f"to launch screen {summary['launch_screen_s']:.2f} s ({summary['runs']} runs)")
+
+    imports = sorted(runs[-1]["imports"].items(), key=lambda item: item[1]["self_s"], reverse=True)
+    print("\nSlowest imports (last run)")
+    for package, times in imports[:15]:
+        print(f"  {times['self_s']:8.3f} s self  {times['cumulative_s']:8.3f} s cumulative  {package}")
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as output_file:
+            output_file.write(json.dumps(summary) + "\n")
+        print(f"\nAppended to {args.output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="DroneVQA inference benchmarks")
+    parser.add_argument("--image", default=DEFAULT_IMAGE, help="RGB test frame")
+    parser.add_argument("--questions", default=None, help="text file with one question per line")
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs per measurement")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    subparsers.add_parser("answer-only", help="answer-only fast path vs. capturing forward").set_defaults(run=benchmarkAnswerOnly)
+
+    quantization = subparsers.add_parser("quantization", help="int8 dynamic quantization vs. fp32 accuracy and latency")
+    quantization.add_argument("--models", nargs="+", default=["ViLT", "ViLT Fine-Tuned", "LXMERT", "LXMERT Fine-Tuned"],
+                              help="model names to compare")
+    quantization.add_argument("--verbose", action="store_true", help="print every question's fp32 and int8 answers")
+    quantization.set_defaults(run=benchmarkQuantization)
+
+    bf16 = subparsers.add_parser("bf16", help="bf16 CPU autocast vs. fp32 latency and answer agreement")
+    bf16.add_argument("--models", nargs="+", default=["ViLT", "ViLT Fine-Tuned", "LXMERT", "LXMERT Fine-Tuned"],
+                      help="model names to compare")
+    bf16.add_argument("--verbose", action="store_true", help="print every question's fp32 and bf16 answers")
+    bf16.set_defaults(run=benchmarkBf16)
+
+    threads = subparsers.add_parser("threads", help="tune the torch and OpenCV thread counts and optionally save the threading profile")
+    threads.add_argument("--models", nargs="+", default=["ViLT", "LXMERT"], help="model names to time")
+    threads.add_argument("--threads", nargs="+", type=int, default=None, help="intra-op thread counts to try (default: powers of two up to the core count)")
+    threads.add_argument("--opencv-threads", nargs="+", type=int, default=None, help="OpenCV thread counts to try (default: as --threads)")
+    threads.add_argument("--inter-op-threads", nargs="+", type=int, default=None, help="inter-op thread counts to try (default: as --threads)")
+    threads.add_argument("--inter-op", type=int, default=None, help=argparse.SUPPRESS) # child process timing one inter-op count
+    threads.add_argument("--answer-only", action="store_true", help="time answer-only predictions, without the first visualization")
+    threads.add_argument("--write", action="store_true", help="write the best thread counts to DroneVQASettings.json")
+    threads.set_defaults(run=benchmarkThreads)
+
+    startup = subparsers.add_parser("startup", help="time to first window and to the launch screen, and import costs")
+    startup.add_argument("--output", default=None, help="JSON lines file to append the median times to")
+    startup.set_defaults(run=benchmarkStartup)
+
+    args = parser.parse_args()
+
+    # Measure under the same threading profile the application uses (the startup benchmark runs the application)
+    if args.benchmark != "startup":
+        from SettingsUtils import settings
+        from ThreadingUtils import applyThreadingProfile
+        applyThreadingProfile(settings["threading"])
+
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
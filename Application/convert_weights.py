@@ -0,0 +1,72 @@
+# This Python file uses the following encoding: utf-8
+# Converts the model checkpoints (pickled modules, .pth/.bin state dicts) to memory-mapped safetensors files, then
+# checks that the mapped weights are identical to the originals. Run from the Application folder:
+#   python convert_weights.py                       convert every model and the shared FRCNN detector
+#   python convert_weights.py --models "ViLT Fine-Tuned"
+#   python convert_weights.py --check-only          only compare existing files with the checkpoints
+# The converted files are used automatically while "models": {"mapped_weights": true} is set in DroneVQASettings.json.
+
+import argparse
+import sys
+import time
+
+import torch
+
+from ModelPredictionUtils import (VILT, VILT_FINETUNED, LXMERT, LXMERT_FINETUNED,
+                                  VILT_WEIGHTS_NAME, FINE_VILT_WEIGHTS_NAME, LXMERT_WEIGHTS_NAME,
+                                  FINE_LXMERT_WEIGHTS_NAME, FRCNN_WEIGHTS_NAME, FrcnnDetector,
+                                  setupViltTransformer, setupFineViltTransformer,
+                                  setupLxmertTransformer, setupLxmertTransformer_finetuned)
+from SafetensorsUtils import loadSafetensors, saveMapped, weightPaths
+from SettingsUtils import settings
+
+FRCNN = "FRCNN"
+
+# Model name -> (function returning the fp32 module loaded from its original checkpoint, converted file name)
+CONVERSIONS = {
+    VILT: (lambda: setupViltTransformer(quantize=False)[0], VILT_WEIGHTS_NAME),
+    VILT_FINETUNED: (lambda: setupFineViltTransformer(quantize=False)[0], FINE_VILT_WEIGHTS_NAME),
+    LXMERT: (lambda: setupLxmertTransformer(quantize=False)[1], LXMERT_WEIGHTS_NAME),
+    LXMERT_FINETUNED: (lambda: setupLxmertTransformer_finetuned(quantize=False)[1], FINE_LXMERT_WEIGHTS_NAME),
+    FRCNN: (lambda: FrcnnDetector().frcnn, FRCNN_WEIGHTS_NAME),
+}
+
+def compareWeights(model, tensors):
+    '''Returns the names of the model's weights that are missing from tensors or differ from them'''
+    return [name for name, value in model.state_dict().items()
+            if name not in tensors or not torch.equal(value, tensors[name])]
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert model checkpoints to memory-mapped safetensors files")
+    parser.add_argument("--models", nargs="+", default=list(CONVERSIONS), choices=list(CONVERSIONS),
+                        help="models to convert")
+    parser.add_argument("--check-only", action="store_true", help="skip the conversion and check existing files")
+    args = parser.parse_args()
+
+    # Always start from the original checkpoints, never from earlier conversions
+    settings["models"]["mapped_weights"] = False
+
+    passed = True
+    for model_name in args.models:
+        load, name = CONVERSIONS[model_name]
+        start = time.perf_counter()
+        model = load()
+        print(f"Loaded {model_name} from its checkpoint in {time.perf_counter() - start:.1f} s")
+
+        if not args.check_only:
+            weights_path, _ = saveMapped(model, name)
+            print(f"Converted {model_name} to {weights_path}")
+
+        start = time.perf_counter()
+        tensors, _ = loadSafetensors(weightPaths(name)[0])
+        map_seconds = time.perf_counter() - start
+        mismatches = compareWeights(model, tensors)
+        passed = passed and not mismatches
+        print(f"  {model_name:<18} mapped in {map_seconds * 1000:.1f} ms   "
+              f"{'ok' if not mismatches else f'MISMATCH in {len(mismatches)} weights: {mismatches[:5]}'}")
+        del model, tensors
+
+    sys.exit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
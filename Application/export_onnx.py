@@ -0,0 +1,65 @@
+# This Python file uses the following encoding: utf-8
+# Exports the base and fine-tuned ViLT models to ONNX and checks the exported graphs against PyTorch.
+# Run from the Application folder:
+#   python export_onnx.py                  export both models, then run the parity check
+#   python export_onnx.py --check-only     only compare existing exports with PyTorch
+# The same parity check runs automatically in tests/test_onnx_parity.py (python -m pytest tests). Needs the optional
+# extras in requirements-onnx.txt.
+# Set "vilt": {"backend": "onnxruntime"} in DroneVQASettings.json to use the exports for answer-only requests.
+
+import argparse
+import sys
+
+from benchmark import DEFAULT_IMAGE, loadImage, loadQuestions
+from ModelPredictionUtils import (VILT, VILT_FINETUNED, VILT_ONNX_NAME, FINE_VILT_ONNX_NAME,
+                                  setupViltTransformer, setupFineViltTransformer)
+from OnnxUtils import OnnxViltModel, compareVilt, exportVilt, onnxPaths
+
+EXPORTS = {
+    VILT: (setupViltTransformer, VILT_ONNX_NAME),
+    VILT_FINETUNED: (setupFineViltTransformer, FINE_VILT_ONNX_NAME),
+}
+
+def encode(processor, model, questions, image):
+    '''Encodes the questions against one image the same way predictViltBatch does'''
+    return processor(images=[image] * len(questions), text=questions, padding=True, truncation=True,
+                     max_length=model.config.max_position_embeddings, return_tensors="pt")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export ViLT to ONNX and check parity with PyTorch")
+    parser.add_argument("--models", nargs="+", default=list(EXPORTS), choices=list(EXPORTS), help="models to export")
+    parser.add_argument("--image", default=DEFAULT_IMAGE, help="RGB frame used for tracing and the parity check")
+    parser.add_argument("--questions", default=None, help="text file with one question per line")
+    parser.add_argument("--opset", type=int, default=14, help="ONNX opset version")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="largest allowed absolute logit difference")
+    parser.add_argument("--check-only", action="store_true", help="skip the export and check existing graphs")
+    args = parser.parse_args()
+
+    image = loadImage(args.image)
+    questions = loadQuestions(args.questions)
+
+    passed = True
+    for model_name in args.models:
+        setup, name = EXPORTS[model_name]
+        # Always export and compare the fp32 PyTorch model
+        model, processor, _ = setup(quantize=False)
+
+        if not args.check_only:
+            # Trace with two questions so batch and sequence sizes are not baked in as constants
+            onnx_path, _ = exportVilt(model, encode(processor, model, questions[:2], image), name, args.opset)
+            print(f"Exported {model_name} to {onnx_path}")
+
+        onnx_model = OnnxViltModel(*onnxPaths(name))
+
+        # Check a single question and the whole question set, which differ in batch and sequence length
+        for batch in ([questions[0]], questions):
+            max_difference, agreement = compareVilt(model, onnx_model, encode(processor, model, batch, image))
+            ok = max_difference <= args.tolerance and agreement == 1.0
+            passed = passed and ok
+            print(f"  {model_name:<16} batch {len(batch):>3}   max |logit difference| {max_difference:.2e}"
+                  f"   top-1 agreement {agreement:6.1%}   {'ok' if ok else 'MISMATCH'}")
+
+    sys.exit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
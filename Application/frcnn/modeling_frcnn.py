@@ -22,6 +22,7 @@ import math
 import os
 from abc import ABCMeta, abstractmethod
 from collections import OrderedDict, namedtuple
+from contextlib import nullcontext
 from typing import Dict, List, Tuple
 
 import numpy as np
@@ -1877,29 +1878,50 @@ class GeneralizedRCNN(nn.Module):
             ROI Heads runs in 7-8 seconds on CPU.
         '''
         
+        # Optional reduced precision (autocast_dtype, e.g. torch.bfloat16) for the convolution-heavy backbone and
+        # ROI head. Their outputs are cast back to fp32, so proposals, box decoding and the returned values stay fp32.
+        autocast_dtype = kwargs.get("autocast_dtype", None)
+        autocast = torch.autocast(images.device.type, dtype=autocast_dtype, enabled=autocast_dtype is not None)
+
+        # Optional callable (cancel_check) run between the stages below; it raises to abandon a cancelled request
+        cancel_check = kwargs.get("cancel_check", None) or (lambda: None)
+
+        # Optional callable (stage_timer) taking a stage name and returning a context manager that times the stage
+        stage_timer = kwargs.get("stage_timer", None) or (lambda name: nullcontext())
+
         # run images through backbone
         original_sizes = image_shapes * scales_yx
-        features = self.backbone(images)
+        with stage_timer("FRCNN backbone"):
+            with autocast:
+                features = self.backbone(images)
+            features = {name: feature.float() for name, feature in features.items()}
+        cancel_check()
 
         # generate proposals if none are available
         if proposals is None:
-            proposal_boxes, _ = self.proposal_generator(images, image_shapes, features, gt_boxes)
+            with stage_timer("FRCNN proposals (RPN)"):
+                proposal_boxes, _ = self.proposal_generator(images, image_shapes, features, gt_boxes)
         else:
             assert proposals is not None
+        cancel_check()
 
         # pool object features from either gt_boxes, or from proposals
-        obj_logits, attr_logits, box_deltas, feature_pooled = self.roi_heads(features, proposal_boxes, gt_boxes)
+        with stage_timer("FRCNN ROI heads"), autocast:
+            roi_outputs = self.roi_heads(features, proposal_boxes, gt_boxes)
+        obj_logits, attr_logits, box_deltas, feature_pooled = (output.float() for output in roi_outputs)
+        cancel_check()
 
         # prepare FRCNN Outputs and select top proposals
-        boxes, classes, class_probs, attrs, attr_probs, roi_features = self.roi_outputs(
-            obj_logits=obj_logits,
-            attr_logits=attr_logits,
-            box_deltas=box_deltas,
-            pred_boxes=proposal_boxes,
-            features=feature_pooled,
-            sizes=image_shapes,
-            scales=scales_yx,
-        )
+        with stage_timer("FRCNN box decoding and NMS"):
+            boxes, classes, class_probs, attrs, attr_probs, roi_features = self.roi_outputs(
+                obj_logits=obj_logits,
+                attr_logits=attr_logits,
+                box_deltas=box_deltas,
+                pred_boxes=proposal_boxes,
+                features=feature_pooled,
+                sizes=image_shapes,
+                scales=scales_yx,
+            )
 
         # will we pad???
         subset_kwargs = {
@@ -24,7 +24,7 @@ from PIL import Image
 from torch import nn
 
 from transformers.image_utils import PILImageResampling
-from .utils import img_tensorize
+from .utils import img_from_array, img_tensorize
 
 
 class ResizeShortestEdge:
@@ -98,16 +98,25 @@ class Preprocess:
 
         return torch.stack(images), torch.tensor(image_sizes)
 
-    def __call__(self, images, single_image=False):
+    def __call__(self, images, single_image=False, array_format=None):
+        """
+        images: a path/URL, an HWC numpy array or torch tensor, or a list of those.
+        array_format: channel order ("RGB"/"BGR") of in-memory frames. When it differs from
+            cfg.INPUT.FORMAT the channels are swapped; None means frames already match cfg.INPUT.FORMAT.
+        """
         with torch.no_grad():
             if not isinstance(images, list):
                 images = [images]
             if single_image:
                 assert len(images) == 1
             for i in range(len(images)):
-                if isinstance(images[i], torch.Tensor):
-                    images.insert(i, images.pop(i).to(self.device).float())
-                elif not isinstance(images[i], torch.Tensor):
+                if isinstance(images[i], (torch.Tensor, np.ndarray)):
+                    images.insert(
+                        i,
+                        img_from_array(images.pop(i), input_format=self.input_format, array_format=array_format)
+                        .to(self.device),
+                    )
+                else:
                     images.insert(
                         i,
                         torch.as_tensor(img_tensorize(images.pop(i), input_format=self.input_format))
@@ -25,6 +25,7 @@ import shutil
 import sys
 import tarfile
 import tempfile
+import threading
 from collections import OrderedDict
 from contextlib import contextmanager
 from functools import partial
@@ -76,6 +77,16 @@ TRANSFORMERS_CACHE = os.getenv("TRANSFORMERS_CACHE", PYTORCH_TRANSFORMERS_CACHE)
 WEIGHTS_NAME = "pytorch_model.bin"
 CONFIG_NAME = "config.yaml"
 
+# Label vocabularies used by the FRCNN box visualizer and the LXMERT answer head.
+# Bump VOCAB_VERSION whenever the upstream files change so stale caches are ignored.
+VOCAB_VERSION = "vg-1600-400-20_vqa-3129"
+VOCAB_CACHE = os.path.join(TRANSFORMERS_CACHE, "vocab", VOCAB_VERSION)
+VOCAB_SOURCES = {
+    "objects": "https://raw.githubusercontent.com/airsplay/py-bottom-up-attention/master/demo/data/genome/1600-400-20/objects_vocab.txt",
+    "attributes": "https://raw.githubusercontent.com/airsplay/py-bottom-up-attention/master/demo/data/genome/1600-400-20/attributes_vocab.txt",
+    "answers": "https://raw.githubusercontent.com/airsplay/lxmert/master/data/vqa/trainval_label2ans.json",
+}
+
 
 def load_labels(objs=OBJECTS, attrs=ATTRIBUTES):
     vg_classes = []
@@ -495,26 +506,111 @@ def cached_path(
     return output_path
 
 
+def parse_vocab(text):
+    """
+    Safely parse a label vocabulary into an indexed tuple of labels.
+
+    Accepts a JSON list (label2ans), a JSON dict mapping labels to indices (ans2label) or plain text
+    with one label per line (objects/attributes vocab). Nothing is ever passed to eval().
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return tuple(line.strip() for line in text.strip().split("\n"))
+
+    if isinstance(data, dict):
+        labels = [None] * len(data)
+        for label, index in data.items():
+            labels[int(index)] = label
+        data = labels
+    if not isinstance(data, list):
+        raise ValueError("unsupported vocabulary format: {}".format(type(data).__name__))
+    return tuple(data)
+
+
 def get_data(query, delim=","):
     assert isinstance(query, str)
     if os.path.isfile(query):
-        with open(query) as f:
-            data = eval(f.read())
+        with open(query, encoding="utf-8") as f:
+            data = parse_vocab(f.read())
     else:
         req = requests.get(query)
-        try:
-            data = requests.json()
-        except Exception:
-            data = req.content.decode()
-            assert data is not None, "could not connect"
-            try:
-                data = eval(data)
-            except Exception:
-                data = data.split("\n")
+        data = req.content.decode()
+        assert data is not None, "could not connect"
+        data = parse_vocab(data)
         req.close()
     return data
 
 
+class VocabularyStore:
+    """
+    Loads the object, attribute and answer vocabularies once and keeps them in memory.
+
+    Lookup order for each vocabulary:
+        1. the versioned local cache (VOCAB_CACHE)
+        2. the upstream URL, which then populates the cache
+    Machines without network access need a prefetched copy (see prefetch.py in the Application folder).
+    """
+
+    def __init__(self, sources=VOCAB_SOURCES, cache_dir=VOCAB_CACHE, timeout=10):
+        self.sources = sources
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self._vocabs = {}
+        # LXMERT models may be set up on several threads at once
+        self._lock = threading.Lock()
+
+    def load(self, *names):
+        """Loads the named vocabularies (all of them by default), each only once even when called from several threads"""
+        with self._lock:
+            for name in names or self.sources:
+                if name not in self._vocabs:
+                    self._vocabs[name] = self._load_one(name)
+        return self
+
+    def _load_one(self, name):
+        url = self.sources[name]
+        cache_path = os.path.join(self.cache_dir, url.split("/")[-1])
+
+        if os.path.isfile(cache_path):
+            return get_data(cache_path)
+
+        try:
+            response = requests.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            text = response.content.decode()
+            vocab = parse_vocab(text)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=self.cache_dir, delete=False, encoding="utf-8") as temp_file:
+                temp_file.write(text)
+            os.replace(temp_file.name, cache_path)
+            return vocab
+        except (requests.exceptions.RequestException, OSError, ValueError):
+            pass
+
+        raise EnvironmentError(
+            f"Could not load the {name} vocabulary: not cached at {cache_path} and could not download {url}."
+            " Run prefetch.py on a connected machine to make an offline copy."
+        )
+
+    def __getitem__(self, name):
+        if name not in self._vocabs:
+            self.load(name)
+        return self._vocabs[name]
+
+    @property
+    def objects(self):
+        return self["objects"]
+
+    @property
+    def attributes(self):
+        return self["attributes"]
+
+    @property
+    def answers(self):
+        return self["answers"]
+
+
 def get_image_from_url(url):
     response = requests.get(url)
     img = np.array(Image.open(BytesIO(response.content)))
@@ -556,5 +652,26 @@ def img_tensorize(im, input_format="RGB"):
     return img
 
 
+def img_from_array(img, input_format="RGB", array_format="RGB"):
+    """
+    Convert an in-memory HWC frame (numpy array or torch tensor) to a float32 torch tensor in input_format.
+
+    The channel swap and the float conversion share a single copy; a float32 frame that is already in
+    input_format is wrapped without copying.
+    """
+    swap = array_format is not None and array_format != input_format
+    if isinstance(img, torch.Tensor):
+        if swap:
+            img = img.flip(-1)
+        return img.float()
+
+    assert isinstance(img, np.ndarray) and img.ndim == 3, "expected an HWC image array"
+    if swap:
+        img = img[:, :, ::-1]
+    if img.dtype != np.float32 or not img.flags["C_CONTIGUOUS"]:
+        img = np.ascontiguousarray(img, dtype=np.float32)
+    return torch.from_numpy(img)
+
+
 def chunk(images, batch=1):
     return (images[i : i + batch] for i in range(0, len(images), batch))
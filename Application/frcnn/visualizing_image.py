@@ -48,10 +48,13 @@ class SingleImageViz:
         pad=0.7,
     ):
         """
-        img: an RGB image of shape (H, W, 3).
+        img: an RGB image of shape (H, W, 3), as a path, numpy array or torch tensor.
+        Arrays are used in place, without a copy, when they are already uint8.
         """
         if isinstance(img, torch.Tensor):
-            img = img.numpy().astype("np.uint8")
+            img = img.detach().cpu().numpy()
+        if isinstance(img, np.ndarray) and img.dtype != np.uint8:
+            img = img.astype(np.uint8)
         if isinstance(img, str):
             img = img_tensorize(img)
         assert isinstance(img, np.ndarray)
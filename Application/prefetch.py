@@ -0,0 +1,82 @@
+# This Python file uses the following encoding: utf-8
+# Downloads the pretrained models, tokenizers, FRCNN detector and LXMERT vocabularies into the artifacts folder and
+# records them (with their checksums) in its manifest.json. Run it on a connected machine from the Application folder,
+# then copy the artifacts folder to the offline machine:
+#   python prefetch.py                        fetch every artifact
+#   python prefetch.py --artifacts unc-nlp/frcnn-vg-finetuned
+#   python prefetch.py --verify               only check the local copies against the manifest checksums
+# The folder is set by "artifacts": {"dir": ...} in DroneVQASettings.json.
+
+import argparse
+import os
+import shutil
+import sys
+import time
+
+from transformers import LxmertTokenizer, ViltForQuestionAnswering, ViltProcessor
+
+from ArtifactUtils import artifactsDir, recordArtifact, verifyArtifacts
+from frcnn.utils import CONFIG_NAME, WEIGHTS_NAME, VocabularyStore, cached_path, hf_bucket_url
+from ModelPredictionUtils import (VILT_HUB_ID, LXMERT_TOKENIZER_ID, LXMERT_HUB_ID, FRCNN_HUB_ID, VOCABULARIES_ID,
+                                  LxmertForQuestionAnswering)
+
+def saveViltProcessor(model_id, directory):
+    ViltProcessor.from_pretrained(model_id).save_pretrained(directory)
+
+def saveVilt(model_id, directory):
+    saveViltProcessor(model_id, directory)
+    ViltForQuestionAnswering.from_pretrained(model_id).save_pretrained(directory)
+
+def saveLxmertTokenizer(model_id, directory):
+    LxmertTokenizer.from_pretrained(model_id).save_pretrained(directory)
+
+def saveLxmert(model_id, directory):
+    LxmertForQuestionAnswering.from_pretrained(model_id).save_pretrained(directory)
+
+def saveFrcnn(model_id, directory):
+    '''The FRCNN port has no save_pretrained; its config and checkpoint are copied as downloaded'''
+    os.makedirs(directory, exist_ok=True)
+    for filename, use_cdn in ((CONFIG_NAME, False), (WEIGHTS_NAME, True)):
+        shutil.copyfile(cached_path(hf_bucket_url(model_id, filename=filename, use_cdn=use_cdn)),
+                        os.path.join(directory, filename))
+
+def saveVocabularies(_, directory):
+    '''Downloads the vocabularies straight into directory, which VocabularyStore then uses as its cache'''
+    VocabularyStore(cache_dir=directory).load()
+
+# Artifact id -> function saving it into a folder. Ids match the ones ModelPredictionUtils resolves.
+ARTIFACTS = {
+    VILT_HUB_ID: saveVilt,
+    LXMERT_TOKENIZER_ID: saveLxmertTokenizer,
+    LXMERT_HUB_ID: saveLxmert,
+    FRCNN_HUB_ID: saveFrcnn,
+    VOCABULARIES_ID: saveVocabularies,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Download model artifacts for offline use")
+    parser.add_argument("--artifacts", nargs="+", default=list(ARTIFACTS), choices=list(ARTIFACTS),
+                        help="artifacts to fetch")
+    parser.add_argument("--verify", action="store_true", help="only check the local copies against the manifest")
+    args = parser.parse_args()
+
+    if not args.verify:
+        for model_id in args.artifacts:
+            directory = artifactsDir() / model_id.replace("/", "--")
+            # Start from an empty folder so files left from an older version are not recorded
+            shutil.rmtree(directory, ignore_errors=True)
+            start = time.perf_counter()
+            ARTIFACTS[model_id](model_id, str(directory))
+            entry = recordArtifact(model_id, directory)
+            size_mb = sum(file_entry["size"] for file_entry in entry["files"].values()) / 2**20
+            print(f"Fetched {model_id:<32} {len(entry['files'])} files, {size_mb:.1f} MB "
+                  f"in {time.perf_counter() - start:.1f} s -> {directory}")
+
+    problems = verifyArtifacts()
+    for problem in problems:
+        print(problem)
+    print("All artifacts match the manifest" if not problems else f"{len(problems)} problems found")
+    sys.exit(0 if not problems else 1)
+
+if __name__ == "__main__":
+    main()
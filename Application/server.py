@@ -0,0 +1,56 @@
+# This Python file uses the following encoding: utf-8
+# Standalone local VQA inference server, so tools other than the GUI can use the models. Run from the Application
+# folder:
+#   python server.py --port 8765
+# The API is described in ServerUtils.py. Set "server": {"enabled": true} in DroneVQASettings.json to have the GUI
+# send its questions here instead of loading the models itself.
+
+import argparse
+from urllib.parse import urlparse
+
+from ModelPredictionUtils import MODEL_SETUPS, warmUpModel
+from ModelRegistry import ModelRegistry
+from ServerUtils import BatchScheduler, ResultStore, VQAServer
+from SettingsUtils import settings
+from ThreadingUtils import applyThreadingProfile
+from TimingUtils import metrics_log
+
+def main():
+    server_settings = settings["server"]
+    default_url = urlparse(server_settings["url"])
+
+    parser = argparse.ArgumentParser(description="DroneVQA local inference server")
+    parser.add_argument("--host", default=default_url.hostname, help="address to listen on (keep it local)")
+    parser.add_argument("--port", type=int, default=default_url.port, help="port to listen on")
+    parser.add_argument("--window-ms", type=float, default=server_settings["batch_window_ms"],
+                        help="how long to wait for concurrent requests to batch together")
+    parser.add_argument("--max-batch", type=int, default=server_settings["max_batch"],
+                        help="most questions in one batched forward")
+    parser.add_argument("--preload", nargs="*", default=settings["models"]["preload"], help="models to load at startup")
+    args = parser.parse_args()
+
+    # The GUI may be writing the main metrics file; a rolling file cannot be shared between processes
+    metrics_log.path = settings["metrics"]["server_file"]
+    metrics_log.enabled = bool(metrics_log.path)
+
+    applyThreadingProfile(settings["threading"])
+
+    modelRegistry = ModelRegistry(MODEL_SETUPS, budget_mb=settings["models"]["ram_budget_mb"])
+    for name in args.preload:
+        modelRegistry.get(name)
+        if settings["models"]["warm_up"]:
+            print(f"Warmed up {name} model in {warmUpModel(name, modelRegistry.get(name)):.1f} s")
+
+    scheduler = BatchScheduler(modelRegistry, window_ms=args.window_ms, max_batch=args.max_batch)
+    server = VQAServer((args.host, args.port), scheduler, ResultStore())
+    print(f"DroneVQA server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        modelRegistry.shutdown()
+
+if __name__ == "__main__":
+    main()
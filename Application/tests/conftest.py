@@ -0,0 +1,14 @@
+# This Python file uses the following encoding: utf-8
+# The application modules use flat imports and paths relative to the Application folder, so tests run from there.
+
+import sys
+from pathlib import Path
+
+import pytest
+
+APPLICATION_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(APPLICATION_DIR))
+
+@pytest.fixture(autouse=True)
+def applicationDir(monkeypatch):
+    monkeypatch.chdir(APPLICATION_DIR)
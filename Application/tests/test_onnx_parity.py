@@ -0,0 +1,33 @@
+# This Python file uses the following encoding: utf-8
+# Parity of the ViLT ONNX exports (export_onnx.py) with PyTorch. Skipped when onnxruntime is not installed or a model
+# has not been exported.
+
+import pytest
+
+pytest.importorskip("onnxruntime")
+
+import numpy as np
+
+# Same limit as export_onnx.py --tolerance
+TOLERANCE = 1e-3
+QUESTIONS = ["How many cars are there?", "What color is the building?", "Is there a person in the image?"]
+
+@pytest.mark.parametrize("model_name", ["ViLT", "ViLT Fine-Tuned"])
+def test_onnx_logits_match_pytorch(model_name):
+    from export_onnx import EXPORTS, encode
+    from OnnxUtils import OnnxViltModel, compareVilt, onnxPaths
+
+    setup, name = EXPORTS[model_name]
+    paths = onnxPaths(name)
+    if not all(path.is_file() for path in paths):
+        pytest.skip(f"{model_name} has not been exported (run export_onnx.py)")
+
+    model, processor, _ = setup(quantize=False)
+    onnx_model = OnnxViltModel(*paths)
+    image = np.random.default_rng(0).integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+
+    # A single question and a padded batch, which differ in batch and sequence length
+    for batch in (QUESTIONS[:1], QUESTIONS):
+        max_difference, agreement = compareVilt(model, onnx_model, encode(processor, model, batch, image))
+        assert max_difference <= TOLERANCE
+        assert agreement == 1.0
@@ -3,9 +3,18 @@
 
 from PySide6.QtCore import QRunnable, Slot, Signal, QObject, QThreadPool
 
+import inspect
 import sys
 import traceback
 
+from CancellationUtils import InferenceCancelled
+
+def _acceptsProgressCallback(fn):
+    try:
+        return 'progress_callback' in inspect.signature(fn).parameters
+    except (TypeError, ValueError): # Some built-ins have no signature
+        return False
+
 class WorkerSignals(QObject):
     '''
     Defines the signals available from a running worker thread.
@@ -22,13 +31,13 @@ class WorkerSignals(QObject):
         object data returned from processing, anything
 
     progress
-        int indicating % progress
+        object partial result emitted by the runner while it works (e.g. a prediction stage)
 
     '''
     finished = Signal()
     error = Signal(tuple)
     result = Signal(object)
-    progress = Signal(int)
+    progress = Signal(object)
 
 class Worker(QRunnable):
     '''
@@ -53,8 +62,9 @@ class Worker(QRunnable):
         self.kwargs = kwargs
         self.signals = WorkerSignals()
 
-        # Add the callback to our kwargs
-        # self.kwargs['progress_callback'] = self.signals.progress
+        # Add the callback to our kwargs when the runner accepts one
+        if _acceptsProgressCallback(fn):
+            self.kwargs['progress_callback'] = self.signals.progress.emit
 
     @Slot()
     def run(self):
@@ -65,6 +75,8 @@ class Worker(QRunnable):
         # Retrieve args/kwargs here; and fire processing using them
         try:
             result = self.fn(*self.args, **self.kwargs)
+        except InferenceCancelled:
+            pass # A newer request superseded this one; nobody is waiting for its result
         except:
             traceback.print_exc()
             exctype, value = sys.exc_info()[:2]